@@ -6,7 +6,6 @@ import google_drive
 import traceback
 import json
 from config import GOOGLE_DRIVE_FOLDER_ID
-from types import SimpleNamespace # N'oubliez pas cet import
 
 TEST_MODE = False
 
@@ -46,32 +45,20 @@ def main_orchestrator():
                     "annee_scolaire": {"annee_standardisee": None, "source_tags": []},
                     "niveaux_map": {}
                 }
-                position_mapping_complet = {}
-                
                 print(f"  -> Starting page-by-page analysis for {len(doc_obj.pages)} page(s)...")
 
-                for page_num, page_obj in enumerate(doc_obj.pages, 1):
+                # Un seul parcours du document : les tags sont uniques sur toutes les pages.
+                document_tague = doc_processor.DocumentTague(doc_obj)
+                position_mapping_complet = document_tague.position_mapping
+
+                for page_num in document_tague.numeros_pages():
                     print(f"    -> Analyzing page {page_num}/{len(doc_obj.pages)}...")
-                    
-                    # --- DÉBUT DE LA CORRECTION FINALE ---
-                    # Nous créons un objet qui imite le document original.
-                    # Il ne contient qu'une seule page, mais la référence de texte
-                    # doit être le texte COMPLET du document original pour que les
-                    # "text_anchors" de la page fonctionnent.
-                    page_doc_obj = SimpleNamespace(
-                        pages=[page_obj],
-                        text=doc_obj.text  # <- Utiliser le texte du document complet
-                    )
-                    
-                    tagged_text_page, position_mapping_page = doc_processor.preprocess_document_for_ia(page_doc_obj)
-                    # --- FIN DE LA CORRECTION FINALE ---
+                    tagged_text_page = document_tague.texte_page(page_num)
 
                     if not tagged_text_page.strip():
                         print(f"    -> Page {page_num} is empty, skipping.")
                         continue
 
-                    position_mapping_complet.update(position_mapping_page)
-                    
                     print(f"    -> Launching AI analysis for page {page_num}...")
                     donnees_page = ai_processor.generer_json_pour_insertion_avec_positions(db_conn, fichier, tagged_text_page)
 
@@ -1,60 +1,244 @@
 # ai_processor.py
+import asyncio
+import hashlib
 import json
-import requests
+import httpx
 import time
 import database
 import re
-from config import GEMINI_API_KEY
+import telemetrie
+import resolveur_standardisation
+from email.utils import parsedate_to_datetime
+from disk_cache import DiskCache
+from limiteur_gemini import LimiteurGemini
+from client_gemini import MoteurGemini
+from config import GEMINI_API_KEY, LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_MB, LLM_CACHE_TTL_HOURS
+from config import STANDARDISATION_SHORTLIST_K, STANDARDISATION_BATCH_SIZE
+from config import GEMINI_RPM, GEMINI_TPM, GEMINI_RATE_HEADROOM, GEMINI_MAX_CONCURRENCY, GEMINI_RATE_STATE_FILE, GEMINI_BACKOFF_MAX_SECONDS
+from config import GEMINI_DEADLINE_SECONDS
 
 if not GEMINI_API_KEY: raise ValueError("The GEMINI_API_KEY environment variable is missing.")
 
 # --- Utility Functions and Prompts ---
+words_to_remove = ['manuels', 'fournitures', 'liste', 'des', 'pour', 'la', 'classe', 'de', 'et', 'list', 'of', 'supplies', 'for', 'the', 'class']
+_annee_scolaire_regex = re.compile(r'\d{4}[-/]\d{4}')
+_words_to_remove_regex = re.compile(r'\b(' + '|'.join(words_to_remove) + r')\b', re.IGNORECASE)
+_separateurs_regex = re.compile(r'[\s:-]+')
+
 def clean_niveau_brut(text: str) -> str:
     if not isinstance(text, str): return ""
-    text = re.sub(r'\d{4}[-/]\d{4}', '', text)
-    words_to_remove = ['manuels', 'fournitures', 'liste', 'des', 'pour', 'la', 'classe', 'de', 'et', 'list', 'of', 'supplies', 'for', 'the', 'class']
-    regex = r'\b(' + '|'.join(words_to_remove) + r')\b'
-    text = re.sub(regex, '', text, flags=re.IGNORECASE)
-    return re.sub(r'[\s:-]+', ' ', text).strip()
+    text = _annee_scolaire_regex.sub('', text)
+    text = _words_to_remove_regex.sub('', text)
+    return _separateurs_regex.sub(' ', text).strip()
+
+# --- LLM response cache ---
+# Identical requests (same model, instructions and text) are answered from disk, within a run
+# and across runs. Only successful responses are stored.
+llm_cache = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_MB * 1024 * 1024, ttl=LLM_CACHE_TTL_HOURS * 3600, nom="LLM cache") if LLM_CACHE_ENABLED else None
+llm_cache_bypass = False
+
+def configurer_cache_llm(bypass: bool):
+    """Enables or bypasses the LLM response cache for the whole process (e.g. --no-llm-cache)."""
+    global llm_cache_bypass
+    llm_cache_bypass = bypass
+
+# Every Gemini call of the process (pages, prompts, pipeline workers) goes through this limiter.
+limiteur = LimiteurGemini(GEMINI_RPM, GEMINI_TPM, GEMINI_RATE_HEADROOM, GEMINI_MAX_CONCURRENCY,
+                          GEMINI_RATE_STATE_FILE, GEMINI_BACKOFF_MAX_SECONDS)
+# Asynchronous HTTP engine (pooled HTTP/2 connections) carrying every Gemini request of the process.
+moteur = MoteurGemini()
+
+def _indication_reessai(response):
+    """Délai de réessai suggéré par le serveur (en-tête Retry-After ou RetryInfo de l'erreur), en secondes, ou None."""
+    if response is None: return None
+    entete = response.headers.get('Retry-After')
+    if entete:
+        try:
+            return max(0.0, float(entete))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(entete).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    try:
+        for detail in response.json().get('error', {}).get('details', []):
+            if detail.get('@type', '').endswith('RetryInfo'):
+                return float(detail['retryDelay'].rstrip('s'))
+    except (ValueError, KeyError, AttributeError):
+        pass
+    return None
+
+def _cle_cache_llm(model, instructions, text_to_analyze):
+    def h(texte): return hashlib.sha256(texte.encode('utf-8')).hexdigest()
+    return f"{model}:{h(instructions)}:{h(str(text_to_analyze))}"
+
+async def call_gemini_detaille_async(instructions, text_to_analyze, model="gemini-1.5-pro", retries=3, delay=5, use_cache=True,
+                                     deadline=GEMINI_DEADLINE_SECONDS):
+    """Coroutine de call_gemini_detaille, exécutée sur la boucle du moteur HTTP (client_gemini).
+
+    `deadline` borne l'appel complet (attente du limiteur, tentatives et backoff), en secondes : au-delà,
+    la requête en vol est annulée et l'appel retourne data None. Annuler la tâche annule la requête.
+    """
+    try:
+        return await asyncio.wait_for(_appeler_gemini(instructions, text_to_analyze, model, retries, delay, use_cache), deadline)
+    except asyncio.TimeoutError:
+        print(f"    -> WARNING: Gemini call cancelled after its {deadline:.0f}s deadline.")
+        resultat = {"data": None, "usage": {"prompt_tokens": 0, "output_tokens": 0}, "latency_ms": int(deadline * 1000),
+                    "attempts": retries, "cached": False}
+        telemetrie.enregistrer_appel_llm(resultat)
+        return resultat
+
+async def _appeler_gemini(instructions, text_to_analyze, model, retries, delay, use_cache):
+    cache = llm_cache if use_cache and not llm_cache_bypass else None
+    cle_cache = _cle_cache_llm(model, instructions, text_to_analyze) if cache else None
+    if cache:
+        en_cache = await asyncio.to_thread(cache.get, cle_cache)
+        if en_cache is not None:
+            resultat = {"data": json.loads(en_cache), "usage": {"prompt_tokens": 0, "output_tokens": 0},
+                        "latency_ms": 0, "attempts": 0, "cached": True}
+            telemetrie.enregistrer_appel_llm(resultat)
+            return resultat
 
-def call_gemini(instructions, text_to_analyze, model="gemini-1.5-pro", retries=3, delay=5):
     url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
     payload = {"contents": [{"parts": [{"text": f"{instructions}\n\n--- TEXT TO ANALYZE ---\n\n{text_to_analyze}"}]}], "generationConfig": {"responseMimeType": "application/json"}}
+    resultat = {"data": None, "usage": {"prompt_tokens": 0, "output_tokens": 0}, "latency_ms": 0, "attempts": 0, "cached": False}
+    debut = time.perf_counter()
+    jetons_estimes = limiteur.estimer_tokens(payload["contents"][0]["parts"][0]["text"])
     for attempt in range(retries):
+        resultat["attempts"] = attempt + 1
+        response, usage_appel, limite, indication = None, None, False, None
+        await limiteur.acquerir_async(jetons_estimes)
         try:
-            response = requests.post(url, headers={"Content-Type": "application/json"}, json=payload, timeout=180)
+            response = await moteur.post(url, payload)
             response.raise_for_status()
-            response_text = response.json()['candidates'][0]['content']['parts'][0]['text']
+            response_json = response.json()
+            usage = response_json.get('usageMetadata', {})
+            usage_appel = {"prompt_tokens": usage.get('promptTokenCount', 0), "output_tokens": usage.get('candidatesTokenCount', 0)}
+            resultat["usage"]["prompt_tokens"] += usage_appel["prompt_tokens"]
+            resultat["usage"]["output_tokens"] += usage_appel["output_tokens"]
+            response_text = response_json['candidates'][0]['content']['parts'][0]['text']
             start = response_text.find(next(filter(lambda c: c in '[{', response_text), ''))
             end = response_text.rfind(']' if response_text[start] == '[' else '}') + 1
-            return json.loads(response_text[start:end])
-        except (requests.exceptions.RequestException, KeyError, json.JSONDecodeError, IndexError, StopIteration) as e:
+            resultat["data"] = json.loads(response_text[start:end])
+            break
+        except (httpx.HTTPError, KeyError, json.JSONDecodeError, IndexError, StopIteration) as e:
             print(f"    -> WARNING: Gemini call failed (attempt {attempt + 1}/{retries}): {e}")
-            if attempt < retries - 1: time.sleep(delay * (attempt + 1))
-    return None
+            # 429 (quota) et 503 (surcharge) : le limiteur ralentit tous les appels, pas seulement celui-ci.
+            limite = response is not None and response.status_code in (429, 503)
+            indication = _indication_reessai(response) if limite else None
+        finally:
+            await limiteur.terminer_async(jetons_estimes, usage_appel, limite, indication)
+        if attempt < retries - 1: await asyncio.sleep(limiteur.delai_reessai(attempt, delay, indication))
+    resultat["latency_ms"] = int((time.perf_counter() - debut) * 1000)
+    if cache and resultat["data"] is not None:
+        await asyncio.to_thread(cache.set, cle_cache, json.dumps(resultat["data"], ensure_ascii=False).encode('utf-8'))
+    telemetrie.enregistrer_appel_llm(resultat)
+    return resultat
+
+async def call_gemini_async(instructions, text_to_analyze, model="gemini-1.5-pro", retries=3, delay=5, use_cache=True):
+    """Comme call_gemini, depuis n'importe quelle boucle asyncio (par exemple pour des centaines d'appels en vol)."""
+    return (await moteur.attendre(call_gemini_detaille_async(instructions, text_to_analyze, model, retries, delay, use_cache)))["data"]
+
+def call_gemini_detaille(instructions, text_to_analyze, model="gemini-1.5-pro", retries=3, delay=5, use_cache=True):
+    """Comme call_gemini, mais retourne aussi l'usage en tokens et la latence cumulée.
+
+    Retourne {"data": <json ou None>, "usage": {"prompt_tokens", "output_tokens"}, "latency_ms", "attempts", "cached"}.
+    Façade synchrone : l'appel s'exécute sur le moteur HTTP asynchrone, le thread appelant attend son résultat.
+    """
+    return moteur.executer(call_gemini_detaille_async(instructions, text_to_analyze, model, retries, delay, use_cache))
+
+def call_gemini(instructions, text_to_analyze, model="gemini-1.5-pro", retries=3, delay=5, use_cache=True):
+    return call_gemini_detaille(instructions, text_to_analyze, model, retries, delay, use_cache)["data"]
 
-def _standardise_entite(conn, valeur_brute: str, entity_type: str, knowledge_base: list, standard_choices: list):
-    if not valeur_brute or not isinstance(valeur_brute, str): return None
+def _valeur_propre(valeur_brute: str, entity_type: str):
     valeur_nettoyee = clean_niveau_brut(valeur_brute) if entity_type == 'niveaux' else valeur_brute
     if entity_type == 'niveaux': print(f"     -> Cleaning grade level: '{valeur_brute}' -> '{valeur_nettoyee}'")
-    valeur_propre = ' '.join(valeur_nettoyee.lower().strip().split())
-    if not valeur_propre: return valeur_brute
-    for entry in knowledge_base:
-        if entry['valeur_brute'] == valeur_propre:
-            print(f"     -> Direct match for '{valeur_propre}': '{entry['nom_standardise']}'")
-            return entry['nom_standardise']
-    print(f"     -> No direct match for '{valeur_propre}'. Calling AI...")
-    text_for_ai = (f"KNOWLEDGE BASE:\n{json.dumps(knowledge_base, indent=2, ensure_ascii=False)}\n\nALLOWED CHOICES LIST:\n{json.dumps(standard_choices, ensure_ascii=False)}\n\nNEW RAW TERM:\n\"{valeur_propre}\"")
+    return ' '.join(valeur_nettoyee.lower().strip().split())
+
+def _choix_pour_prompt(base, valeurs_propres):
+    """Choices and example rules sent to Gemini for these terms: the union of their shortlists (the k lexically
+    closest standard names each, not the whole table), or everything for a table of at most k names.
+    Returns (choices, rules, {term: shortlist} or None)."""
+    k = STANDARDISATION_SHORTLIST_K
+    if not k or len(base.choix) <= k:
+        return base.choix, base.knowledge_base, None
+    shortlists = {valeur: base.resolveur.shortlist(valeur, k) for valeur in valeurs_propres}
+    choices = list(dict.fromkeys(nom for shortlist in shortlists.values() for nom in shortlist))
+    print(f"     -> Shortlist: {len(choices)}/{len(base.choix)} choice(s) sent.")
+    return choices, base.resolveur.exemples(choices), shortlists
+
+def _enregistrer_rang(shortlists, valeur_propre, ai_choice):
+    shortlist = shortlists.get(valeur_propre) if shortlists is not None else None
+    if shortlists is None:
+        resolveur_standardisation.statistiques_shortlist.enregistrer(complet=True)
+    else:
+        resolveur_standardisation.statistiques_shortlist.enregistrer(shortlist.index(ai_choice) + 1 if ai_choice in shortlist else None)
+
+def _standardise_entite(conn, valeur_brute: str, base, differer=False):
+    """Returns (standard name, pending). With `differer`, a term without a local match is kept as is
+    and flagged as pending, for standardiser_lot at the end of the run, instead of calling Gemini."""
+    entity_type, knowledge_base = base.entity_type, base.knowledge_base
+    if not valeur_brute or not isinstance(valeur_brute, str): return None, False
+    valeur_propre = _valeur_propre(valeur_brute, entity_type)
+    if not valeur_propre: return valeur_brute, False
+    # Exact, normalised (accents, ordinals) or close match in the knowledge base; Gemini only below the threshold.
+    nom_standardise, score, methode = base.resolveur.resoudre(valeur_propre)
+    if methode == "exact":
+        print(f"     -> Direct match for '{valeur_propre}': '{nom_standardise}'")
+        return nom_standardise, False
+    if nom_standardise:
+        print(f"     -> {methode.capitalize()} match for '{valeur_propre}': '{nom_standardise}' (score {score:.2f})")
+        database.learn_new_standardisation(conn, valeur_brute, nom_standardise, entity_type)
+        return nom_standardise, False
+    if differer:
+        print(f"     -> No match for '{valeur_propre}' (best score {score:.2f}). Deferred to batch standardisation.")
+        return valeur_brute, True
+    print(f"     -> No match for '{valeur_propre}' (best score {score:.2f}). Calling AI...")
+    choices, exemples, shortlists = _choix_pour_prompt(base, [valeur_propre])
+    text_for_ai = (f"KNOWLEDGE BASE:\n{json.dumps(exemples, ensure_ascii=False)}\n\nALLOWED CHOICES LIST:\n{json.dumps(choices, ensure_ascii=False)}\n\nNEW RAW TERM:\n\"{valeur_propre}\"")
     ai_result = call_gemini(intelligent_standardize_prompt_constrained, text_for_ai)
     ai_choice = ai_result.get('nom_standardise') if ai_result else None
-    if ai_choice and ai_choice in standard_choices:
+    _enregistrer_rang(shortlists, valeur_propre, ai_choice)
+    if ai_choice and ai_choice in base.choix:
         print(f"     -> Gemini Pro deduced: '{ai_choice}'")
         database.learn_new_standardisation(conn, valeur_brute, ai_choice, entity_type)
-        return ai_choice
+        return ai_choice, False
     else:
         print(f"     -> Gemini Pro could not deduce. Using raw value.")
         database.learn_new_standardisation(conn, valeur_brute, valeur_brute, entity_type)
-        return valeur_brute
+        return valeur_brute, False
+
+def standardiser_lot(base, valeurs_brutes):
+    """Deferred standardisation: local resolution first (the rules may have changed since the terms were
+    inserted), then STANDARDISATION_BATCH_SIZE terms per Gemini request.
+
+    Returns {raw term: (standard name or None, to learn)}; terms of a failed request are left out.
+    """
+    resultats, valeurs_propres = {}, {}
+    for valeur_brute in valeurs_brutes:
+        valeur_propre = _valeur_propre(valeur_brute, base.entity_type)
+        nom_standardise, _, methode = base.resolveur.resoudre(valeur_propre) if valeur_propre else (None, 0.0, None)
+        if nom_standardise or not valeur_propre:
+            resultats[valeur_brute] = (nom_standardise, methode != "exact")
+        else:
+            valeurs_propres.setdefault(valeur_propre, []).append(valeur_brute)
+    termes = list(valeurs_propres)
+    for debut in range(0, len(termes), STANDARDISATION_BATCH_SIZE):
+        lot = termes[debut:debut + STANDARDISATION_BATCH_SIZE]
+        print(f"  -> Batch standardisation of {len(lot)} {base.entity_type} term(s)...")
+        choices, exemples, shortlists = _choix_pour_prompt(base, lot)
+        text_for_ai = (f"KNOWLEDGE BASE:\n{json.dumps(exemples, ensure_ascii=False)}\n\nALLOWED CHOICES LIST:\n{json.dumps(choices, ensure_ascii=False)}\n\nNEW RAW TERMS:\n{json.dumps(lot, ensure_ascii=False)}")
+        ai_result = call_gemini(batch_standardize_prompt_constrained, text_for_ai)
+        if not isinstance(ai_result, dict) or not isinstance(ai_result.get('correspondances'), dict):
+            print(f"    -> WARNING: batch standardisation failed, {len(lot)} term(s) left pending.")
+            continue
+        for terme in lot:
+            ai_choice = ai_result['correspondances'].get(terme)
+            ai_choice = ai_choice if isinstance(ai_choice, str) and ai_choice in base.choix else None
+            _enregistrer_rang(shortlists, terme, ai_choice)
+            for valeur_brute in valeurs_propres[terme]:
+                resultats[valeur_brute] = (ai_choice, True)
+    return resultats
 
 # --- PROMPTS (Translated to English) ---
 school_prompt_instructions = """
@@ -83,6 +267,8 @@ REQUIRED JSON OUTPUT FORMAT:
 
 intelligent_standardize_prompt_constrained = """MISSION: For a NEW RAW TERM, find the best match in the ALLOWED CHOICES LIST, using the KNOWLEDGE BASE as a reference. Your answer MUST be one of the exact values from the LIST. FORMAT: {"nom_standardise": "EXACT_CHOICE"} or {"nom_standardise": null}"""
 
+batch_standardize_prompt_constrained = """MISSION: For EACH term of the NEW RAW TERMS list, find the best match in the ALLOWED CHOICES LIST, using the KNOWLEDGE BASE as a reference. Each answer MUST be one of the exact values from the LIST, or null if no choice matches. Use each raw term, exactly as given, as a key. FORMAT: {"correspondances": {"RAW TERM": "EXACT_CHOICE", "OTHER RAW TERM": null}}"""
+
 extract_levels_and_books_prompt = """You are an expert in analyzing school supply lists, specializing in structured data extraction.
 MISSION: Analyze the entire document to comprehensively and structurally extract ALL grade levels and the precise details of each textbook.
 
@@ -154,25 +340,132 @@ UPDATED OUTPUT EXAMPLE:
 """
 
 
+combined_extraction_prompt = """You are an expert in analyzing school supply lists. In ONE pass over the text, extract the school name, the school year, and ALL grade levels with their textbooks.
+Each input line is prefixed with a tag like [E1]. You MUST include these tags in your response.
+
+RULES:
+1.  SCHOOL: Prioritize the TOP of the document and keywords like "Groupe Scolaire", "Lycée", "École", "Collège", "Institut", "Institution". If no clear name is found, use null.
+2.  YEAR: Look for a sequence like AAAA/BBBB or AAAA-BBBB, or phrases like "Rentrée 2025". If no year is found, use "Année Non Spécifiée ".
+3.  LEVELS AND TEXTBOOKS: Apply exactly the same rules as a dedicated extraction: segment the text by GRADE LEVEL TITLE (subject names are NOT grade levels), extract every book, textbook or workbook, IGNORE general supplies and vague titles. If only one grade level title exists, all books belong to it.
+    Each book MUST contain: `titre_livre` (never null, cleaned of mentions like "(student book)" or "طبعة جديدة"), `matiere_livre`, `maison_edition`, `annee_edition` (4 digits or null), `code_livre` (10/13-digit ISBN or null), `type_livre` ("Manuel" by default) and `source_tags`.
+
+REQUIRED JSON OUTPUT FORMAT:
+{
+  "ecole_unifie": "The Found School Name",
+  "ecole_source_tags": ["E1"],
+  "annee_scolaire": "2025/2026",
+  "annee_source_tags": ["E3"],
+  "niveaux": [
+    {
+      "niveau_brut": "3e année primaire",
+      "niveau_source_tags": ["E5"],
+      "manuels": [
+        {"titre_livre": "Mot de passe", "matiere_livre": "Français", "maison_edition": "Hachette", "annee_edition": 2021, "code_livre": "9782017135111", "type_livre": "Manuel", "source_tags": ["E6"]}
+      ]
+    }
+  ]
+}
+"""
+
+
 # --- MAIN FUNCTION ---
-def generer_json_pour_insertion_avec_positions(conn, file_info, tagged_text: str):
-    print("  -> Retrieving knowledge bases...")
-    niveaux_knowledge_base = database.get_standardisation_knowledge_base(conn, 'niveaux')
-    ecoles_knowledge_base = database.get_standardisation_knowledge_base(conn, 'ecoles')
-    standard_niveaux_choices = sorted(list(set(item['nom_standardise'] for item in niveaux_knowledge_base)))
-    standard_ecoles_choices = sorted(list(set(item['nom_standardise'] for item in ecoles_knowledge_base)))
-    
-    school_data = call_gemini(school_prompt_instructions, tagged_text) or {}
-    year_data = call_gemini(year_prompt_instructions, tagged_text) or {}
-    
+EXTRACTION_MODES = ("triple", "combine")
+
+EXTRACTION_PROMPTS = {
+    "school": school_prompt_instructions,
+    "year": year_prompt_instructions,
+    "extraction": extract_levels_and_books_prompt,
+}
+# Pages écartées par le pré-filtre (filtre_pages) : école et année seulement, quel que soit le mode.
+PROMPTS_SANS_LIVRES = ("school", "year")
+
+def _separer_reponse_combinee(data):
+    """Convertit la réponse du prompt combiné au format des trois prompts séparés."""
+    if not isinstance(data, dict):
+        return {"school": None, "year": None, "extraction": None}
+    return {
+        "school": {"ecole_unifie": data.get('ecole_unifie'), "source_tags": data.get('ecole_source_tags', [])},
+        "year": {"annee_scolaire": data.get('annee_scolaire'), "source_tags": data.get('annee_source_tags', [])},
+        "extraction": {"niveaux": data.get('niveaux', [])},
+    }
+
+def extraire_donnees_combinees(tagged_text: str):
+    """Mode "combine" : un seul appel Gemini pour l'école, l'année et les niveaux/manuels."""
+    print("  -> Starting single-pass extraction (school, year, levels and textbooks)...")
+    return _separer_reponse_combinee(call_gemini(combined_extraction_prompt, tagged_text))
+
+async def _extraire_donnees_combinees_async(tagged_text: str):
+    print("  -> Starting single-pass extraction (school, year, levels and textbooks)...")
+    return _separer_reponse_combinee((await call_gemini_detaille_async(combined_extraction_prompt, tagged_text))["data"])
+
+async def _sous_limite(limite, coroutine):
+    async with limite:
+        return await coroutine
+
+async def _donnees(coroutine):
+    return (await coroutine)["data"]
+
+def limite_appels(nombre):
+    """Limite d'appels simultanés à passer à lancer_extraction_brute (ex. page_concurrency pour un fichier)."""
+    return moteur.semaphore(nombre)
+
+def lancer_extraction_brute(limite, tagged_text: str, mode="triple", livres=True):
+    """Lance les prompts indépendants d'une page sur le moteur HTTP asynchrone. Retourne un dict de futures.
+
+    Aucun thread n'est bloqué par appel en vol ; `limite` (limite_appels) borne les appels simultanés
+    du groupe. Annuler une future annule sa requête. Avec `livres=False`, seuls les prompts école et année sont lancés.
+    """
+    def lancer(coroutine):
+        return moteur.soumettre(_sous_limite(limite, coroutine))
+    def appel(prompt):
+        return lancer(_donnees(call_gemini_detaille_async(prompt, tagged_text)))
+    if not livres:
+        return {cle: appel(EXTRACTION_PROMPTS[cle]) for cle in PROMPTS_SANS_LIVRES}
+    if mode == "combine":
+        return {"_combine": lancer(_extraire_donnees_combinees_async(tagged_text))}
+    return {cle: appel(prompt) for cle, prompt in EXTRACTION_PROMPTS.items()}
+
+def collecter_extraction_brute(futures: dict):
+    """Attend les futures de lancer_extraction_brute et retourne les données brutes de la page."""
+    if "_combine" in futures:
+        return futures["_combine"].result()
+    return {cle: future.result() for cle, future in futures.items()}
+
+def extraire_donnees_brutes(tagged_text: str, mode="triple", livres=True):
+    """Appelle Gemini pour l'école, l'année et les niveaux/manuels d'une page, sans standardisation.
+
+    Avec `livres=False`, l'extraction des niveaux/manuels est sautée.
+    """
+    if not livres:
+        return {cle: call_gemini(EXTRACTION_PROMPTS[cle], tagged_text) for cle in PROMPTS_SANS_LIVRES}
+    if mode == "combine":
+        return extraire_donnees_combinees(tagged_text)
+    school_data = call_gemini(school_prompt_instructions, tagged_text)
+    year_data = call_gemini(year_prompt_instructions, tagged_text)
     print("  -> Starting integrated extraction (levels and textbooks)...")
     extraction_data = call_gemini(extract_levels_and_books_prompt, tagged_text)
-    
+    return {"school": school_data, "year": year_data, "extraction": extraction_data}
+
+def standardiser_donnees_brutes(conn, donnees_brutes: dict, differer=False):
+    """Standardise les réponses brutes d'une page et construit le JSON prêt à l'insertion.
+
+    Avec `differer`, une école ou un niveau sans correspondance locale garde son nom brut et porte
+    "standardisation_differee": True ; standardisation_differee.resoudre le standardise plus tard.
+    """
+    # Cached per process, reloaded only when the rules' version changes.
+    base_niveaux = resolveur_standardisation.charger(conn, 'niveaux')
+    base_ecoles = resolveur_standardisation.charger(conn, 'ecoles')
+
+    school_data = donnees_brutes.get('school') or {}
+    year_data = donnees_brutes.get('year') or {}
+    extraction_data = donnees_brutes.get('extraction')
+
     extracted_levels = extraction_data.get('niveaux') if isinstance(extraction_data, dict) else []
     
+    nom_std_ecole, ecole_en_attente = _standardise_entite(conn, school_data.get('ecole_unifie'), base_ecoles, differer)
     final_json = {
         "ecole": {
-            "nom_standardise": _standardise_entite(conn, school_data.get('ecole_unifie'), 'ecoles', ecoles_knowledge_base, standard_ecoles_choices),
+            "nom_standardise": nom_std_ecole,
             "source_tags": school_data.get('source_tags', [])
         },
         "annee_scolaire": {
@@ -181,9 +474,11 @@ def generer_json_pour_insertion_avec_positions(conn, file_info, tagged_text: str
         },
         "niveaux": []
     }
+    if ecole_en_attente: final_json["ecole"]["standardisation_differee"] = True
 
     if not extracted_levels:
-        print("    -> WARNING: Integrated extraction found no levels or textbooks.")
+        if 'extraction' in donnees_brutes:
+            print("    -> WARNING: Integrated extraction found no levels or textbooks.")
         return final_json
 
     for niveau_data in extracted_levels:
@@ -191,7 +486,7 @@ def generer_json_pour_insertion_avec_positions(conn, file_info, tagged_text: str
         if not niveau_brut: continue
 
         print(f"  -> Processing found level: '{niveau_brut}'...")
-        nom_std_niveau = _standardise_entite(conn, niveau_brut, 'niveaux', niveaux_knowledge_base, standard_niveaux_choices)
+        nom_std_niveau, niveau_en_attente = _standardise_entite(conn, niveau_brut, base_niveaux, differer)
         
         manuels_valides = [
             livre for livre in niveau_data.get("manuels", []) 
@@ -204,5 +499,12 @@ def generer_json_pour_insertion_avec_positions(conn, file_info, tagged_text: str
             "niveau_source_tags": niveau_data.get("niveau_source_tags", []),
             "manuels": manuels_valides
         })
+        if niveau_en_attente: final_json["niveaux"][-1]["standardisation_differee"] = True
+
+    return final_json
 
-    return final_json
\ No newline at end of file
+def generer_json_pour_insertion_avec_positions(conn, file_info, tagged_text: str, mode="triple", livres=True, extraction=None, differer=False):
+    """Extraction et standardisation d'une page ; `extraction` remplace la réponse niveaux/manuels (extraction_tableaux)."""
+    donnees_brutes = extraire_donnees_brutes(tagged_text, mode, livres)
+    if extraction is not None: donnees_brutes['extraction'] = extraction
+    return standardiser_donnees_brutes(conn, donnees_brutes, differer)
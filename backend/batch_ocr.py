@@ -0,0 +1,249 @@
+# batch_ocr.py
+# Mode OCR par lots pour les gros arriérés (rentrée de septembre). Avant le traitement normal,
+# les fichiers en attente sont regroupés en jobs Document AI asynchrones (batch_process_documents),
+# suivis par interrogation périodique. Les documents obtenus sont déposés dans le cache OCR
+# (doc_processor.sauver_ocr) : la passe normale les y retrouve et enchaîne directement sur
+# preprocess_document_for_ia, sans appel OCR en ligne.
+#
+# Le backend est interchangeable : DocumentAIBatchBackend (Document AI + Google Cloud Storage)
+# en production, LocalBatchBackend (--ocr-mode batch-local) pour exécuter le même flux sans bucket,
+# et entièrement hors ligne avec fake_docai.FakeDocumentAIClient. L'appelant ferme le backend (fermer()).
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import documentai
+import doc_processor
+import ingestion
+import spool
+from config import (DOCAI_LOCATION, DOCAI_PROCESSOR_ID, DOCAI_PROJECT_ID, DOCAI_BATCH_GCS_BUCKET,
+                    DOCAI_BATCH_GCS_PREFIX, BATCH_OCR_SIZE, BATCH_OCR_MIN_FILES, BATCH_OCR_POLL_SECONDS,
+                    BATCH_OCR_MAX_WAIT_SECONDS)
+
+OCR_MODES = ("online", "batch", "batch-local", "auto")
+
+class DocumentAIBatchBackend:
+    """Jobs batch Document AI : entrées et sorties transitent par un bucket GCS."""
+    def __init__(self, bucket_name, prefix):
+        from google.cloud import storage  # Dépendance requise uniquement pour le mode batch
+        self._bucket = storage.Client(project=DOCAI_PROJECT_ID).bucket(bucket_name)
+        self._bucket_name = bucket_name
+        self._prefix = prefix
+        self._operations = {}
+
+    def soumettre(self, elements):
+        """Envoie un lot de (fichier, contenu). Retourne l'identifiant du job. Les spools sont fermés dans tous les cas.
+
+        En cas d'échec (envoi GCS, quota de batch_process_documents), les fichiers déjà envoyés sont supprimés du bucket.
+        """
+        job_id = uuid.uuid4().hex
+        documents, correspondance = [], {}
+        try:
+            for fichier, contenu in elements:
+                chemin = f"{self._prefix}/{job_id}/input/{fichier['id']}"
+                self._bucket.blob(chemin).upload_from_filename(contenu.chemin, content_type=fichier['mimeType'])
+                uri = f"gs://{self._bucket_name}/{chemin}"
+                documents.append(documentai.GcsDocument(gcs_uri=uri, mime_type=fichier['mimeType']))
+                correspondance[uri] = fichier['id']
+
+            client = doc_processor._get_docai_client()
+            request = documentai.BatchProcessRequest(
+                name=client.processor_path(DOCAI_PROJECT_ID, DOCAI_LOCATION, DOCAI_PROCESSOR_ID),
+                input_documents=documentai.BatchDocumentsInputConfig(gcs_documents=documentai.GcsDocuments(documents=documents)),
+                document_output_config=documentai.DocumentOutputConfig(gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                    gcs_uri=f"gs://{self._bucket_name}/{self._prefix}/{job_id}/output/")))
+            self._operations[job_id] = (client.batch_process_documents(request=request), correspondance)
+        except Exception:
+            self._nettoyer(job_id)
+            raise
+        finally:
+            for _, contenu in elements: spool.liberer(contenu)
+        return job_id
+
+    def _nettoyer(self, job_id):
+        """Supprime du bucket les entrées et sorties d'un job (sans lever d'erreur)."""
+        try:
+            for blob in self._bucket.list_blobs(prefix=f"{self._prefix}/{job_id}/"):
+                blob.delete()
+        except Exception as e:
+            print(f"  -> WARNING: could not clean up batch OCR job {job_id} in the bucket: {e}")
+
+    def est_termine(self, job_id):
+        return self._operations[job_id][0].done()
+
+    def _lire_sortie(self, gcs_uri):
+        """Charge les shards JSON d'un document et les assemble dans l'ordre."""
+        prefixe = gcs_uri.replace(f"gs://{self._bucket_name}/", "", 1)
+        blobs = [b for b in self._bucket.list_blobs(prefix=prefixe) if b.name.endswith(".json")]
+        blobs.sort(key=lambda b: int(m.group(1)) if (m := re.search(r"-(\d+)\.json$", b.name)) else 0)
+        shards = [documentai.Document.from_json(b.download_as_bytes(), ignore_unknown_fields=True) for b in blobs]
+        return doc_processor.fusionner_documents(shards) if shards else None
+
+    def resultats(self, job_id):
+        """Retourne {file_id: (succes, message, document)} pour un job terminé, puis nettoie le bucket."""
+        operation, correspondance = self._operations.pop(job_id)
+        resultats = {}
+        try:
+            if operation.exception():
+                return {file_id: (False, str(operation.exception()), None) for file_id in correspondance.values()}
+            for statut in operation.metadata.individual_process_statuses:
+                file_id = correspondance.get(statut.input_gcs_source)
+                if not file_id: continue
+                if statut.status.code != 0:
+                    resultats[file_id] = (False, statut.status.message, None)
+                    continue
+                try:
+                    document = self._lire_sortie(statut.output_gcs_destination)
+                except Exception as e:
+                    resultats[file_id] = (False, f"Lecture de la sortie batch impossible: {e}", None)
+                    continue
+                resultats[file_id] = (True, "Succès (batch)", document) if document else (False, "Sortie batch introuvable", None)
+        finally:
+            self._nettoyer(job_id)
+        return resultats
+
+    def abandonner(self, job_id):
+        """Annule un job non terminé et supprime ses fichiers du bucket."""
+        operation, _ = self._operations.pop(job_id, (None, None))
+        if operation is None: return
+        try:
+            operation.cancel()
+        finally:
+            self._nettoyer(job_id)
+
+    def fermer(self):
+        """Abandonne les jobs encore suivis (leurs fichiers restent à l'OCR en ligne)."""
+        for job_id in list(self._operations):
+            self.abandonner(job_id)
+
+def _ocr_en_ligne(fichier, contenu):
+    try:
+        return doc_processor.ocr_document(fichier, contenu)
+    finally:
+        spool.liberer(contenu)
+
+class LocalBatchBackend:
+    """Remplaçant local : chaque lot est traité en arrière-plan par `fonction_ocr`.
+
+    Par défaut, l'OCR en ligne est utilisé ; avec doc_processor._client remplacé par
+    fake_docai.FakeDocumentAIClient, tout le flux batch s'exécute hors ligne.
+    """
+    def __init__(self, fonction_ocr=None, workers=4):
+        self._fonction_ocr = fonction_ocr or _ocr_en_ligne
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}
+
+    def soumettre(self, elements):
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = [(fichier['id'], contenu, self._executor.submit(self._fonction_ocr, fichier, contenu))
+                              for fichier, contenu in elements]
+        return job_id
+
+    def est_termine(self, job_id):
+        return all(future.done() for _, _, future in self._jobs[job_id])
+
+    def resultats(self, job_id):
+        resultats = {}
+        for file_id, _, future in self._jobs.pop(job_id):
+            try:
+                resultats[file_id] = future.result()
+            except Exception as e:
+                resultats[file_id] = (False, str(e), None)
+        return resultats
+
+    def abandonner(self, job_id):
+        for _, contenu, future in self._jobs.pop(job_id, []):
+            if future.cancel(): spool.liberer(contenu)  # Jamais démarré : le spool n'a pas été fermé par l'OCR
+
+    def fermer(self):
+        """Abandonne les jobs encore suivis et arrête les threads, après les OCR déjà commencés."""
+        for job_id in list(self._jobs):
+            self.abandonner(job_id)
+        self._executor.shutdown(wait=True)
+
+def choisir_backend(ocr_mode, nb_fichiers):
+    """Retourne le backend batch à utiliser pour cette exécution, ou None pour rester en OCR en ligne."""
+    if ocr_mode == "online" or (ocr_mode == "auto" and nb_fichiers < BATCH_OCR_MIN_FILES):
+        return None
+    if doc_processor.ocr_cache is None:
+        print("  -> WARNING: batch OCR needs the OCR cache (OCR_CACHE_ENABLED). Using online OCR.")
+        return None
+    if ocr_mode == "batch-local":
+        return LocalBatchBackend()
+    if not DOCAI_BATCH_GCS_BUCKET:
+        if ocr_mode == "batch": print("  -> WARNING: DOCAI_BATCH_GCS_BUCKET is not set. Using online OCR.")
+        return None
+    return DocumentAIBatchBackend(DOCAI_BATCH_GCS_BUCKET, DOCAI_BATCH_GCS_PREFIX)
+
+def _abandonner(backend, job_id):
+    try:
+        backend.abandonner(job_id)
+    except Exception as e:
+        print(f"  -> WARNING: could not cancel batch OCR job {job_id}: {e}")
+
+def pre_ocr_par_lots(drive_service, db_conn, fichiers, backend, taille_lot=BATCH_OCR_SIZE, intervalle=BATCH_OCR_POLL_SECONDS,
+                     delai_max=BATCH_OCR_MAX_WAIT_SECONDS, arret=None):
+    """OCR par lots des fichiers en attente ; les résultats vont dans le cache OCR. Retourne le nombre de documents obtenus.
+
+    Les doublons, les échecs de téléchargement et les fichiers déjà en cache sont laissés à la passe normale.
+    Un document en échec dans un job sera simplement traité en ligne par la passe normale, comme ceux des
+    jobs abandonnés quand `delai_max` secondes sont écoulées ou que l'événement `arret` est levé.
+    """
+    fichiers_par_id = {f['id']: f for f in fichiers}
+    jobs, lot = {}, []
+    limite = time.monotonic() + delai_max
+
+    def interrompu():
+        return (arret and arret.is_set()) or time.monotonic() > limite
+
+    def envoyer_lot():
+        if not lot: return
+        elements = list(lot)
+        lot.clear()
+        try:
+            job_id = backend.soumettre(elements)
+        except Exception as e:
+            print(f"  -> WARNING: could not submit a batch OCR job, {len(elements)} file(s) will use online OCR: {e}")
+            for _, contenu in elements: spool.liberer(contenu)
+            return
+        jobs[job_id] = len(elements)
+        print(f"  -> Batch OCR job {job_id} submitted ({len(elements)} file(s)).")
+
+    try:
+        for fichier in fichiers:
+            if interrompu(): break
+            log_status, _, contenu = ingestion.telecharger_sans_doublon(drive_service, db_conn, fichier)
+            if log_status or contenu is None: continue
+            lot.append((fichier, contenu))
+            if len(lot) >= taille_lot: envoyer_lot()
+        if not interrompu(): envoyer_lot()
+    finally:
+        for _, contenu in lot: spool.liberer(contenu)
+
+    obtenus = 0
+    while jobs and not interrompu():
+        for job_id in list(jobs):
+            try:
+                if not backend.est_termine(job_id): continue
+                resultats = backend.resultats(job_id)
+            except Exception as e:
+                print(f"  -> WARNING: batch OCR job {job_id} failed, its {jobs[job_id]} file(s) will use online OCR: {e}")
+                _abandonner(backend, job_id)
+                resultats = {}
+            del jobs[job_id]
+            for file_id, (succes, message, document) in resultats.items():
+                if succes:
+                    doc_processor.sauver_ocr(file_id, fichiers_par_id[file_id].get('empreinte'), document)
+                    obtenus += 1
+                else:
+                    print(f"  -> WARNING: batch OCR failed for {file_id}, will fall back to online OCR: {message}")
+            print(f"  -> Batch OCR job {job_id} finished.")
+        if jobs:
+            if arret: arret.wait(intervalle)
+            else: time.sleep(intervalle)
+
+    if jobs:
+        raison = "stop requested" if arret and arret.is_set() else f"no result after {delai_max:.0f}s"
+        print(f"  -> WARNING: batch OCR abandoned ({raison}), {sum(jobs.values())} file(s) will use online OCR.")
+        for job_id in jobs: _abandonner(backend, job_id)
+    return obtenus
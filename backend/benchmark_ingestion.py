@@ -0,0 +1,277 @@
+# benchmark_ingestion.py
+# Benchmark de bout en bout de l'ingestion : main_orchestrator traite un corpus synthétique servi par
+# un Drive en mémoire (fake_drive), un Document AI local (fake_docai) et une API Gemini locale
+# (fake_gemini, latence et taux d'erreur réglables), avec une base MySQL jetable.
+#
+# Chaque combinaison (taille du corpus, workers, appels Gemini simultanés par fichier) s'exécute dans
+# un processus séparé : la mémoire maximale mesurée (RSS) est bien celle de cette exécution. Le rapport
+# JSON donne le débit (fichiers et pages par minute), les percentiles p50/p95 par étape (metriques_fichiers)
+# et la mémoire maximale ; --compare affiche l'écart avec un rapport précédent.
+#
+# La base BENCHMARK_DB_NAME (par défaut <DB_NAME>_benchmark, sur le serveur de DB_CONFIG) est supprimée
+# et recréée à chaque exécution ; elle ne peut pas être la base de DB_NAME.
+#
+# Usage : python benchmark_ingestion.py --sizes 10,1000,10000 --workers 1,4 --page-concurrency 1,4
+#         python benchmark_ingestion.py --sizes 1000 --gemini-latency 0.8 --gemini-error-rate 0.02 --compare logs/avant.json
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+try:
+    import resource
+except ImportError:  # Windows : pas de mesure de la mémoire maximale
+    resource = None
+import mysql.connector
+import ai_processor
+import database
+import doc_processor
+import fake_docai
+import google_drive
+import ingestion
+import main
+import telemetrie
+from fake_docai import FakeDocumentAIClient
+from fake_drive import FakeDriveService
+from fake_gemini import FakeGemini
+from limiteur_gemini import LimiteurGemini
+from config import DB_CONFIG, DB_NAME, GEMINI_MAX_CONCURRENCY, INGESTION_QUEUE_SIZE
+
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", f"{DB_NAME}_benchmark")
+
+# Tables du site lues ou écrites par l'ingestion (colonnes utilisées par database.py uniquement) ;
+# les tables propres à l'ingestion viennent de database.INGESTION_TABLES_DDL.
+SCHEMA_DDL = [
+    """CREATE TABLE logs_fichiers (
+        id_fichier_drive VARCHAR(255) PRIMARY KEY, nom_fichier VARCHAR(255), mime_type VARCHAR(100),
+        statut VARCHAR(50), error_message VARCHAR(255), date_traitement DATETIME)""",
+    "CREATE TABLE ecoles (id_ecole INT AUTO_INCREMENT PRIMARY KEY, nom_ecole VARCHAR(255), statut VARCHAR(50), INDEX (nom_ecole))",
+    "CREATE TABLE annees_scolaires (id_annee INT AUTO_INCREMENT PRIMARY KEY, annee_scolaire VARCHAR(50), statut VARCHAR(50), INDEX (annee_scolaire))",
+    "CREATE TABLE niveaux (id_niveau INT AUTO_INCREMENT PRIMARY KEY, nom_niveau VARCHAR(255), statut VARCHAR(50), INDEX (nom_niveau))",
+    """CREATE TABLE listes_scolaires (
+        id_liste INT AUTO_INCREMENT PRIMARY KEY, id_ecole INT, id_annee INT, id_niveau INT,
+        source_file_id VARCHAR(255), statut VARCHAR(50), INDEX (id_ecole, id_annee, id_niveau))""",
+    """CREATE TABLE manuels (
+        id_manuel INT AUTO_INCREMENT PRIMARY KEY, titre VARCHAR(500), editeur VARCHAR(255), annee_edition INT,
+        isbn VARCHAR(20), type VARCHAR(100), matiere VARCHAR(255), id_niveau INT, statut VARCHAR(50))""",
+    "CREATE TABLE liste_manuels (id_liste INT, id_manuel INT, PRIMARY KEY (id_liste, id_manuel))",
+    """CREATE TABLE source_locations (
+        id INT AUTO_INCREMENT PRIMARY KEY, source_file_id VARCHAR(255), entite_type VARCHAR(20), entite_id INT,
+        page_number INT, coordonnees_json TEXT)""",
+    "CREATE TABLE standardisation_ecoles (valeur_brute VARCHAR(255) PRIMARY KEY, nom_standardise VARCHAR(255), statut VARCHAR(50))",
+    "CREATE TABLE standardisation_niveaux (valeur_brute VARCHAR(255) PRIMARY KEY, nom_standardise VARCHAR(255), statut VARCHAR(50))",
+]
+
+# --- Corpus synthétique ---
+NIVEAUX = ("CP", "CE1", "CE2", "CM1", "CM2", "1ère année collège", "2ème année collège", "Tronc commun sciences")
+MATIERES = ("Français", "Mathématiques", "Arabe", "Anglais", "Éveil scientifique", "Éducation islamique", "Histoire-géographie")
+EDITEURS = ("Hachette", "Nathan", "Bordas", "Hatier", "Magnard", "Dar Al Kitab", "Afrique Orient", "Oxford")
+MOTS_TITRE = ("Mot", "de", "passe", "Pour", "comprendre", "Les", "nouveaux", "outils", "Parcours", "Réussir", "Mes", "apprentissages",
+              "Cap", "sur", "le", "monde", "Ribambelle", "Caribou", "Pixel", "Défi", "Horizons")
+FOURNITURES = ("2 stylos bleus", "1 trousse", "1 paquet de feuilles doubles", "1 cahier de 96 pages", "1 règle de 30 cm",
+               "1 boîte de crayons de couleur", "1 protège-cahier rouge", "1 calculatrice")
+
+def _isbn(rng):
+    chiffres = [9, 7, 8] + [rng.randint(0, 9) for _ in range(9)]
+    controle = (10 - sum(c * (3 if i % 2 else 1) for i, c in enumerate(chiffres)) % 10) % 10
+    return "".join(map(str, chiffres + [controle]))
+
+def generer_pages(index, rng):
+    """Pages (listes de lignes) d'une liste scolaire synthétique : en-tête, niveaux, manuels et fournitures."""
+    pages = [[f"Groupe Scolaire Al Amal {index}", "Liste des fournitures scolaires 2025/2026"]]
+    for numero in range(rng.randint(1, 3)):
+        if numero: pages.append([])
+        for niveau in rng.sample(NIVEAUX, rng.randint(1, 2)):
+            pages[-1].append(niveau)
+            for _ in range(rng.randint(3, 8)):
+                titre = " ".join(rng.sample(MOTS_TITRE, rng.randint(2, 4)))
+                pages[-1].append(f"{rng.choice(MATIERES)} : {titre} {index} - {rng.choice(EDITEURS)} - {_isbn(rng)}")
+            pages[-1].extend(rng.sample(FOURNITURES, rng.randint(1, 4)))
+    return pages
+
+def construire_corpus(drive, nb_fichiers, seed, taux_doublons=0.0, fichiers_par_dossier=100):
+    """Ajoute `nb_fichiers` listes au Drive en mémoire, réparties en sous-dossiers. Retourne (racine, octets)."""
+    rng = random.Random(seed)
+    racine = drive.ajouter_dossier("Listes scolaires")
+    contenus, octets, dossier = [], 0, None
+    for index in range(nb_fichiers):
+        if index % fichiers_par_dossier == 0:
+            dossier = drive.ajouter_dossier(f"Lot {index // fichiers_par_dossier + 1}", parents=[racine])
+        if contenus and rng.random() < taux_doublons:
+            contenu = rng.choice(contenus)
+        else:
+            contenu = fake_docai.contenu_synthetique(generer_pages(index, rng))
+            contenus.append(contenu)
+        # Type image : fake_docai lit le texte tel quel, sans l'essai de découpage réservé aux PDF.
+        drive.ajouter_fichier(f"liste_{index:05d}.png", contenu, parents=[dossier], mime_type='image/png')
+        octets += len(contenu)
+    return racine, octets
+
+# --- Base jetable ---
+def preparer_base(nom):
+    """Recrée la base `nom` (schéma du site + tables d'ingestion) et y redirige database.py."""
+    if nom == DB_NAME: raise ValueError(f"Refusing to benchmark on the application database '{DB_NAME}'")
+    conn = mysql.connector.connect(**{cle: valeur for cle, valeur in DB_CONFIG.items() if cle != 'database'})
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{nom}`")
+    cursor.execute(f"CREATE DATABASE `{nom}` CHARACTER SET utf8mb4")
+    cursor.execute(f"USE `{nom}`")
+    for ddl in SCHEMA_DDL:
+        cursor.execute(ddl)
+    # Niveaux déjà validés : la standardisation des niveaux passe par la correspondance directe.
+    cursor.executemany("INSERT INTO standardisation_niveaux (valeur_brute, nom_standardise, statut) VALUES (%s, %s, 'VALIDÉ')",
+                       [(niveau.lower(), niveau) for niveau in NIVEAUX])
+    conn.commit()
+    cursor.close()
+    conn.close()
+    DB_CONFIG['database'] = nom  # Dict partagé avec database.py
+    conn = database.get_connection()
+    database.init_ingestion_tables(conn)
+    conn.close()
+
+# --- Une exécution (processus enfant) ---
+def executer(parametres):
+    """Une passe main_orchestrator sur un corpus neuf ; retourne les mesures de l'exécution."""
+
+    preparer_base(parametres["database"])
+    drive = FakeDriveService()
+    racine, octets = construire_corpus(drive, parametres["files"], parametres["seed"], parametres["duplicate_rate"])
+
+    google_drive.get_drive_service = lambda: drive
+    main.GOOGLE_DRIVE_FOLDER_ID = racine
+    ocr = FakeDocumentAIClient(latence_s=parametres["ocr_latency"], taux_erreur=parametres["ocr_error_rate"], seed=parametres["seed"])
+    doc_processor._client = ocr
+    gemini = FakeGemini(latence_s=parametres["gemini_latency"], gigue_s=parametres["gemini_jitter"],
+                        taux_erreur=parametres["gemini_error_rate"], taux_limite=parametres["gemini_429_rate"], seed=parametres["seed"])
+    ai_processor.moteur.utiliser_client(gemini)
+    ai_processor.limiteur = LimiteurGemini(parametres["gemini_rpm"], parametres["gemini_tpm"], 1.0, parametres["gemini_concurrency"])
+    # Sans caches disque : chaque exécution paie tout l'OCR et tous les appels Gemini.
+    doc_processor.ocr_cache = None
+    ai_processor.configurer_cache_llm(bypass=True)
+
+    options = ingestion.options_par_defaut(page_concurrency=parametres["page_concurrency"], extraction_mode=parametres["extraction_mode"],
+                                           discovery_mode="full", ocr_mode="online", job_queue=False)
+    debut = time.perf_counter()
+    main.main_orchestrator(workers=parametres["workers"], queue_size=parametres["queue_size"], options=options)
+    duree = time.perf_counter() - debut
+
+    conn = database.get_connection()
+    resume = telemetrie.agreger(database.get_file_metrics(conn, 1))
+    conn.close()
+    return {
+        **{cle: parametres[cle] for cle in ("files", "workers", "page_concurrency", "queue_size", "extraction_mode")},
+        "corpus_bytes": octets,
+        "wall_s": round(duree, 2),
+        "files_per_minute": round(resume["files"] * 60 / duree, 1),
+        "pages_per_minute": round(resume["pages"] * 60 / duree, 1),
+        # ru_maxrss est en kilo-octets sous Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+        "statuses": resume["statuses"],
+        "pages": resume["pages"],
+        "stages": resume["stages"],
+        "llm": resume["llm"],
+        "fake_services": {"ocr_calls": ocr.appels, "gemini": gemini.stats},
+    }
+
+# --- Orchestration (processus parent) ---
+def _commit_git():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def lancer(parametres, journal):
+    """Exécute une combinaison dans un processus enfant ; sa sortie standard va dans `journal`."""
+    descripteur, chemin_resultat = tempfile.mkstemp(suffix=".json")
+    os.close(descripteur)
+    try:
+        with open(journal, 'a', encoding='utf-8') as sortie:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(parametres), "--result", chemin_resultat],
+                           stdout=sortie, stderr=subprocess.STDOUT, check=True)
+        with open(chemin_resultat, encoding='utf-8') as f:
+            return json.load(f)
+    except subprocess.CalledProcessError as e:
+        return {**{cle: parametres[cle] for cle in ("files", "workers", "page_concurrency")}, "error": f"exit code {e.returncode}, see {journal}"}
+    finally:
+        os.remove(chemin_resultat)
+
+def _cle_run(run):
+    return run["files"], run["workers"], run["page_concurrency"], run.get("extraction_mode")
+
+def comparer(rapport, precedent):
+    """Affiche l'écart de débit et de p95 par étape avec un rapport précédent, pour les combinaisons communes."""
+    anciens = {_cle_run(run): run for run in precedent["runs"] if "error" not in run}
+    print(f"\n--- COMPARISON WITH {precedent.get('commit') or '?'} ({precedent.get('generated_at')}) ---")
+    for run in rapport["runs"]:
+        ancien = anciens.get(_cle_run(run))
+        if not ancien or "error" in run: continue
+        def ecart(avant, apres): return f"{(apres - avant) / avant * 100:+.1f}%" if avant else "n/a"
+        p95 = ", ".join(f"{etape} {ecart(ancien['stages'][etape]['p95_ms'], run['stages'][etape]['p95_ms'])}"
+                        for etape in ("ocr", "analyse", "bdd", "total")
+                        if ancien['stages'][etape]['p95_ms'] and run['stages'][etape]['p95_ms'])
+        print(f"  {run['files']} files, {run['workers']} worker(s), page concurrency {run['page_concurrency']}: "
+              f"{ancien['files_per_minute']} -> {run['files_per_minute']} files/min ({ecart(ancien['files_per_minute'], run['files_per_minute'])}); p95 {p95}")
+
+def _liste_entiers(texte):
+    return [int(valeur) for valeur in texte.split(",") if valeur.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de bout en bout de l'ingestion sur des services simulés.")
+    parser.add_argument("--sizes", type=_liste_entiers, default=[10, 1000, 10000], help="Tailles de corpus (fichiers), séparées par des virgules.")
+    parser.add_argument("--workers", type=_liste_entiers, default=[1, 4], help="Workers par étape à mesurer (1 = séquentiel).")
+    parser.add_argument("--page-concurrency", type=_liste_entiers, default=[1, 4], help="Appels Gemini simultanés par fichier à mesurer.")
+    parser.add_argument("--queue-size", type=int, default=INGESTION_QUEUE_SIZE)
+    parser.add_argument("--extraction-mode", choices=("triple", "combine"), default="triple")
+    parser.add_argument("--ocr-latency", type=float, default=0.5, help="Latence simulée d'un appel Document AI (secondes).")
+    parser.add_argument("--ocr-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="Latence simulée d'un appel Gemini (secondes).")
+    parser.add_argument("--gemini-jitter", type=float, default=0.2, help="Variation aléatoire de la latence Gemini (± secondes).")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Part des appels Gemini en erreur 500.")
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0, help="Part des appels Gemini limités (429 avec Retry-After).")
+    parser.add_argument("--gemini-rpm", type=int, default=1_000_000, help="Quota simulé du limiteur (par défaut sans effet).")
+    parser.add_argument("--gemini-tpm", type=int, default=1_000_000_000)
+    parser.add_argument("--gemini-concurrency", type=int, default=GEMINI_MAX_CONCURRENCY)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Part des fichiers copiant le contenu d'un fichier précédent.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", default=BENCHMARK_DB_NAME, help="Base MySQL jetable, recréée à chaque exécution.")
+    parser.add_argument("--output", default=os.path.join("logs", f"ingestion_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"))
+    parser.add_argument("--log", default=os.path.join("logs", "ingestion_benchmark.log"), help="Sortie des exécutions (main_orchestrator).")
+    parser.add_argument("--compare", help="Rapport JSON précédent à comparer.")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        resultat = executer(json.loads(args.run_one))
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(resultat, f, ensure_ascii=False)
+        sys.exit(0)
+
+    reglages = {cle: getattr(args, cle) for cle in ("queue_size", "extraction_mode", "ocr_latency", "ocr_error_rate", "gemini_latency",
+                                                     "gemini_jitter", "gemini_error_rate", "gemini_429_rate", "gemini_rpm", "gemini_tpm",
+                                                     "gemini_concurrency", "duplicate_rate", "seed", "database")}
+    rapport = {"generated_at": datetime.now().isoformat(), "machine": socket.gethostname(), "commit": _commit_git(),
+               "settings": reglages, "runs": []}
+    for taille, workers, page_concurrency in itertools.product(args.sizes, args.workers, args.page_concurrency):
+        print(f"-> {taille} file(s), {workers} worker(s), page concurrency {page_concurrency}...", flush=True)
+        run = lancer({**reglages, "files": taille, "workers": workers, "page_concurrency": page_concurrency}, args.log)
+        rapport["runs"].append(run)
+        if "error" in run:
+            print(f"   ERROR: {run['error']}")
+        else:
+            print(f"   {run['files_per_minute']} files/min, {run['pages_per_minute']} pages/min, "
+                  f"p95 total {run['stages']['total']['p95_ms']} ms, peak RSS {run['peak_rss_mb']} MB")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            comparer(rapport, json.load(f))
@@ -0,0 +1,92 @@
+# client_gemini.py
+# Moteur HTTP asynchrone des appels Gemini. Une boucle asyncio tourne dans un thread dédié du processus
+# et porte un seul httpx.AsyncClient : connexions HTTP/2 multiplexées et réutilisées (keep-alive), pool
+# borné à GEMINI_HTTP_MAX_CONNECTIONS. Des centaines d'appels peuvent ainsi être en vol sans qu'aucun
+# thread ne reste bloqué pendant la réponse de l'API.
+#
+# Les coroutines (ai_processor.call_gemini_detaille_async...) s'exécutent toujours sur cette boucle :
+#   - depuis du code synchrone : moteur.executer(coroutine) attend le résultat (façade de call_gemini) ;
+#     moteur.soumettre(coroutine) retourne un concurrent.futures.Future, annulable ;
+#   - depuis une autre boucle asyncio : await moteur.attendre(coroutine).
+# Le contexte (contextvars) de l'appelant est transmis à la coroutine : la télémétrie impute les tokens
+# au fichier en cours comme pour un appel synchrone.
+#
+# Le client HTTP peut être remplacé (moteur.utiliser_client), par exemple par fake_gemini.FakeGemini.
+import asyncio
+import threading
+import httpx
+from config import GEMINI_HTTP2, GEMINI_HTTP_MAX_CONNECTIONS, GEMINI_HTTP_TIMEOUT_SECONDS
+
+# Délai d'établissement d'une connexion (la lecture de la réponse a droit à GEMINI_HTTP_TIMEOUT_SECONDS).
+DELAI_CONNEXION_S = 10
+
+class MoteurGemini:
+    def __init__(self, http2=GEMINI_HTTP2, connexions_max=GEMINI_HTTP_MAX_CONNECTIONS, delai_s=GEMINI_HTTP_TIMEOUT_SECONDS):
+        self.http2 = http2
+        self.connexions_max = connexions_max
+        self.delai_s = delai_s
+        self._boucle = None
+        self._boucle_thread = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def boucle(self):
+        """Boucle asyncio du moteur, démarrée au premier appel dans un thread démon."""
+        with self._lock:
+            if self._boucle is None:
+                boucle = asyncio.new_event_loop()
+                thread = threading.Thread(target=boucle.run_forever, name="gemini-http", daemon=True)
+                thread.start()
+                self._boucle_thread = thread.ident
+                self._boucle = boucle
+            return self._boucle
+
+    def client(self):
+        """Client HTTP partagé ; à n'utiliser que depuis la boucle du moteur."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.connexions_max, max_keepalive_connections=self.connexions_max),
+                timeout=httpx.Timeout(self.delai_s, connect=DELAI_CONNEXION_S))
+        return self._client
+
+    def utiliser_client(self, client):
+        """Remplace le client HTTP (même interface async post() qu'httpx.AsyncClient)."""
+        self._client = client
+
+    def soumettre(self, coroutine):
+        """Planifie `coroutine` sur la boucle du moteur. Retourne un concurrent.futures.Future ; l'annuler annule l'appel."""
+        # run_coroutine_threadsafe copie le contexte courant : la tâche hérite des contextvars de l'appelant.
+        return asyncio.run_coroutine_threadsafe(coroutine, self.boucle())
+
+    def executer(self, coroutine):
+        """Façade synchrone : exécute `coroutine` sur la boucle du moteur et retourne son résultat.
+
+        Depuis la boucle du moteur elle-même, l'attente bloquerait la boucle pour toujours : RuntimeError
+        (une coroutine utilise `await`, ou `await moteur.attendre(...)`).
+        """
+        if self._boucle is not None and threading.get_ident() == self._boucle_thread:
+            coroutine.close()
+            raise RuntimeError("MoteurGemini.executer() called from the engine's own event loop; use await instead.")
+        future = self.soumettre(coroutine)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def attendre(self, coroutine):
+        """Depuis n'importe quelle boucle asyncio : exécute `coroutine` sur la boucle du moteur.
+        L'annulation de l'appelant annule aussi la coroutine."""
+        return await asyncio.wrap_future(self.soumettre(coroutine))
+
+    async def post(self, url, payload, timeout=None):
+        return await self.client().post(url, headers={"Content-Type": "application/json"}, json=payload,
+                                        timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT)
+
+    async def _semaphore(self, limite):
+        return asyncio.Semaphore(limite)
+
+    def semaphore(self, limite):
+        """asyncio.Semaphore de la boucle du moteur, pour borner un groupe d'appels (ex. les pages d'un fichier)."""
+        return self.executer(self._semaphore(limite))
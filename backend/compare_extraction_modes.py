@@ -0,0 +1,125 @@
+# compare_extraction_modes.py
+# Compare les modes d'extraction "triple" (trois prompts par page) et "combine" (un seul prompt)
+# sur de vrais fichiers Drive : tokens, latence et concordance des champs extraits, page par page.
+# Aucune écriture en base.
+#
+# Usage : python compare_extraction_modes.py --limit 5
+#         python compare_extraction_modes.py --file-id <ID> --file-id <ID> --output rapport.json
+import argparse
+import json
+import os
+from datetime import datetime
+import google_drive
+import doc_processor
+import ai_processor
+from config import GOOGLE_DRIVE_FOLDER_ID
+
+def _normaliser(valeur):
+    return ' '.join(str(valeur).lower().split()) if valeur else ""
+
+def _jaccard(a: set, b: set):
+    if not a and not b: return 1.0
+    return round(len(a & b) / len(a | b), 3)
+
+def _mesures(appels):
+    return {
+        "calls": len(appels),
+        "prompt_tokens": sum(a["usage"]["prompt_tokens"] for a in appels),
+        "output_tokens": sum(a["usage"]["output_tokens"] for a in appels),
+        "latency_ms": sum(a["latency_ms"] for a in appels),
+    }
+
+def _champs(donnees_brutes):
+    """Extrait les champs comparables d'une réponse au format des trois prompts."""
+    school = donnees_brutes.get("school") or {}
+    year = donnees_brutes.get("year") or {}
+    extraction = donnees_brutes.get("extraction") or {}
+    niveaux = extraction.get("niveaux", []) if isinstance(extraction, dict) else []
+    return {
+        "ecole": _normaliser(school.get("ecole_unifie")),
+        "annee": _normaliser(year.get("annee_scolaire")),
+        "niveaux": {_normaliser(n.get("niveau_brut")) for n in niveaux if isinstance(n, dict)},
+        "titres": {_normaliser(m.get("titre_livre")) for n in niveaux if isinstance(n, dict)
+                   for m in n.get("manuels", []) if isinstance(m, dict) and m.get("titre_livre")},
+    }
+
+def comparer_page(tagged_text: str):
+    """Exécute les deux modes sur une page et retourne les mesures et la concordance."""
+    # Le cache LLM est contourné : on mesure de vrais appels.
+    appels_triple = {cle: ai_processor.call_gemini_detaille(prompt, tagged_text, use_cache=False)
+                     for cle, prompt in ai_processor.EXTRACTION_PROMPTS.items()}
+    triple = {cle: appel["data"] for cle, appel in appels_triple.items()}
+
+    appel_combine = ai_processor.call_gemini_detaille(ai_processor.combined_extraction_prompt, tagged_text, use_cache=False)
+    combine = ai_processor._separer_reponse_combinee(appel_combine["data"])
+
+    champs_triple, champs_combine = _champs(triple), _champs(combine)
+    return {
+        "triple": _mesures(list(appels_triple.values())),
+        "combine": _mesures([appel_combine]),
+        "agreement": {
+            "ecole": champs_triple["ecole"] == champs_combine["ecole"],
+            "annee": champs_triple["annee"] == champs_combine["annee"],
+            "niveaux_jaccard": _jaccard(champs_triple["niveaux"], champs_combine["niveaux"]),
+            "titres_jaccard": _jaccard(champs_triple["titres"], champs_combine["titres"]),
+            "titres_triple": len(champs_triple["titres"]),
+            "titres_combine": len(champs_combine["titres"]),
+        },
+    }
+
+def _resumer(pages):
+    if not pages: return {}
+    def total(mode, cle): return sum(p[mode][cle] for p in pages)
+    resume = {"pages": len(pages)}
+    for mode in ("triple", "combine"):
+        resume[mode] = {cle: total(mode, cle) for cle in ("calls", "prompt_tokens", "output_tokens", "latency_ms")}
+    resume["prompt_tokens_saved_pct"] = round(100 * (1 - resume["combine"]["prompt_tokens"] / resume["triple"]["prompt_tokens"]), 1) if resume["triple"]["prompt_tokens"] else None
+    resume["latency_saved_pct"] = round(100 * (1 - resume["combine"]["latency_ms"] / resume["triple"]["latency_ms"]), 1) if resume["triple"]["latency_ms"] else None
+    resume["agreement"] = {
+        "ecole_rate": round(sum(p["agreement"]["ecole"] for p in pages) / len(pages), 3),
+        "annee_rate": round(sum(p["agreement"]["annee"] for p in pages) / len(pages), 3),
+        "niveaux_jaccard_avg": round(sum(p["agreement"]["niveaux_jaccard"] for p in pages) / len(pages), 3),
+        "titres_jaccard_avg": round(sum(p["agreement"]["titres_jaccard"] for p in pages) / len(pages), 3),
+    }
+    return resume
+
+def generer_rapport(drive_service, fichiers):
+    rapport = {"generated_at": datetime.now().isoformat(), "files": []}
+    toutes_les_pages = []
+    for fichier in fichiers:
+        print(f"\n--- Comparing modes on: {fichier['name']} ({fichier['id']}) ---")
+        succes, message, doc_obj = doc_processor.run_workflow_for_single_file(drive_service, fichier)
+        if not succes:
+            rapport["files"].append({"file_id": fichier['id'], "name": fichier['name'], "error": message})
+            continue
+        pages = []
+        document_tague = doc_processor.DocumentTague(doc_obj)
+        for page_num in document_tague.numeros_pages():
+            tagged_text_page = document_tague.texte_page(page_num)
+            if not tagged_text_page.strip(): continue
+            print(f"    -> Page {page_num}/{len(doc_obj.pages)}...")
+            pages.append({"page": page_num, **comparer_page(tagged_text_page)})
+        toutes_les_pages.extend(pages)
+        rapport["files"].append({"file_id": fichier['id'], "name": fichier['name'], "pages": pages, "summary": _resumer(pages)})
+    rapport["summary"] = _resumer(toutes_les_pages)
+    return rapport
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les modes d'extraction 'triple' et 'combine'.")
+    parser.add_argument("--file-id", action="append", default=[], help="ID Drive d'un fichier à comparer (répétable).")
+    parser.add_argument("--limit", type=int, default=3, help="Sans --file-id : nombre de fichiers pris dans le dossier Drive.")
+    parser.add_argument("--output", default=os.path.join("logs", "extraction_mode_report.json"))
+    args = parser.parse_args()
+
+    drive_service = google_drive.get_drive_service()
+    fichiers = [f for f in google_drive.lister_fichiers_recursif(drive_service, GOOGLE_DRIVE_FOLDER_ID)
+                if not args.file_id or f['id'] in args.file_id]
+    if not args.file_id:
+        fichiers = fichiers[:args.limit]
+
+    rapport = generer_rapport(drive_service, fichiers)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    print("\n--- SUMMARY ---")
+    print(json.dumps(rapport["summary"], indent=2, ensure_ascii=False))
+    print(f"Report written to {args.output}")
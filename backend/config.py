@@ -59,9 +59,127 @@ if not (DOCAI_PROJECT_ID):
     raise ValueError("DOCAI_LOCATION est manquante.")
 
 
-# Seuil de confiance pour la recherche sémantique des manuels.
-# Seules les suggestions de l'IA avec un score supérieur seront acceptées.
-SEUIL_DE_CONFIANCE = 0.85
+#------------------Ingestion (main.py)-------------------------
+# Nombre de workers par étape (téléchargement, OCR, IA). 1 = traitement séquentiel.
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+# Taille maximale des files d'attente entre les étapes du pipeline.
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "4"))
+# Appels Gemini simultanés par fichier (pages et prompts). 1 = analyse page par page.
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "1"))
+# Mode d'extraction Gemini : "triple" (école, année, niveaux séparément) ou "combine" (un seul prompt).
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "triple")
+# Découverte des fichiers Drive : "full" (listing récursif complet) ou "incremental" (API changes).
+DRIVE_DISCOVERY_MODE = os.getenv("DRIVE_DISCOVERY_MODE", "full")
+# OCR : "online" (un appel par fichier), "batch" (jobs Document AI par lots), "batch-local" (même flux par lots,
+# traité localement : tests hors ligne) ou "auto" (batch au-delà de BATCH_OCR_MIN_FILES).
+OCR_MODE = os.getenv("OCR_MODE", "auto")
+BATCH_OCR_MIN_FILES = int(os.getenv("BATCH_OCR_MIN_FILES", "20"))
+BATCH_OCR_SIZE = int(os.getenv("BATCH_OCR_SIZE", "50"))
+BATCH_OCR_POLL_SECONDS = float(os.getenv("BATCH_OCR_POLL_SECONDS", "15"))
+# Attente maximale des jobs batch ; au-delà, les fichiers restants passent par l'OCR en ligne.
+BATCH_OCR_MAX_WAIT_SECONDS = float(os.getenv("BATCH_OCR_MAX_WAIT_SECONDS", "3600"))
+# Le traitement par lots de Document AI lit et écrit dans Google Cloud Storage.
+DOCAI_BATCH_GCS_BUCKET = os.getenv("DOCAI_BATCH_GCS_BUCKET")
+DOCAI_BATCH_GCS_PREFIX = os.getenv("DOCAI_BATCH_GCS_PREFIX", "docai-batch")
+# Téléchargements Drive écrits par morceaux dans un fichier temporaire plutôt qu'en mémoire.
+DOWNLOAD_SPOOL_DIR = os.getenv("DOWNLOAD_SPOOL_DIR", os.path.join("cache", "spool"))
+DRIVE_DOWNLOAD_CHUNK_MB = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_MB", "8"))
+# Fichiers plus gros refusés (ERREUR_OCR) avant ou pendant le téléchargement.
+DRIVE_MAX_FILE_MB = int(os.getenv("DRIVE_MAX_FILE_MB", "200"))
+# Total des contenus chargés en mémoire en même temps pour l'OCR en ligne (tous workers du processus) :
+# c'est la borne du pic mémoire dû aux fichiers, une requête plus grosse passant seule.
+OCR_MAX_INFLIGHT_MB = int(os.getenv("OCR_MAX_INFLIGHT_MB", "256"))
+# PDF découpés en morceaux de pages OCR'isés en parallèle au-delà de ces seuils (limites de l'OCR en ligne
+# de Document AI : 15 pages, 20 Mo par requête ; des morceaux plus petits réduisent aussi la latence).
+OCR_SPLIT_MAX_PAGES = int(os.getenv("OCR_SPLIT_MAX_PAGES", "15"))
+OCR_SPLIT_MAX_MB = int(os.getenv("OCR_SPLIT_MAX_MB", "20"))
+OCR_SPLIT_CHUNK_PAGES = int(os.getenv("OCR_SPLIT_CHUNK_PAGES", "5"))
+OCR_SPLIT_CONCURRENCY = int(os.getenv("OCR_SPLIT_CONCURRENCY", "4"))
+
+# Pré-filtre des pages (filtre_pages.py) : sous PAGE_FILTER_MIN_SCORE, pas d'extraction des niveaux/manuels.
+PAGE_FILTER_ENABLED = os.getenv("PAGE_FILTER_ENABLED", "true").lower() == "true"
+PAGE_FILTER_MIN_SCORE = int(os.getenv("PAGE_FILTER_MIN_SCORE", "1"))
+# Pages en tableau (extraction_tableaux.py) : manuels lus sans Gemini au-delà de cette confiance (0-1).
+TABLE_EXTRACTION_ENABLED = os.getenv("TABLE_EXTRACTION_ENABLED", "true").lower() == "true"
+TABLE_EXTRACTION_MIN_CONFIDENCE = float(os.getenv("TABLE_EXTRACTION_MIN_CONFIDENCE", "0.8"))
+
+#------------------Worker résident (main.py --daemon)-------------------------
+# Délai maximal entre deux passes de découverte ; un upload via l'API réveille le worker plus tôt.
+INGESTION_POLL_SECONDS = int(os.getenv("INGESTION_POLL_SECONDS", "300"))
+# Fichier touché par l'API à chaque upload (chemin partagé entre Flask et le worker).
+INGESTION_WAKE_FILE = os.getenv("INGESTION_WAKE_FILE", os.path.join("cache", "ingestion.wake"))
+INGESTION_WAKE_CHECK_SECONDS = float(os.getenv("INGESTION_WAKE_CHECK_SECONDS", "2"))
+
+#------------------File de jobs partagée (plusieurs workers)-------------------------
+# Avec INGESTION_JOB_QUEUE=true, les fichiers découverts passent par la table jobs_ingestion :
+# plusieurs processus main.py, sur une ou plusieurs machines, se partagent le travail.
+INGESTION_JOB_QUEUE = os.getenv("INGESTION_JOB_QUEUE", "false").lower() == "true"
+# Durée d'un bail ; il est prolongé (heartbeat) tant que le worker qui le détient est vivant.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Délai avant nouvel essai d'un job en échec, doublé à chaque tentative.
+JOB_RETRY_DELAY_SECONDS = int(os.getenv("JOB_RETRY_DELAY_SECONDS", "60"))
+# Priorité donnée aux fichiers dont le retraitement est demandé depuis l'interface.
+JOB_PRIORITY_REPROCESS = int(os.getenv("JOB_PRIORITY_REPROCESS", "10"))
+
+#------------------Enregistrement / rejeu (rejeu.py, main.py --record / --replay)-------------------------
+# "record" : réponses Drive, Document AI et Gemini écrites dans RECORD_REPLAY_DIR ; "replay" : relues sans réseau.
+RECORD_REPLAY_MODE = os.getenv("RECORD_REPLAY_MODE") or None
+RECORD_REPLAY_DIR = os.getenv("RECORD_REPLAY_DIR", os.path.join("fixtures", "ingestion"))
+# Latence simulée au rejeu : durée enregistrée de l'appel multipliée par REPLAY_LATENCY_SCALE, plus REPLAY_LATENCY_MS.
+REPLAY_LATENCY_SCALE = float(os.getenv("REPLAY_LATENCY_SCALE", "0"))
+REPLAY_LATENCY_MS = float(os.getenv("REPLAY_LATENCY_MS", "0"))
+
+#------------------Limiteur de débit Gemini-------------------------
+# Quotas du projet Gemini (requêtes et tokens par minute) ; le limiteur vise GEMINI_RATE_HEADROOM de ces valeurs.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_RATE_HEADROOM = float(os.getenv("GEMINI_RATE_HEADROOM", "0.9"))
+# Appels simultanés maximum ; divisé par deux à chaque 429, puis remonté progressivement.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# Fichier d'état partagé par les workers d'une même machine (vide = limiteur propre à chaque processus).
+# Plusieurs machines sur le même projet : répartir GEMINI_RPM / GEMINI_TPM entre elles.
+GEMINI_RATE_STATE_FILE = os.getenv("GEMINI_RATE_STATE_FILE") or None
+# Plafond du backoff entre deux tentatives (et d'une pause demandée par le serveur).
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "60"))
+# Client HTTP asynchrone (client_gemini) : connexions HTTP/2 réutilisées, taille du pool, délai de réponse
+# d'une requête, et échéance d'un appel complet (attente du limiteur, tentatives et backoff compris).
+GEMINI_HTTP2 = os.getenv("GEMINI_HTTP2", "true").lower() == "true"
+GEMINI_HTTP_MAX_CONNECTIONS = int(os.getenv("GEMINI_HTTP_MAX_CONNECTIONS", "100"))
+GEMINI_HTTP_TIMEOUT_SECONDS = float(os.getenv("GEMINI_HTTP_TIMEOUT_SECONDS", "180"))
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "600"))
+
+#------------------Télémétrie (coûts estimés)-------------------------
+# Tarifs en USD servant à estimer le coût par page dans /statistics/ingestion ; à ajuster au contrat.
+GEMINI_PRICE_INPUT_PER_MTOK = float(os.getenv("GEMINI_PRICE_INPUT_PER_MTOK", "1.25"))
+GEMINI_PRICE_OUTPUT_PER_MTOK = float(os.getenv("GEMINI_PRICE_OUTPUT_PER_MTOK", "5.0"))
+DOCAI_PRICE_PER_PAGE = float(os.getenv("DOCAI_PRICE_PER_PAGE", "0.0015"))
+
+#------------------Caches disque-------------------------
+# Résultats Document AI conservés sur disque (clé : fichier + empreinte + processeur), éviction LRU par taille.
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join("cache", "ocr"))
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "2048"))
+# Réponses Gemini (clé : modèle + hash du prompt + hash du texte), avec durée de vie et éviction LRU.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join("cache", "llm"))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "512"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "720"))
+
+#------------------Standardisation (écoles, niveaux)-------------------------
+# Seuil de confiance de la standardisation locale (resolveur_standardisation.py) : une valeur brute
+# proche d'une forme connue (similarité >= seuil) est standardisée sans appeler Gemini.
+SEUIL_DE_CONFIANCE = float(os.getenv("SEUIL_DE_CONFIANCE", "0.85"))
+# Les règles de standardisation sont gardées en mémoire et relues seulement quand leur version
+# (table versions_standardisation) change ; cette version est consultée au plus une fois par intervalle.
+STANDARDISATION_VERSION_CHECK_SECONDS = float(os.getenv("STANDARDISATION_VERSION_CHECK_SECONDS", "5"))
+# Nombre de noms standardisés candidats (les plus proches lexicalement) envoyés à Gemini ; 0 = liste complète.
+# Le taux de réussite de cette présélection est affiché en fin d'ingestion pour ajuster la valeur.
+STANDARDISATION_SHORTLIST_K = int(os.getenv("STANDARDISATION_SHORTLIST_K", "15"))
+# Standardisation différée : les termes sans correspondance locale sont insérés tels quels puis standardisés
+# en fin de passe, STANDARDISATION_BATCH_SIZE termes par appel Gemini (standardisation_differee.py).
+STANDARDISATION_DEFERRED = os.getenv("STANDARDISATION_DEFERRED", "false").lower() == "true"
+STANDARDISATION_BATCH_SIZE = int(os.getenv("STANDARDISATION_BATCH_SIZE", "25"))
 
 
 
@@ -1,6 +1,7 @@
 # database.py
 import mysql.connector
 import json
+import hashlib
 from config import DB_CONFIG
 
 def get_connection():
@@ -12,17 +13,426 @@ def get_connection():
         print(f"DB connection error: {e}")
         raise
 
-def get_fichiers_traites(conn):
-    """Retrieves the IDs of files already successfully processed (status TRAITÉ)."""
+def use_read_committed(conn):
+    """Ingestion sessions read in READ COMMITTED: a row created and committed by another worker
+    is visible to the next SELECT, even inside an open transaction (see _create_once)."""
     cursor = conn.cursor()
-    # We only filter for successfully PROCESSED files to avoid re-running them.
+    cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+    cursor.close()
+
+def get_ingestion_connection():
+    conn = get_connection()
+    use_read_committed(conn)
+    return conn
+
+# Tables used only by the ingestion pipeline (main.py), created on first run.
+INGESTION_TABLES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS empreintes_fichiers (
+        id_fichier_drive VARCHAR(255) NOT NULL PRIMARY KEY,
+        empreinte VARCHAR(100) NOT NULL,
+        id_fichier_source VARCHAR(255) NULL,
+        date_enregistrement DATETIME DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_empreinte (empreinte)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS etat_synchronisation_drive (
+        cle VARCHAR(255) NOT NULL PRIMARY KEY,
+        valeur MEDIUMTEXT NULL,
+        date_maj DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints_ingestion (
+        id_fichier_drive VARCHAR(255) NOT NULL,
+        etape VARCHAR(20) NOT NULL,
+        page INT NOT NULL DEFAULT 0,
+        empreinte VARCHAR(100) NOT NULL,
+        donnees_json MEDIUMTEXT NULL,
+        date_maj DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (id_fichier_drive, etape, page)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS jobs_ingestion (
+        id_fichier_drive VARCHAR(255) NOT NULL PRIMARY KEY,
+        nom_fichier VARCHAR(255) NULL,
+        empreinte VARCHAR(100) NULL,
+        metadonnees_json TEXT NOT NULL,
+        priorite INT NOT NULL DEFAULT 0,
+        statut VARCHAR(20) NOT NULL DEFAULT 'EN_ATTENTE',
+        tentatives INT NOT NULL DEFAULT 0,
+        worker VARCHAR(255) NULL,
+        bail_expire DATETIME NULL,
+        disponible_apres DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        derniere_erreur VARCHAR(255) NULL,
+        date_creation DATETIME DEFAULT CURRENT_TIMESTAMP,
+        date_maj DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_jobs_disponibles (statut, priorite, disponible_apres),
+        INDEX idx_jobs_worker (worker)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS metriques_fichiers (
+        id_metrique INT AUTO_INCREMENT PRIMARY KEY,
+        id_fichier_drive VARCHAR(255) NOT NULL,
+        statut VARCHAR(50) NOT NULL,
+        machine VARCHAR(255) NULL,
+        date_traitement DATETIME DEFAULT CURRENT_TIMESTAMP,
+        telechargement_ms INT NULL,
+        telechargement_octets BIGINT NULL,
+        ocr_ms INT NULL,
+        ocr_pages INT NULL,
+        ocr_cache TINYINT NULL,
+        analyse_ms INT NULL,
+        llm_appels INT NULL,
+        llm_appels_cache INT NULL,
+        llm_tokens_entree INT NULL,
+        llm_tokens_sortie INT NULL,
+        llm_reessais INT NULL,
+        llm_ms INT NULL,
+        bdd_ms INT NULL,
+        bdd_lignes INT NULL,
+        total_ms INT NULL,
+        INDEX idx_metriques_fichier (id_fichier_drive),
+        INDEX idx_metriques_date (date_traitement)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS versions_standardisation (
+        nom VARCHAR(64) NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        date_maj DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS standardisation_en_attente (
+        type_entite VARCHAR(20) NOT NULL,
+        id_entite INT NOT NULL,
+        valeur_brute VARCHAR(255) NOT NULL,
+        date_ajout DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (type_entite, id_entite),
+        INDEX idx_attente_valeur (type_entite, valeur_brute)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pages_filtrees (
+        id_fichier_drive VARCHAR(255) NOT NULL,
+        page INT NOT NULL,
+        score INT NOT NULL,
+        raisons_json TEXT NULL,
+        extrait TEXT NULL,
+        date_filtrage DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id_fichier_drive, page)
+    )
+    """,
+]
+
+FILE_METRICS_COLUMNS = ('telechargement_ms', 'telechargement_octets', 'ocr_ms', 'ocr_pages', 'ocr_cache', 'analyse_ms',
+                        'llm_appels', 'llm_appels_cache', 'llm_tokens_entree', 'llm_tokens_sortie', 'llm_reessais', 'llm_ms',
+                        'bdd_ms', 'bdd_lignes', 'total_ms')
+
+def init_ingestion_tables(conn):
+    """Creates the ingestion support tables if they do not exist yet."""
+    cursor = conn.cursor()
+    try:
+        for ddl in INGESTION_TABLES_DDL:
+            cursor.execute(ddl)
+        conn.commit()
+    finally:
+        cursor.close()
+
+def get_fichiers_traites(conn, file_ids=None):
+    """Retrieves the IDs of files already successfully processed (status TRAITÉ or DOUBLON).
+
+    With `file_ids`, only those files are looked up instead of the whole log table.
+    """
+    if file_ids is not None and not file_ids: return set()
+    cursor = conn.cursor()
+    # We only filter for successfully PROCESSED files (or duplicates of one) to avoid re-running them.
     # Those with errors (ERREUR_EXTRACTION, etc.) will be reprocessed.
-    query = "SELECT id_fichier_drive FROM logs_fichiers WHERE statut = 'TRAITÉ'"
-    cursor.execute(query)
+    query = "SELECT id_fichier_drive FROM logs_fichiers WHERE statut IN ('TRAITÉ', 'DOUBLON')"
+    params = ()
+    if file_ids is not None:
+        params = tuple(file_ids)
+        query += f" AND id_fichier_drive IN ({', '.join(['%s'] * len(params))})"
+    cursor.execute(query, params)
     fichiers_traites = {row[0] for row in cursor.fetchall()}
     cursor.close()
     return fichiers_traites
 
+def get_fichier_par_empreinte(conn, empreinte, file_id_exclu):
+    """Returns the Drive ID of an already processed (TRAITÉ) file with the same content fingerprint, or None."""
+    cursor = conn.cursor()
+    query = """
+        SELECT e.id_fichier_drive FROM empreintes_fichiers e
+        JOIN logs_fichiers l ON l.id_fichier_drive = e.id_fichier_drive
+        WHERE e.empreinte = %s AND l.statut = 'TRAITÉ' AND e.id_fichier_source IS NULL AND e.id_fichier_drive != %s
+        LIMIT 1
+    """
+    cursor.execute(query, (empreinte, file_id_exclu))
+    result = cursor.fetchone()
+    cursor.close()
+    return result[0] if result else None
+
+def enregistrer_empreinte(conn, file_id, empreinte, id_fichier_source=None):
+    """Stores the content fingerprint of a file; id_fichier_source is set when the file is a duplicate."""
+    cursor = conn.cursor()
+    query = """
+        INSERT INTO empreintes_fichiers (id_fichier_drive, empreinte, id_fichier_source)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE empreinte = VALUES(empreinte), id_fichier_source = VALUES(id_fichier_source)
+    """
+    cursor.execute(query, (file_id, empreinte, id_fichier_source))
+    conn.commit()
+    cursor.close()
+
+def get_empreinte(conn, file_id):
+    """Returns the stored content fingerprint of a file, or None."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT empreinte FROM empreintes_fichiers WHERE id_fichier_drive = %s", (file_id,))
+    result = cursor.fetchone()
+    cursor.close()
+    return result[0] if result else None
+
+def get_fichiers_a_reessayer(conn):
+    """Retrieves the IDs of logged files that are not in a final state (errors, pending, modified)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT id_fichier_drive FROM logs_fichiers WHERE statut NOT IN ('TRAITÉ', 'DOUBLON')")
+    fichiers = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return fichiers
+
+def get_etat_sync(conn, cle):
+    """Reads a Drive synchronisation value (changes cursor, known folders...)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT valeur FROM etat_synchronisation_drive WHERE cle = %s", (cle,))
+    result = cursor.fetchone()
+    cursor.close()
+    return result[0] if result else None
+
+def set_etat_sync(conn, cle, valeur):
+    cursor = conn.cursor()
+    query = """
+        INSERT INTO etat_synchronisation_drive (cle, valeur) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE valeur = VALUES(valeur)
+    """
+    cursor.execute(query, (cle, valeur))
+    conn.commit()
+    cursor.close()
+
+def get_checkpoints(conn, file_id, empreinte):
+    """Returns the checkpoints recorded for this version (fingerprint) of a file."""
+    cursor = conn.cursor(dictionary=True)
+    query = "SELECT etape, page, donnees_json FROM checkpoints_ingestion WHERE id_fichier_drive = %s AND empreinte = %s"
+    cursor.execute(query, (file_id, empreinte))
+    checkpoints = cursor.fetchall()
+    cursor.close()
+    return checkpoints
+
+def save_checkpoint(conn, file_id, empreinte, etape, page=0, donnees=None, commit=True):
+    """Records that a processing stage (or page) is complete, with its result if any."""
+    cursor = conn.cursor()
+    query = """
+        INSERT INTO checkpoints_ingestion (id_fichier_drive, etape, page, empreinte, donnees_json)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE empreinte = VALUES(empreinte), donnees_json = VALUES(donnees_json)
+    """
+    donnees_json = json.dumps(donnees, ensure_ascii=False) if donnees is not None else None
+    cursor.execute(query, (file_id, etape, page, empreinte, donnees_json))
+    if commit: conn.commit()
+    cursor.close()
+
+def clear_checkpoints(conn, file_id):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM checkpoints_ingestion WHERE id_fichier_drive = %s", (file_id,))
+    conn.commit()
+    cursor.close()
+
+def acquire_named_lock(conn, name, timeout=30):
+    """Takes a MySQL named lock (GET_LOCK), held by the session until released. Returns its key, or None on timeout."""
+    # GET_LOCK names are limited to 64 characters.
+    key = "smartlists:" + hashlib.sha1(name.encode('utf-8')).hexdigest()
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (key, timeout))
+    result = cursor.fetchone()
+    cursor.close()
+    return key if result and result[0] == 1 else None
+
+def release_named_locks(conn, keys):
+    cursor = conn.cursor()
+    for key in keys:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (key,))
+        cursor.fetchone()
+    cursor.close()
+
+def enqueue_jobs(conn, jobs):
+    """Adds or refreshes ingestion jobs: (file_id, file_name, fingerprint, metadata dict, priority) tuples.
+
+    A finished or failed job only goes back to the queue if the file content changed;
+    a job currently leased by a worker is left untouched.
+    """
+    if not jobs: return
+    cursor = conn.cursor()
+    # Assignments are evaluated left to right: `empreinte` must be updated last.
+    query = """
+        INSERT INTO jobs_ingestion (id_fichier_drive, nom_fichier, empreinte, metadonnees_json, priorite)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            tentatives = IF(statut IN ('TERMINE', 'ECHEC') AND NOT (empreinte <=> VALUES(empreinte)), 0, tentatives),
+            statut = IF(statut IN ('TERMINE', 'ECHEC') AND NOT (empreinte <=> VALUES(empreinte)), 'EN_ATTENTE', statut),
+            priorite = GREATEST(priorite, VALUES(priorite)),
+            nom_fichier = VALUES(nom_fichier),
+            metadonnees_json = VALUES(metadonnees_json),
+            empreinte = VALUES(empreinte)
+    """
+    cursor.executemany(query, [(file_id, name, empreinte, json.dumps(meta, ensure_ascii=False), priorite)
+                               for file_id, name, empreinte, meta, priorite in jobs])
+    conn.commit()
+    cursor.close()
+
+def claim_jobs(conn, worker, limit, lease_seconds, max_attempts):
+    """Leases up to `limit` available jobs to `worker` (SELECT ... FOR UPDATE SKIP LOCKED). Returns their metadata dicts.
+
+    Jobs whose lease expired are taken over, or marked ECHEC once they used all their attempts.
+    The claim is committed on its own: `conn` must not have a transaction open (see job_queue.reserver).
+    """
+    if conn.in_transaction:
+        raise RuntimeError("claim_jobs needs a connection without an open transaction; committing it would commit the caller's work.")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT id_fichier_drive, metadonnees_json, statut, tentatives FROM jobs_ingestion
+            WHERE (statut = 'EN_ATTENTE' AND disponible_apres <= NOW()) OR (statut = 'EN_COURS' AND bail_expire < NOW())
+            ORDER BY priorite DESC, disponible_apres
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        rows = cursor.fetchall()
+        abandoned = [r['id_fichier_drive'] for r in rows if r['statut'] == 'EN_COURS' and r['tentatives'] >= max_attempts]
+        claimed = [r for r in rows if r['id_fichier_drive'] not in abandoned]
+        if abandoned:
+            placeholders = ', '.join(['%s'] * len(abandoned))
+            cursor.execute(f"""
+                UPDATE jobs_ingestion SET statut = 'ECHEC', worker = NULL, bail_expire = NULL,
+                    derniere_erreur = 'Lease expired after the last attempt.'
+                WHERE id_fichier_drive IN ({placeholders})
+            """, tuple(abandoned))
+        if claimed:
+            placeholders = ', '.join(['%s'] * len(claimed))
+            cursor.execute(f"""
+                UPDATE jobs_ingestion SET statut = 'EN_COURS', worker = %s, tentatives = tentatives + 1,
+                    bail_expire = NOW() + INTERVAL %s SECOND
+                WHERE id_fichier_drive IN ({placeholders})
+            """, (worker, lease_seconds) + tuple(r['id_fichier_drive'] for r in claimed))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return [json.loads(r['metadonnees_json']) for r in claimed]
+
+def extend_job_leases(conn, worker, lease_seconds):
+    """Heartbeat: pushes back the lease expiry of every job held by `worker`."""
+    cursor = conn.cursor()
+    query = "UPDATE jobs_ingestion SET bail_expire = NOW() + INTERVAL %s SECOND WHERE worker = %s AND statut = 'EN_COURS'"
+    cursor.execute(query, (lease_seconds, worker))
+    conn.commit()
+    cursor.close()
+
+def complete_job(conn, file_id, worker, success, message="", max_attempts=3, retry_delay_seconds=60):
+    """Ends a leased job: TERMINE on success, otherwise back to the queue with exponential backoff, or ECHEC."""
+    cursor = conn.cursor()
+    if success:
+        query = """
+            UPDATE jobs_ingestion SET statut = 'TERMINE', worker = NULL, bail_expire = NULL, derniere_erreur = NULL
+            WHERE id_fichier_drive = %s AND worker = %s
+        """
+        params = (file_id, worker)
+    else:
+        query = """
+            UPDATE jobs_ingestion SET
+                statut = IF(tentatives >= %s, 'ECHEC', 'EN_ATTENTE'),
+                disponible_apres = NOW() + INTERVAL (%s * POW(2, tentatives - 1)) SECOND,
+                worker = NULL, bail_expire = NULL, derniere_erreur = %s
+            WHERE id_fichier_drive = %s AND worker = %s
+        """
+        params = (max_attempts, retry_delay_seconds, (message or "")[:255], file_id, worker)
+    # The `worker` condition ignores a result whose lease was already taken over by another worker.
+    cursor.execute(query, params)
+    conn.commit()
+    cursor.close()
+
+def release_jobs(conn, worker):
+    """Returns the jobs still leased by `worker` to the queue without counting the attempt (graceful stop)."""
+    cursor = conn.cursor()
+    query = """
+        UPDATE jobs_ingestion SET statut = 'EN_ATTENTE', tentatives = GREATEST(tentatives - 1, 0), worker = NULL, bail_expire = NULL
+        WHERE worker = %s AND statut = 'EN_COURS'
+    """
+    cursor.execute(query, (worker,))
+    conn.commit()
+    released = cursor.rowcount
+    cursor.close()
+    return released
+
+def requeue_job(conn, file_id, priorite=0):
+    """Puts a file's job back in the queue immediately (no effect if it is currently leased or unknown)."""
+    cursor = conn.cursor()
+    query = """
+        UPDATE jobs_ingestion SET statut = 'EN_ATTENTE', tentatives = 0, disponible_apres = NOW(), priorite = GREATEST(priorite, %s)
+        WHERE id_fichier_drive = %s AND statut != 'EN_COURS'
+    """
+    cursor.execute(query, (priorite, file_id))
+    conn.commit()
+    cursor.close()
+
+def save_file_metrics(conn, file_id, statut, machine, metrics):
+    """Stores one row of ingestion metrics for a processed file (unknown metric names are ignored)."""
+    columns = [c for c in FILE_METRICS_COLUMNS if c in metrics]
+    query = f"""
+        INSERT INTO metriques_fichiers (id_fichier_drive, statut, machine{''.join(', ' + c for c in columns)})
+        VALUES (%s, %s, %s{', %s' * len(columns)})
+    """
+    cursor = conn.cursor()
+    cursor.execute(query, (file_id, statut, machine) + tuple(metrics[c] for c in columns))
+    conn.commit()
+    cursor.close()
+
+def get_file_metrics(conn, days):
+    """Returns the ingestion metrics rows of the last `days` days."""
+    cursor = conn.cursor(dictionary=True)
+    query = "SELECT * FROM metriques_fichiers WHERE date_traitement >= NOW() - INTERVAL %s DAY"
+    cursor.execute(query, (days,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def get_known_publishers(conn):
+    """Returns the distinct publisher names already recorded on textbooks."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT editeur FROM manuels WHERE editeur IS NOT NULL AND editeur <> ''")
+    publishers = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return publishers
+
+def log_filtered_pages(conn, rows):
+    """Records pages skipped by the page filter: rows of (file_id, page, score, reasons dict, excerpt)."""
+    query = """
+        INSERT INTO pages_filtrees (id_fichier_drive, page, score, raisons_json, extrait)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE score = VALUES(score), raisons_json = VALUES(raisons_json),
+                                extrait = VALUES(extrait), date_filtrage = NOW()
+    """
+    cursor = conn.cursor()
+    cursor.executemany(query, [(file_id, page, score, json.dumps(reasons, ensure_ascii=False), excerpt)
+                               for file_id, page, score, reasons, excerpt in rows])
+    conn.commit()
+    cursor.close()
+
 def get_standardisation_knowledge_base(conn, entity_type: str):
     cursor = conn.cursor(dictionary=True)
     query = f"SELECT valeur_brute, nom_standardise FROM standardisation_{entity_type} WHERE statut = 'VALIDÉ'"
@@ -33,6 +443,29 @@ def get_standardisation_knowledge_base(conn, entity_type: str):
         print(f"    -> WARNING: The knowledge base for '{entity_type}' is empty.")
     return knowledge_base
 
+def get_standardisation_versions(conn):
+    """Version stamps of the standardisation rules, {table_name: version}; None if they cannot be read
+    (versions_standardisation not created yet), in which case callers must reload the rules."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT nom, version FROM versions_standardisation")
+        return dict(cursor.fetchall())
+    except mysql.connector.Error as e:
+        print(f"    -> WARNING: could not read standardisation versions: {e}")
+        return None
+    finally:
+        cursor.close()
+
+def bump_standardisation_version(cursor, table_name: str):
+    """Marks the rules of `table_name` as changed, in the caller's transaction (committed by the caller).
+
+    Processes caching the knowledge base (resolveur_standardisation.charger) reload it on their next check.
+    Errors propagate: a rule change must not commit without its version bump, or workers would keep
+    serving the old rules (and a deadlock has already rolled the caller's transaction back).
+    """
+    cursor.execute("INSERT INTO versions_standardisation (nom, version) VALUES (%s, 1) "
+                   "ON DUPLICATE KEY UPDATE version = version + 1", (table_name,))
+
 def learn_new_standardisation(conn, valeur_brute: str, nom_standardise: str, entity_type: str):
     if not all([valeur_brute, nom_standardise, entity_type]): return
     valeur_propre = ' '.join(valeur_brute.lower().strip().split())
@@ -44,13 +477,161 @@ def learn_new_standardisation(conn, valeur_brute: str, nom_standardise: str, ent
     """
     try:
         cursor.execute(query, (valeur_propre, nom_standardise))
+        # rowcount 2: an existing rule was changed (possibly a VALIDÉ one, now back to review).
+        # A new row is only a suggestion to review and leaves the knowledge base unchanged.
+        if cursor.rowcount == 2: bump_standardisation_version(cursor, f"standardisation_{entity_type}")
         conn.commit()
     except Exception as e:
+        conn.rollback()  # Neither the rule without its version bump, nor the reverse
         print(f"    -> ERROR during standardisation learning for '{valeur_brute}': {e}")
     finally:
         cursor.close()
 
-def get_or_create_entity_id(conn, cache_dict, entity_value, table_name, column_name):
+def learn_new_standardisations(conn, entity_type: str, paires, commit=True):
+    """Bulk learn_new_standardisation for [(valeur_brute, nom_standardise), ...], with a single executemany.
+
+    As in learn_new_standardisation, the version is only bumped when an existing rule changed: new rows are
+    suggestions to review, which no cached knowledge base uses.
+    """
+    lignes = [(' '.join(brute.lower().strip().split()), nom) for brute, nom in paires if brute and nom]
+    if not lignes: return
+    table = f"standardisation_{entity_type}"
+    cursor = conn.cursor()
+    try:
+        # The per-row rowcount is not available for a batch: the existing rules are read first, locked until commit.
+        placeholders = ', '.join(['%s'] * len(lignes))
+        cursor.execute(f"SELECT valeur_brute, nom_standardise, statut FROM {table} WHERE valeur_brute IN ({placeholders}) FOR UPDATE",
+                       tuple(brute for brute, _ in lignes))
+        existantes = {brute.lower(): (nom, statut) for brute, nom, statut in cursor.fetchall()}
+        cursor.executemany(f"""
+            INSERT INTO {table} (valeur_brute, nom_standardise, statut)
+            VALUES (%s, %s, 'À_VÉRIFIER')
+            ON DUPLICATE KEY UPDATE nom_standardise = VALUES(nom_standardise), statut = 'À_VÉRIFIER'
+        """, lignes)
+        if any(brute in existantes and existantes[brute] != (nom, 'À_VÉRIFIER') for brute, nom in lignes):
+            bump_standardisation_version(cursor, table)
+        if commit: conn.commit()
+    finally:
+        cursor.close()
+
+def add_pending_standardisation(conn, entity_type: str, valeur_brute: str, id_entite: int, commit=True):
+    """Records the entity `id_entite`, created under the raw term `valeur_brute`, to be standardised later
+    (deferred standardisation). Only entities recorded here are ever renamed or merged by it."""
+    cursor = conn.cursor()
+    cursor.execute("INSERT IGNORE INTO standardisation_en_attente (type_entite, id_entite, valeur_brute) VALUES (%s, %s, %s)",
+                   (entity_type, id_entite, valeur_brute))
+    if commit: conn.commit()
+    cursor.close()
+
+def get_pending_standardisations(conn, entity_type: str):
+    """Returns {raw term: [ids of the entities created under it]}, oldest terms first."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT valeur_brute, id_entite FROM standardisation_en_attente WHERE type_entite = %s ORDER BY date_ajout, id_entite",
+                   (entity_type,))
+    en_attente = {}
+    for valeur_brute, id_entite in cursor.fetchall():
+        en_attente.setdefault(valeur_brute, []).append(id_entite)
+    cursor.close()
+    return en_attente
+
+def delete_pending_standardisations(conn, entity_type: str, valeurs, commit=True):
+    if not valeurs: return
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM standardisation_en_attente WHERE type_entite = %s AND valeur_brute = %s",
+                       [(entity_type, valeur) for valeur in valeurs])
+    if commit: conn.commit()
+    cursor.close()
+
+# Standardised entities: (table, id column, name column, entite_type in source_locations).
+STANDARDISED_ENTITIES = {
+    'ecoles': ('ecoles', 'id_ecole', 'nom_ecole', 'ecole'),
+    'niveaux': ('niveaux', 'id_niveau', 'nom_niveau', 'niveau'),
+}
+
+def merge_standardised_entity(conn, entity_type: str, ancien_nom: str, ids_provisoires, nouveau_nom: str, locks):
+    """Renames the provisional entities `ids_provisoires` (created under the raw name `ancien_nom` and
+    recorded by add_pending_standardisation) to `nouveau_nom`, or merges them into the existing `nouveau_nom`
+    entity: lists, textbooks and source locations are moved, then they are deleted. Only those ids, still
+    named `ancien_nom` and À_VÉRIFIER, are touched: another entity sharing the raw name is left alone.
+
+    Runs in the caller's transaction; the named locks taken (same keys as get_or_create_entity_id and
+    get_or_create_liste_id) are appended to `locks`, to be released after the commit.
+    Returns the number of provisional entities patched.
+    """
+    table, id_column, name_column, entite_type = STANDARDISED_ENTITIES[entity_type]
+    for nom in sorted({ancien_nom, nouveau_nom}):
+        key = acquire_named_lock(conn, f"{table}:{nom}")
+        if not key: raise RuntimeError(f"Timed out waiting for lock '{table}:{nom}'")
+        locks.append(key)
+    if not ids_provisoires: return 0
+    cursor = conn.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(ids_provisoires))
+        cursor.execute(f"""SELECT {id_column} FROM {table} WHERE {id_column} IN ({placeholders})
+                           AND {name_column} = %s AND statut = 'À_VÉRIFIER' ORDER BY {id_column}""",
+                       tuple(ids_provisoires) + (ancien_nom,))
+        provisoires = [row[0] for row in cursor.fetchall()]
+        if not provisoires: return 0
+        cursor.execute(f"SELECT {id_column} FROM {table} WHERE {name_column} = %s ORDER BY {id_column} LIMIT 1", (nouveau_nom,))
+        row = cursor.fetchone()
+        if row:
+            cible = row[0]
+        else:
+            cible = provisoires.pop(0)
+            cursor.execute(f"UPDATE {table} SET {name_column} = %s WHERE {id_column} = %s", (nouveau_nom, cible))
+        for ancien_id in provisoires:
+            _move_lists(conn, cursor, id_column, ancien_id, cible, locks)
+            if entity_type == 'niveaux':
+                cursor.execute("UPDATE manuels SET id_niveau = %s WHERE id_niveau = %s", (cible, ancien_id))
+            cursor.execute("UPDATE source_locations SET entite_id = %s WHERE entite_type = %s AND entite_id = %s",
+                           (cible, entite_type, ancien_id))
+            cursor.execute(f"DELETE FROM {table} WHERE {id_column} = %s", (ancien_id,))
+        return len(provisoires) + (0 if row else 1)
+    finally:
+        cursor.close()
+
+def _move_lists(conn, cursor, id_column, ancien_id, cible, locks):
+    """Points the lists of entity `ancien_id` to `cible`; a list that already exists for `cible` (same
+    school, year and level) receives the textbooks of the duplicate, which is deleted."""
+    cursor.execute(f"SELECT id_liste, id_ecole, id_annee, id_niveau FROM listes_scolaires WHERE {id_column} = %s", (ancien_id,))
+    for id_liste, id_ecole, id_annee, id_niveau in cursor.fetchall():
+        ids = {'id_ecole': id_ecole, 'id_annee': id_annee, 'id_niveau': id_niveau, id_column: cible}
+        key = acquire_named_lock(conn, f"listes_scolaires:{ids['id_ecole']}:{ids['id_annee']}:{ids['id_niveau']}")
+        if not key: raise RuntimeError("Timed out waiting for a list lock")
+        locks.append(key)
+        cursor.execute("SELECT id_liste FROM listes_scolaires WHERE id_ecole = %s AND id_annee = %s AND id_niveau = %s",
+                       (ids['id_ecole'], ids['id_annee'], ids['id_niveau']))
+        existante = cursor.fetchone()
+        if existante:
+            cursor.execute("INSERT IGNORE INTO liste_manuels (id_liste, id_manuel) SELECT %s, id_manuel FROM liste_manuels WHERE id_liste = %s",
+                           (existante[0], id_liste))
+            cursor.execute("DELETE FROM liste_manuels WHERE id_liste = %s", (id_liste,))
+            cursor.execute("DELETE FROM listes_scolaires WHERE id_liste = %s", (id_liste,))
+        else:
+            cursor.execute(f"UPDATE listes_scolaires SET {id_column} = %s WHERE id_liste = %s", (cible, id_liste))
+
+def _create_once(conn, cursor, lock_name, locks, query_select, params_select, query_insert, params_insert, commit, created=None):
+    """SELECT again under a named lock, then INSERT only if the row is still missing.
+
+    Concurrent workers can thus not create the same row twice. With commit=False the lock must
+    outlive the caller's transaction: its key is appended to `locks`, to be released by the
+    caller after its commit or rollback. The id of an inserted row is appended to `created`, if given.
+    """
+    key = acquire_named_lock(conn, lock_name)
+    if not key: raise RuntimeError(f"Timed out waiting for lock '{lock_name}'")
+    try:
+        cursor.execute(query_select, params_select)
+        result = cursor.fetchone()
+        if result: return result[0]
+        cursor.execute(query_insert, params_insert)
+        if commit: conn.commit()
+        if created is not None: created.append(cursor.lastrowid)
+        return cursor.lastrowid
+    finally:
+        if commit or locks is None: release_named_locks(conn, [key])
+        else: locks.append(key)
+
+def get_or_create_entity_id(conn, cache_dict, entity_value, table_name, column_name, commit=True, locks=None, created=None):
     if not entity_value or not isinstance(entity_value, str): return None
     cache_key = f"{table_name}:{entity_value}"
     if cache_key in cache_dict: return cache_dict[cache_key]
@@ -64,14 +645,13 @@ def get_or_create_entity_id(conn, cache_dict, entity_value, table_name, column_n
     entity_id = result[0] if result else None
     if not entity_id:
         query_insert = f"INSERT INTO {table_name} ({column_name}, statut) VALUES (%s, 'À_VÉRIFIER')"
-        cursor.execute(query_insert, (entity_value,))
-        conn.commit()
-        entity_id = cursor.lastrowid
+        entity_id = _create_once(conn, cursor, f"{table_name}:{entity_value}", locks,
+                                 query_select, (entity_value,), query_insert, (entity_value,), commit, created)
     cache_dict[cache_key] = entity_id
     cursor.close()
     return entity_id
 
-def get_or_create_liste_id(conn, id_ecole, id_annee, id_niveau, source_file_id):
+def get_or_create_liste_id(conn, id_ecole, id_annee, id_niveau, source_file_id, commit=True, locks=None):
     cursor = conn.cursor()
     query_select = "SELECT id_liste FROM listes_scolaires WHERE id_ecole = %s AND id_annee = %s AND id_niveau = %s"
     cursor.execute(query_select, (id_ecole, id_annee, id_niveau))
@@ -79,13 +659,13 @@ def get_or_create_liste_id(conn, id_ecole, id_annee, id_niveau, source_file_id):
     liste_id = result[0] if result else None
     if not liste_id:
         query_insert = "INSERT INTO listes_scolaires (id_ecole, id_annee, id_niveau, source_file_id, statut) VALUES (%s, %s, %s, %s, 'A_VERIFIER')"
-        cursor.execute(query_insert, (id_ecole, id_annee, id_niveau, source_file_id))
-        conn.commit()
-        liste_id = cursor.lastrowid
+        liste_id = _create_once(conn, cursor, f"listes_scolaires:{id_ecole}:{id_annee}:{id_niveau}", locks,
+                                query_select, (id_ecole, id_annee, id_niveau),
+                                query_insert, (id_ecole, id_annee, id_niveau, source_file_id), commit)
     cursor.close()
     return liste_id
 
-def inserer_manuel(conn, manuel_data, id_niveau):
+def inserer_manuel(conn, manuel_data, id_niveau, commit=True):
     cursor = conn.cursor()
     colonnes = ['titre', 'editeur', 'annee_edition', 'isbn', 'type', 'matiere', 'id_niveau', 'statut']
     # --- DÉBUT DE LA MODIFICATION : Correction de la clé pour la matière ---
@@ -104,19 +684,19 @@ def inserer_manuel(conn, manuel_data, id_niveau):
     placeholders = ', '.join(['%s'] * len(colonnes))
     query = f"INSERT INTO manuels ({', '.join(colonnes)}) VALUES ({placeholders})"
     cursor.execute(query, donnees)
-    conn.commit()
+    if commit: conn.commit()
     manuel_id = cursor.lastrowid
     cursor.close()
     return manuel_id
 
-def creer_lien_liste_manuel(conn, id_liste, id_manuel):
+def creer_lien_liste_manuel(conn, id_liste, id_manuel, commit=True):
     cursor = conn.cursor()
     query = "INSERT IGNORE INTO liste_manuels (id_liste, id_manuel) VALUES (%s, %s)"
     cursor.execute(query, (id_liste, id_manuel))
-    conn.commit()
+    if commit: conn.commit()
     cursor.close()
 
-def save_extraction_positions(conn, file_id, entity_map, position_mapping):
+def save_extraction_positions(conn, file_id, entity_map, position_mapping, commit=True):
     locations_to_insert = []
     def prepare_location(entity_type, entity_info):
         entity_id = entity_info.get('id')
@@ -130,16 +710,20 @@ def save_extraction_positions(conn, file_id, entity_map, position_mapping):
         prepare_location('niveau', {'id': niveau_id, 'source_tags': niveau_info.get('source_tags', [])})
     for manuel_id, manuel_info in entity_map.get('manuels', {}).items():
         prepare_location('manuel', {'id': manuel_id, 'source_tags': manuel_info.get('source_tags', [])})
-    if not locations_to_insert: return
+    if not locations_to_insert: return 0
     query = "INSERT INTO source_locations (source_file_id, entite_type, entite_id, page_number, coordonnees_json) VALUES (%s, %s, %s, %s, %s)"
     cursor = conn.cursor()
     try:
         cursor.executemany(query, locations_to_insert)
-        conn.commit()
+        if commit: conn.commit()
         print(f"  -> {len(locations_to_insert)} positions saved.")
+        return len(locations_to_insert)
     except Exception as e:
         print(f"    -> ERROR during position insertion: {e}")
+        # Inside a caller's transaction, the error propagates so the whole file is rolled back as one unit.
+        if not commit: raise
         conn.rollback()
+        return 0
     finally: cursor.close()
 
 def log_to_db(conn, file_id, file_name, mime_type, statut, message=""):
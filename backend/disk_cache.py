@@ -0,0 +1,108 @@
+# disk_cache.py
+# Cache disque adressé par contenu : chaque entrée est un fichier compressé (zlib) dont le nom
+# est le SHA-256 de sa clé. La taille totale est bornée ; au-delà, les entrées les moins
+# récemment utilisées sont supprimées (la date d'accès est mise à jour à chaque lecture).
+# Une durée de vie optionnelle (ttl) invalide les entrées trop anciennes.
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+class DiskCache:
+    def __init__(self, dossier, max_bytes, ttl=None, nom="cache"):
+        self.dossier = dossier
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nom = nom
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(dossier, exist_ok=True)
+        self._taille_totale = sum(taille for _, taille, _ in self._entrees())
+
+    def _chemin(self, cle):
+        empreinte = hashlib.sha256(cle.encode('utf-8')).hexdigest()
+        return os.path.join(self.dossier, empreinte[:2], empreinte + ".z")
+
+    def _entrees(self):
+        """Liste (chemin, taille, date du dernier accès) de toutes les entrées."""
+        entrees = []
+        for racine, _, fichiers in os.walk(self.dossier):
+            for nom in fichiers:
+                if not nom.endswith(".z"): continue
+                chemin = os.path.join(racine, nom)
+                try:
+                    st = os.stat(chemin)
+                    entrees.append((chemin, st.st_size, st.st_atime))
+                except FileNotFoundError:
+                    pass
+        return entrees
+
+    def get(self, cle):
+        """Retourne la valeur (bytes) associée à `cle`, ou None."""
+        chemin = self._chemin(cle)
+        try:
+            st = os.stat(chemin)
+            if self.ttl is not None and time.time() - st.st_mtime > self.ttl:
+                self._supprimer(chemin, st.st_size)
+                raise FileNotFoundError(chemin)
+            with open(chemin, 'rb') as f:
+                valeur = zlib.decompress(f.read())
+            os.utime(chemin, (time.time(), st.st_mtime))  # Marque l'entrée comme récemment utilisée
+        except (FileNotFoundError, zlib.error, OSError):
+            with self._lock: self.stats["misses"] += 1
+            return None
+        with self._lock: self.stats["hits"] += 1
+        return valeur
+
+    def contient(self, cle):
+        """Indique si une entrée encore valide existe pour `cle`, sans la lire ni compter de hit/miss."""
+        try:
+            st = os.stat(self._chemin(cle))
+        except OSError:
+            return False
+        return self.ttl is None or time.time() - st.st_mtime <= self.ttl
+
+    def set(self, cle, valeur: bytes):
+        """Enregistre `valeur` sous `cle` puis applique la limite de taille."""
+        chemin = self._chemin(cle)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        donnees = zlib.compress(valeur, 6)
+        if len(donnees) > self.max_bytes:
+            return
+        ancienne_taille = os.path.getsize(chemin) if os.path.exists(chemin) else 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(chemin))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(donnees)
+        os.replace(tmp, chemin)  # Écriture atomique : un lecteur concurrent ne voit jamais un fichier partiel
+        with self._lock:
+            self.stats["writes"] += 1
+            self._taille_totale += len(donnees) - ancienne_taille
+            depassement = self._taille_totale > self.max_bytes
+        if depassement:
+            self._evincer()
+
+    def _supprimer(self, chemin, taille):
+        try:
+            os.remove(chemin)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._taille_totale -= taille
+
+    def _evincer(self):
+        """Supprime les entrées les moins récemment utilisées jusqu'à repasser sous 90 % de la limite."""
+        cible = int(self.max_bytes * 0.9)
+        entrees = sorted(self._entrees(), key=lambda e: e[2])
+        with self._lock:
+            self._taille_totale = sum(taille for _, taille, _ in entrees)
+        for chemin, taille, _ in entrees:
+            if self._taille_totale <= cible: break
+            self._supprimer(chemin, taille)
+            with self._lock: self.stats["evictions"] += 1
+
+    def resume(self):
+        with self._lock:
+            return f"{self.nom}: {self.stats['hits']} hit(s), {self.stats['misses']} miss(es), " \
+                   f"{self.stats['writes']} write(s), {self.stats['evictions']} eviction(s), {self._taille_totale // 1024} KiB"
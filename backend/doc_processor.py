@@ -1,77 +1,315 @@
 # doc_processor_improved.py
+import io
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import documentai
 from google.api_core.client_options import ClientOptions
+from pypdf import PdfReader, PdfWriter
 import google_drive
-from config import DOCAI_LOCATION, DOCAI_PROCESSOR_ID, DOCAI_PROJECT_ID
+import spool
+from disk_cache import DiskCache
+from config import DOCAI_LOCATION, DOCAI_PROCESSOR_ID, DOCAI_PROJECT_ID, OCR_CACHE_ENABLED, OCR_CACHE_DIR, OCR_CACHE_MAX_MB, DRIVE_MAX_FILE_MB
+from config import OCR_SPLIT_MAX_PAGES, OCR_SPLIT_MAX_MB, OCR_SPLIT_CHUNK_PAGES, OCR_SPLIT_CONCURRENCY
 
-def run_workflow_for_single_file(service, fichier):
-    """Lance le traitement OCR via Document AI pour un seul fichier."""
-    print(f"  -> Lancement de l'OCR pour {fichier['name']}...")
-    file_content = google_drive.telecharger_fichier(service, fichier['id'])
-    if not file_content:
-        return False, "Échec du téléchargement depuis Drive", None
+SUPPORTED_MIME_TYPES = ['application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/tiff']
 
-    opts = ClientOptions(api_endpoint=f'{DOCAI_LOCATION}-documentai.googleapis.com')
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
-    name = client.processor_path(DOCAI_PROJECT_ID, DOCAI_LOCATION, DOCAI_PROCESSOR_ID)
+_client = None
+_client_lock = threading.Lock()
+
+def _get_docai_client():
+    """Retourne un client Document AI partagé (le client gRPC est thread-safe)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            opts = ClientOptions(api_endpoint=f'{DOCAI_LOCATION}-documentai.googleapis.com')
+            _client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    return _client
+
+# --- Cache des résultats OCR ---
+# Les documents Document AI sont conservés sur disque, indexés par ID de fichier, empreinte
+# du contenu et processeur, pour qu'un retraitement (ex: /processing/<id>/reprocess après un
+# changement de prompt) ou un débogage ne repaie pas l'OCR.
+ocr_cache = DiskCache(OCR_CACHE_DIR, OCR_CACHE_MAX_MB * 1024 * 1024, nom="OCR cache") if OCR_CACHE_ENABLED else None
 
+def _cle_ocr(file_id, empreinte):
+    return f"{file_id}:{empreinte}:{DOCAI_PROCESSOR_ID}"
+
+def ocr_en_cache(file_id, empreinte):
+    """Indique si un résultat OCR est disponible sur disque pour ce fichier et ce contenu."""
+    return bool(ocr_cache and empreinte and ocr_cache.contient(_cle_ocr(file_id, empreinte)))
+
+def charger_ocr(file_id, empreinte):
+    """Charge depuis le disque le documentai.Document d'un fichier déjà passé à l'OCR, ou None."""
+    if not ocr_cache or not empreinte: return None
+    donnees = ocr_cache.get(_cle_ocr(file_id, empreinte))
+    return documentai.Document.deserialize(donnees) if donnees else None
+
+def sauver_ocr(file_id, empreinte, document):
+    """Enregistre sur disque le résultat OCR d'un fichier (sans effet si le cache est désactivé)."""
+    if not ocr_cache or not empreinte: return
+    try:
+        ocr_cache.set(_cle_ocr(file_id, empreinte), documentai.Document.serialize(document))
+    except OSError as e:
+        print(f"  -> AVERTISSEMENT: impossible d'écrire le cache OCR: {e}")
+
+def telecharger_document(service, fichier):
+    """Télécharge le contenu d'un fichier depuis Drive. Retourne (succes, message, contenu).
+
+    `contenu` est un spool.FichierSpool : l'appelant le ferme une fois l'OCR terminé.
+    """
     mime_type = fichier['mimeType']
-    supported_types = ['application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/tiff']
-    if mime_type not in supported_types:
+    if mime_type not in SUPPORTED_MIME_TYPES:
         message = f"Format de fichier non supporté par Document AI: {mime_type}"
         print(f"   -> AVERTISSEMENT: {message}")
         return False, message, None
 
-    raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
-    request = documentai.ProcessRequest(name=name, raw_document=raw_document)
+    taille_max = DRIVE_MAX_FILE_MB * 1024 * 1024
+    if int(fichier.get('size') or 0) > taille_max:
+        message = f"Fichier trop volumineux ({int(fichier['size']) // (1024 * 1024)} Mo, maximum {DRIVE_MAX_FILE_MB} Mo)"
+        print(f"   -> AVERTISSEMENT: {message}")
+        return False, message, None
+
+    file_content = google_drive.telecharger_fichier(service, fichier['id'], taille_max)
+    if not file_content:
+        return False, "Échec du téléchargement depuis Drive", None
+    return True, "Succès", file_content
+
+def ocr_document(fichier, file_content, empreinte=None):
+    """Lance l'OCR Document AI sur un contenu déjà téléchargé. Retourne (succes, message, document).
+
+    `file_content` est un spool.FichierSpool ou des octets. Si `empreinte` est fournie, le cache OCR
+    est consulté d'abord (et `file_content` peut alors valoir None), puis alimenté après un appel réussi.
+    Les octets ne sont chargés en mémoire que le temps de l'appel, sous contrôle d'admission.
+
+    Un PDF au-delà de OCR_SPLIT_MAX_PAGES pages ou OCR_SPLIT_MAX_MB Mo est découpé en morceaux de pages
+    traités en parallèle, puis réassemblé (fusionner_documents) : numéros de page et ancres restent
+    ceux du document entier.
+    """
+    document = charger_ocr(fichier['id'], empreinte)
+    if document is not None:
+        print(f"  -> OCR chargé depuis le cache pour {fichier['name']}.")
+        return True, "Succès (cache)", document
+    if file_content is None:
+        return False, "Contenu du fichier indisponible pour l'OCR", None
 
+    print(f"  -> Lancement de l'OCR pour {fichier['name']}...")
     try:
-        result = client.process_document(request=request)
+        morceaux = _plan_decoupage(fichier, file_content)
+        if morceaux:
+            print(f"  -> PDF découpé en {len(morceaux)} morceaux de pages pour l'OCR.")
+            with ThreadPoolExecutor(max_workers=min(OCR_SPLIT_CONCURRENCY, len(morceaux))) as executor:
+                documents = list(executor.map(lambda m: _ocr_morceau(file_content, *m), morceaux))
+            document = fusionner_documents(documents)
+        else:
+            document = _ocr_requete(len(file_content), fichier['mimeType'], lambda: _lire(file_content))
         print("  -> OCR terminé avec succès.")
-        return True, "Succès", result.document
+        sauver_ocr(fichier['id'], empreinte, document)
+        return True, "Succès", document
     except Exception as e:
         print(f"  -> ERREUR lors du traitement Document AI: {e}")
         return False, str(e), None
 
+def _lire(file_content):
+    return file_content.lire() if isinstance(file_content, spool.FichierSpool) else file_content
+
+def _source_pdf(file_content):
+    """Source lisible par pypdf, sans charger un spool en mémoire."""
+    return file_content.chemin if isinstance(file_content, spool.FichierSpool) else io.BytesIO(file_content)
+
+def _ocr_requete(taille, mime_type, charger_octets):
+    """Un appel process_document ; les octets ne sont chargés qu'une fois admis (spool.admission_ocr).
+
+    L'API en ligne exige le document en octets dans la requête : la requête entière (fichier ou morceau
+    de PDF) est en mémoire le temps de l'appel. C'est l'admission qui borne la mémoire, pas le spool.
+    """
+    client = _get_docai_client()
+    name = client.processor_path(DOCAI_PROJECT_ID, DOCAI_LOCATION, DOCAI_PROCESSOR_ID)
+    spool.admission_ocr.acquerir(taille)
+    try:
+        octets = charger_octets()
+        raw_document = documentai.RawDocument(content=octets, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=name, raw_document=raw_document)
+        del octets, raw_document
+        return client.process_document(request=request).document
+    finally:
+        spool.admission_ocr.liberer(taille)
+
+def _plan_decoupage(fichier, file_content):
+    """Morceaux (debut, fin, taille estimée) d'un PDF à découper, ou None pour un seul appel."""
+    if fichier['mimeType'] != 'application/pdf': return None
+    taille = len(file_content)
+    try:
+        nb_pages = len(PdfReader(_source_pdf(file_content)).pages)
+    except Exception as e:
+        print(f"  -> AVERTISSEMENT: PDF illisible pour le découpage ({e}), envoi en un seul appel.")
+        return None
+    taille_max = OCR_SPLIT_MAX_MB * 1024 * 1024
+    if nb_pages <= 1 or (nb_pages <= OCR_SPLIT_MAX_PAGES and taille <= taille_max):
+        return None
+    # Assez de morceaux pour que chacun, à taille de page moyenne, reste sous la limite de taille.
+    pages_par_morceau = max(1, min(OCR_SPLIT_CHUNK_PAGES, nb_pages * taille_max // max(taille, 1)))
+    return [(debut, min(debut + pages_par_morceau, nb_pages), taille * (min(debut + pages_par_morceau, nb_pages) - debut) // nb_pages)
+            for debut in range(0, nb_pages, pages_par_morceau)]
+
+def _ocr_morceau(file_content, debut, fin, taille):
+    """OCR des pages [debut, fin[ d'un PDF, extraites dans un PDF temporaire en mémoire."""
+    def extraire():
+        lecteur = PdfReader(_source_pdf(file_content))  # Un lecteur par thread : PdfReader n'est pas thread-safe
+        redacteur = PdfWriter()
+        for page in lecteur.pages[debut:fin]:
+            redacteur.add_page(page)
+        tampon = io.BytesIO()
+        redacteur.write(tampon)
+        return tampon.getvalue()
+    return _ocr_requete(taille, 'application/pdf', extraire)
+
+def run_workflow_for_single_file(service, fichier):
+    """Lance le traitement OCR via Document AI pour un seul fichier."""
+    empreinte = fichier.get('empreinte')
+    if ocr_en_cache(fichier['id'], empreinte):
+        return ocr_document(fichier, None, empreinte)
+    succes, message, file_content = telecharger_document(service, fichier)
+    if not succes:
+        return False, message, None
+    try:
+        return ocr_document(fichier, file_content, empreinte)
+    finally:
+        spool.liberer(file_content)
+
+def _decaler_ancres(message_pb, decalage):
+    """Décale de `decalage` caractères tous les text_anchor d'un message protobuf, récursivement."""
+    for champ, valeur in message_pb.ListFields():
+        if champ.message_type is None: continue
+        # `label` n'existe plus depuis protobuf 7 ; `is_repeated` le remplace.
+        repete = champ.is_repeated if hasattr(champ, 'is_repeated') else champ.label == champ.LABEL_REPEATED
+        elements = valeur if repete else [valeur]
+        for element in elements:
+            if champ.name == 'text_anchor':
+                for segment in element.text_segments:
+                    segment.start_index += decalage
+                    segment.end_index += decalage
+            else:
+                _decaler_ancres(element, decalage)
+
+def fusionner_documents(documents):
+    """Assemble des documents consécutifs (morceaux ou shards) en un seul documentai.Document.
+
+    Les textes sont mis bout à bout ; les pages sont renumérotées et leurs ancres de texte
+    décalées pour pointer dans le texte assemblé.
+    """
+    if len(documents) == 1: return documents[0]
+    fusion_pb = documentai.Document.pb(documentai.Document())
+    morceaux_texte, decalage = [], 0
+    for document in documents:
+        doc_pb = documentai.Document.pb(document)
+        if not fusion_pb.mime_type: fusion_pb.mime_type = doc_pb.mime_type
+        for page in doc_pb.pages:
+            nouvelle_page = fusion_pb.pages.add()
+            nouvelle_page.CopyFrom(page)
+            nouvelle_page.page_number = len(fusion_pb.pages)
+            _decaler_ancres(nouvelle_page, decalage)
+        morceaux_texte.append(doc_pb.text)
+        decalage += len(doc_pb.text)
+    fusion_pb.text = "".join(morceaux_texte)
+    return documentai.Document.wrap(fusion_pb)
+
 def _get_text_anchor_content(text, text_anchor):
     """Extrait le segment de texte basé sur ses ancres."""
-    response = ""
-    for segment in text_anchor.text_segments:
-        start_index = int(segment.start_index)
-        end_index = int(segment.end_index)
-        response += text[start_index:end_index]
-    return response.strip()
-
-def _extract_bounding_box(layout):
-    """Extrait les coordonnées de la boîte englobante."""
-    if not layout or not layout.bounding_poly: return None
-    return [{"x": nv.x, "y": nv.y} for nv in layout.bounding_poly.normalized_vertices] if layout.bounding_poly.normalized_vertices else None
-
-def preprocess_document_for_ia(document):
-    """Transforme le document Document AI en texte tagué et en mapping de positions."""
-    texte_complet = document.text
-    tagged_text = ""
-    position_mapping = {}
-    element_id = 1
-
-    for page_num, page in enumerate(document.pages):
-        page_info = {
-            "page_number": page_num + 1,
-            "width": page.dimension.width if page.dimension else 0,
-            "height": page.dimension.height if page.dimension else 0,
-            "unit": page.dimension.unit if page.dimension else "px"
-        }
-        for line in page.lines:
-            line_text = _get_text_anchor_content(texte_complet, line.layout.text_anchor).replace('\n', ' ').strip()
-            if line_text:
-                tag = f"E{element_id}"
-                tagged_text += f"[{tag}] {line_text}\n"
-                position_mapping[tag] = {
-                    "text": line_text,
-                    "page_info": page_info,
-                    "bounding_box": _extract_bounding_box(line.layout),
-                    "confidence": line.layout.confidence if hasattr(line.layout, 'confidence') else None
-                }
-                element_id += 1
-
-    return tagged_text, position_mapping
\ No newline at end of file
+    return "".join(text[int(segment.start_index):int(segment.end_index)] for segment in text_anchor.text_segments).strip()
+
+class IndexPositions(Mapping):
+    """Positions des lignes taguées, vues comme un dict {tag: {"text", "page_info", "bounding_box", "confidence"}}.
+
+    Une ligne est stockée en tuple (texte, page_info partagé par la page, sommets, confiance) ; le dict
+    n'est construit qu'à la lecture d'un tag. Une vue de page ne copie rien : elle borne les indices.
+    """
+    def __init__(self, lignes, premier_tag, debut=0, fin=None):
+        self._lignes = lignes
+        self._premier_tag = premier_tag
+        self._debut = debut
+        self._fin = len(lignes) if fin is None else fin
+
+    def _indice(self, tag):
+        if not isinstance(tag, str) or not tag.startswith("E") or not tag[1:].isdigit(): return None
+        indice = int(tag[1:]) - self._premier_tag
+        return indice if self._debut <= indice < self._fin else None
+
+    def __getitem__(self, tag):
+        indice = self._indice(tag)
+        if indice is None: raise KeyError(tag)
+        texte, page_info, sommets, confiance = self._lignes[indice]
+        return {"text": texte, "page_info": page_info,
+                "bounding_box": [{"x": x, "y": y} for x, y in sommets] if sommets else None, "confidence": confiance}
+
+    def __contains__(self, tag):
+        return self._indice(tag) is not None
+
+    def __iter__(self):
+        return (f"E{self._premier_tag + indice}" for indice in range(self._debut, self._fin))
+
+    def __len__(self):
+        return self._fin - self._debut
+
+class DocumentTague:
+    """Texte tagué et index des positions d'un document, construits en un seul parcours de ses lignes.
+
+    Les tags (E1, E2...) sont numérotés à la suite sur tout le document : un tag désigne une seule
+    ligne, quelle que soit sa page. Le texte d'une page n'est assemblé qu'à la demande (texte_page).
+    """
+    def __init__(self, document, premiere_page=1, premier_tag=1):
+        # Lecture sur le protobuf brut : bien plus rapide que les accès proto-plus, ligne par ligne.
+        document_pb = documentai.Document.pb(document) if isinstance(document, documentai.Document) else document
+        texte_complet = document_pb.text
+        self.premier_tag = premier_tag
+        self._document = document
+        self._lignes_taguees = []
+        self._lignes = []
+        self._pages = {}
+        for indice_page, page in enumerate(document_pb.pages):
+            dimension = page.dimension
+            page_info = {
+                "page_number": premiere_page + indice_page,
+                "width": dimension.width,
+                "height": dimension.height,
+                "unit": dimension.unit or "px"
+            }
+            debut = len(self._lignes)
+            for line in page.lines:
+                layout = line.layout
+                line_text = _get_text_anchor_content(texte_complet, layout.text_anchor).replace('\n', ' ').strip()
+                if not line_text: continue
+                self._lignes_taguees.append(f"[E{premier_tag + len(self._lignes)}] {line_text}\n")
+                sommets = layout.bounding_poly.normalized_vertices
+                self._lignes.append((line_text, page_info, tuple((v.x, v.y) for v in sommets) if sommets else None, layout.confidence))
+            self._pages[premiere_page + indice_page] = (indice_page, debut, len(self._lignes))
+        self.position_mapping = IndexPositions(self._lignes, premier_tag)
+
+    def numeros_pages(self):
+        return list(self._pages)
+
+    def page(self, page_num):
+        """Objet page Document AI d'origine."""
+        return self._document.pages[self._pages[page_num][0]]
+
+    def texte_page(self, page_num):
+        """Texte tagué d'une page ("" si elle n'a aucune ligne)."""
+        _, debut, fin = self._pages[page_num]
+        return "".join(self._lignes_taguees[debut:fin])
+
+    def positions_page(self, page_num):
+        _, debut, fin = self._pages[page_num]
+        return IndexPositions(self._lignes, self.premier_tag, debut, fin)
+
+    def texte(self):
+        return "".join(self._lignes_taguees)
+
+def preprocess_document_for_ia(document, premiere_page=1, premier_tag=1):
+    """Transforme le document Document AI en texte tagué et en mapping de positions (voir DocumentTague).
+
+    Pour un document découpé page par page, `premiere_page` et `premier_tag` donnent le numéro
+    réel de la page et le premier tag libre, pour que tags et numéros de page restent uniques
+    dans tout le document.
+    """
+    tague = DocumentTague(document, premiere_page, premier_tag)
+    return tague.texte(), tague.position_mapping
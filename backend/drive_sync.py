@@ -0,0 +1,78 @@
+# drive_sync.py
+# Découverte des fichiers à traiter. En mode "incremental", on ne parcourt plus toute
+# l'arborescence Drive à chaque exécution : un curseur de l'API changes (start page token)
+# et la liste des sous-dossiers connus sont conservés en base, et seuls les ajouts,
+# modifications et suppressions survenus depuis la dernière exécution sont lus.
+import json
+import database
+import google_drive
+import ingestion
+
+DISCOVERY_MODES = ("full", "incremental")
+
+def _cle(nom, folder_id):
+    return f"{nom}:{folder_id}"
+
+def _sauvegarder_curseur(db_conn, folder_id, jeton, dossiers):
+    database.set_etat_sync(db_conn, _cle('start_page_token', folder_id), jeton)
+    database.set_etat_sync(db_conn, _cle('dossiers', folder_id), json.dumps(sorted(dossiers)))
+
+def _filtrer_modifies(db_conn, fichiers_modifies, fichiers_deja_traites):
+    """Garde les nouveaux fichiers et les fichiers déjà traités dont le contenu a changé."""
+    candidats = []
+    for fichier in fichiers_modifies:
+        if fichier['id'] in fichiers_deja_traites:
+            empreinte = ingestion.empreinte_drive(fichier)
+            if empreinte and empreinte == database.get_empreinte(db_conn, fichier['id']):
+                continue  # Changement de métadonnées seulement (renommage, déplacement...)
+            print(f"  -> Content modified since last processing, re-ingesting: {fichier['name']}")
+        candidats.append(fichier)
+    return candidats
+
+def _fichiers_a_reessayer(drive_service, db_conn, ids_exclus):
+    """Métadonnées Drive des fichiers journalisés en erreur ou en attente, comme le ferait un listing complet."""
+    fichiers = []
+    for file_id in database.get_fichiers_a_reessayer(db_conn):
+        if file_id in ids_exclus: continue
+        meta = google_drive.obtenir_metadonnees(drive_service, file_id)
+        if meta and not meta.pop('trashed', False):
+            fichiers.append(meta)
+    return fichiers
+
+def decouvrir_fichiers(drive_service, db_conn, folder_id, mode="full"):
+    """Retourne les fichiers à traiter, en listant tout le dossier ('full') ou via l'API changes ('incremental')."""
+    if mode != "incremental":
+        fichiers_deja_traites = database.get_fichiers_traites(db_conn)
+        tous_les_fichiers_drive = google_drive.lister_fichiers_recursif(drive_service, folder_id)
+        return [f for f in tous_les_fichiers_drive if f['id'] not in fichiers_deja_traites]
+
+    jeton = database.get_etat_sync(db_conn, _cle('start_page_token', folder_id))
+    dossiers_json = database.get_etat_sync(db_conn, _cle('dossiers', folder_id))
+
+    if not jeton or not dossiers_json:
+        print("  -> No Drive changes cursor yet: full listing to initialise it...")
+        # Le jeton est pris AVANT le listing pour ne perdre aucun changement survenu pendant celui-ci.
+        nouveau_jeton = google_drive.obtenir_jeton_changements(drive_service)
+        fichiers_deja_traites = database.get_fichiers_traites(db_conn)
+        dossiers = {folder_id}
+        tous_les_fichiers_drive = google_drive.lister_fichiers_recursif(drive_service, folder_id, dossiers)
+        candidats = [f for f in tous_les_fichiers_drive if f['id'] not in fichiers_deja_traites]
+    else:
+        dossiers = set(json.loads(dossiers_json))
+        modifies, supprimes, nouveau_jeton = google_drive.lister_changements(drive_service, jeton, dossiers)
+        print(f"  -> Drive changes since last run: {len(modifies)} added/modified, {len(supprimes)} removed.")
+        # Seuls les fichiers concernés par les changements sont cherchés dans le journal.
+        fichiers_deja_traites = database.get_fichiers_traites(db_conn, [f['id'] for f in modifies] + list(supprimes))
+        for file_id in supprimes & fichiers_deja_traites:
+            print(f"  -> Processed file removed or trashed on Drive: {file_id}")
+        candidats = _filtrer_modifies(db_conn, modifies, fichiers_deja_traites)
+        ids_exclus = {f['id'] for f in candidats} | supprimes
+        candidats.extend(_fichiers_a_reessayer(drive_service, db_conn, ids_exclus))
+
+    # Les candidats sont journalisés avant d'avancer le curseur : si l'exécution s'interrompt,
+    # ils seront repris par _fichiers_a_reessayer au lieu d'être perdus.
+    for fichier in candidats:
+        database.log_to_db(db_conn, fichier['id'], fichier['name'], fichier.get('mimeType'), 'EN_ATTENTE',
+                           "Queued by incremental Drive discovery.")
+    _sauvegarder_curseur(db_conn, folder_id, nouveau_jeton, dossiers)
+    return candidats
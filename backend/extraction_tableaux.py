@@ -0,0 +1,157 @@
+# extraction_tableaux.py
+# Extraction déterministe des listes présentées en tableau (matière | titre | éditeur | ISBN...).
+# Les lignes d'une page sont regroupées en rangées d'après leur position (ou lues dans page.tables
+# quand le processeur Document AI fournit des tableaux) ; une rangée d'en-tête reconnue donne les
+# colonnes, puis chaque rangée devient un manuel au format du prompt d'extraction, avec ses source_tags.
+#
+# Le résultat n'est utilisé que s'il est jugé fiable (TABLE_EXTRACTION_MIN_CONFIDENCE) ; sinon la page repart vers
+# l'extraction Gemini habituelle.
+import re
+from statistics import median
+from filtre_pages import normaliser
+from config import TABLE_EXTRACTION_MIN_CONFIDENCE
+
+# Mots d'en-tête (normalisés) de chaque colonne ; "niveau" regroupe les manuels par niveau.
+COLONNES = {
+    "matiere_livre": ("matiere", "matieres", "discipline", "المادة"),
+    "titre_livre": ("titre", "titres", "manuel", "manuels", "livre", "livres", "ouvrage", "designation", "intitule", "العنوان", "الكتاب", "الكتب"),
+    "maison_edition": ("editeur", "editeurs", "edition", "editions", "maison d'edition", "الناشر", "دار النشر"),
+    "code_livre": ("isbn", "code", "ean", "code isbn"),
+    "annee_edition": ("annee", "annee d'edition", "annee edition", "سنة النشر"),
+    "type_livre": ("type", "nature"),
+    "niveau": ("niveau", "classe", "المستوى", "القسم"),
+}
+TYPES_LIVRE = (("cahier de travaux pratiques", "Cahier de travaux pratiques"), ("cahier d'activites", "Cahier d'activités"),
+               ("fichier", "Fichier"), ("roman", "Roman"), ("dictionnaire", "Dictionnaire"))
+
+_ISBN = re.compile(r"\b(97[89](?:[- ]?\d){10}|\d(?:[- ]?\d){8}[- ]?[\dXx])\b")
+_ANNEE = re.compile(r"\b(19[5-9]\d|20\d\d)\b")
+# Mention d'édition retirée du titre, comme le demande le prompt d'extraction (« édition 2021 », « طبعة 2022 »).
+_MENTION_EDITION = re.compile(r"[(\[]?\s*(?:[ée]dition|[ée]d\.|طبعة)\s*(?:19|20)\d\d\s*[)\]]?", re.IGNORECASE)
+_NIVEAU = re.compile(r"^(?:cp|ce1|ce2|cm1|cm2|ps|ms|gs|[1-6] ?(?:e|eme|er|ere)\b.*|\d ?(?:ap|ac|bac)\b.*|.*\bannee\b.*(?:primaire|college|lycee|bac).*"
+                     r"|(?:petite|moyenne|grande) section.*|tronc commun.*|seconde|premiere|terminale|السنة .*|الجذع المشترك.*|المستوى .*)$")
+
+def _colonne_entete(texte):
+    texte = normaliser(texte).strip(" :.")
+    for colonne, mots in COLONNES.items():
+        if texte in (normaliser(m) for m in mots):
+            return colonne
+    return None
+
+def _cellule(tag, info):
+    boite = info.get('bounding_box')
+    if not boite: return None
+    xs, ys = [p['x'] for p in boite], [p['y'] for p in boite]
+    return {"texte": info['text'], "tags": [tag], "x0": min(xs), "x1": max(xs), "y0": min(ys), "y1": max(ys),
+            "confiance": info.get('confidence') or 1.0}
+
+def _rangees_geometriques(position_mapping):
+    """Regroupe les lignes OCR en rangées : même bande verticale, triées de gauche à droite."""
+    cellules = [c for tag, info in position_mapping.items() if (c := _cellule(tag, info))]
+    if len(cellules) != len(position_mapping) or not cellules: return None
+    hauteur = median(c["y1"] - c["y0"] for c in cellules) or 0.01
+    rangees = []
+    for cellule in sorted(cellules, key=lambda c: (c["y0"] + c["y1"]) / 2):
+        centre = (cellule["y0"] + cellule["y1"]) / 2
+        if rangees and abs(centre - rangees[-1]["y"]) < hauteur / 2:
+            rangees[-1]["cellules"].append(cellule)
+        else:
+            rangees.append({"y": centre, "cellules": [cellule]})
+    return [sorted(r["cellules"], key=lambda c: c["x0"]) for r in rangees]
+
+def _rangees_document_ai(page, texte_document, position_mapping):
+    """Rangées de page.tables (processeurs qui détectent les tableaux), suivies des autres lignes de la page."""
+    cellules_lignes = {tag: c for tag, info in position_mapping.items() if (c := _cellule(tag, info))}
+    rangees, pris = [], set()
+    for tableau in page.tables:
+        for rangee in list(tableau.header_rows) + list(tableau.body_rows):
+            cellules = []
+            for cell in rangee.cells:
+                boite = cell.layout.bounding_poly.normalized_vertices
+                if not boite: continue
+                x0, x1 = min(v.x for v in boite), max(v.x for v in boite)
+                y0, y1 = min(v.y for v in boite), max(v.y for v in boite)
+                tags = [tag for tag, c in cellules_lignes.items()
+                        if x0 <= (c["x0"] + c["x1"]) / 2 <= x1 and y0 <= (c["y0"] + c["y1"]) / 2 <= y1]
+                pris.update(tags)
+                texte = "".join(texte_document[int(s.start_index):int(s.end_index)] for s in cell.layout.text_anchor.text_segments)
+                cellules.append({"texte": " ".join(texte.split()), "tags": tags, "x0": x0, "x1": x1, "y0": y0, "y1": y1,
+                                 "confiance": cell.layout.confidence or 1.0})
+            if cellules: rangees.append(cellules)
+    # Les titres de niveau sont en général hors tableau.
+    rangees.extend([c] for tag, c in cellules_lignes.items() if tag not in pris)
+    return sorted(rangees, key=lambda r: min(c["y0"] for c in r))
+
+def _colonnes(entete):
+    colonnes = [(_colonne_entete(c["texte"]), c) for c in entete]
+    trouvees = [col for col, _ in colonnes if col]
+    if "titre_livre" not in trouvees or len(trouvees) < 2 or len(set(trouvees)) != len(trouvees): return None
+    return [(col, (c["x0"] + c["x1"]) / 2) for col, c in colonnes if col]
+
+def _ranger(rangee, colonnes):
+    """Affecte chaque cellule d'une rangée à la colonne d'en-tête la plus proche horizontalement."""
+    valeurs = {}
+    for cellule in rangee:
+        centre = (cellule["x0"] + cellule["x1"]) / 2
+        colonne = min(colonnes, key=lambda c: abs(c[1] - centre))[0]
+        valeurs.setdefault(colonne, []).append(cellule)
+    return valeurs
+
+def _texte(cellules):
+    return " ".join(c["texte"] for c in cellules).strip() if cellules else ""
+
+def _manuel(valeurs):
+    titre = _texte(valeurs.get("titre_livre"))
+    if not titre: return None
+    code = _ISBN.search(_texte(valeurs.get("code_livre")) or titre)
+    annee = _ANNEE.search(_texte(valeurs.get("annee_edition")) or titre)
+    texte_type = normaliser(_texte(valeurs.get("type_livre")) + " " + titre)
+    return {
+        "titre_livre": " ".join(_MENTION_EDITION.sub(" ", titre).split()) or titre,
+        "matiere_livre": _texte(valeurs.get("matiere_livre")) or None,
+        "maison_edition": _texte(valeurs.get("maison_edition")) or None,
+        "annee_edition": int(annee.group(1)) if annee else None,
+        "code_livre": re.sub(r"[- ]", "", code.group(1)) if code else None,
+        "type_livre": next((libelle for mot, libelle in TYPES_LIVRE if mot in texte_type), "Manuel"),
+        "source_tags": [tag for cellules in valeurs.values() for c in cellules for tag in c["tags"]],
+    }
+
+def extraire_page(page, texte_document, position_mapping, confiance_min=TABLE_EXTRACTION_MIN_CONFIDENCE):
+    """Extraction {"niveaux": [...]} d'une page en tableau, au format du prompt d'extraction, ou None.
+
+    La confiance est la part des rangées du tableau lues comme un manuel avec son niveau, multipliée
+    par la confiance OCR moyenne de ces rangées. None si aucun en-tête n'est reconnu ou si la
+    confiance est sous `confiance_min`.
+    """
+    rangees = _rangees_document_ai(page, texte_document, position_mapping) if getattr(page, 'tables', None) \
+        else _rangees_geometriques(position_mapping)
+    if not rangees: return None
+
+    niveaux, colonnes, niveau_courant, lues, isolees, confiances = {}, None, None, 0, 0, []
+    for rangee in rangees:
+        if len(rangee) == 1:
+            texte = normaliser(rangee[0]["texte"]).strip(" :")
+            if len(texte) <= 40 and _NIVEAU.match(texte):
+                niveau_courant = (rangee[0]["texte"].strip(" :"), rangee[0]["tags"])
+            elif colonnes:
+                isolees += 1  # Cellule seule : titre sur deux lignes ? Non lue si le tableau continue après.
+            continue
+        # Une rangée d'en-tête (la première, ou répétée avant chaque tableau) fixe les colonnes.
+        entete = _colonnes(rangee)
+        if entete or colonnes is None:
+            colonnes, isolees = entete or colonnes, 0
+            continue
+        lues += 1 + isolees
+        isolees = 0
+        valeurs = _ranger(rangee, colonnes)
+        manuel = _manuel(valeurs)
+        niveau = (_texte(valeurs["niveau"]), [t for c in valeurs["niveau"] for t in c["tags"]]) if valeurs.get("niveau") else niveau_courant
+        if manuel is None or not niveau: continue
+        confiances.extend(c["confiance"] for c in rangee)
+        entree = niveaux.setdefault(niveau[0], {"niveau_brut": niveau[0], "niveau_source_tags": niveau[1], "manuels": []})
+        entree["manuels"].append(manuel)
+
+    if not confiances: return None
+    manuels = sum(len(n["manuels"]) for n in niveaux.values())
+    if manuels / lues * sum(confiances) / len(confiances) < confiance_min: return None
+    return {"niveaux": list(niveaux.values())}
@@ -0,0 +1,93 @@
+# fake_docai.py
+# Client Document AI local, pour exécuter l'OCR hors ligne (tests, lots locaux, benchmarks).
+# Le « fichier » envoyé est interprété comme du texte UTF-8 : les pages sont séparées par
+# un saut de page (\f) et les lignes par \n. Un vrai PDF (pdf_synthetique) est lu page par page
+# avec pypdf, pour tester le découpage des gros PDF. Le document renvoyé a la même structure que
+# celui de Document AI (texte global, pages, lignes avec text_anchor et bounding_poly).
+#
+# Exemple :
+#   doc_processor._client = FakeDocumentAIClient(latence_s=0.2)
+#   contenu = contenu_synthetique([["École Al Amal", "2025/2026"], ["CE1", "Mot de passe - Hachette"]])
+import io
+import random
+import threading
+import time
+from google.cloud import documentai
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+def contenu_synthetique(pages):
+    """Encode une liste de pages (listes de lignes) au format lu par FakeDocumentAIClient."""
+    return "\f".join("\n".join(lignes) for lignes in pages).encode('utf-8')
+
+def pdf_synthetique(pages):
+    """Construit un vrai PDF (une page PDF par liste de lignes, texte ASCII) lisible par FakeDocumentAIClient."""
+    redacteur = PdfWriter()
+    police = redacteur._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica")}))
+    for lignes in pages:
+        page = redacteur.add_blank_page(width=595, height=842)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): police})})
+        texte = " T* ".join(f"({ligne.replace('(', '[').replace(')', ']')}) Tj" for ligne in lignes)
+        flux = DecodedStreamObject()
+        flux.set_data(f"BT /F1 12 Tf 14 TL 50 800 Td {texte} ET".encode('latin-1'))
+        page[NameObject("/Contents")] = redacteur._add_object(flux)
+    tampon = io.BytesIO()
+    redacteur.write(tampon)
+    return tampon.getvalue()
+
+def _pages_du_contenu(contenu):
+    if contenu.startswith(b"%PDF"):
+        textes = [page.extract_text() for page in PdfReader(io.BytesIO(contenu)).pages]
+    else:
+        textes = contenu.decode('utf-8', errors='replace').split("\f")
+    return [[ligne for ligne in texte.split("\n") if ligne.strip()] for texte in textes]
+
+def _boite(x0, y0, x1, y1):
+    return documentai.BoundingPoly(normalized_vertices=[
+        documentai.NormalizedVertex(x=x0, y=y0), documentai.NormalizedVertex(x=x1, y=y0),
+        documentai.NormalizedVertex(x=x1, y=y1), documentai.NormalizedVertex(x=x0, y=y1)])
+
+def construire_document(pages, mime_type='application/pdf'):
+    """Construit un documentai.Document à partir d'une liste de pages (chacune une liste de lignes)."""
+    morceaux, pages_doc, position = [], [], 0
+    for num, lignes in enumerate(pages, 1):
+        lignes_doc = []
+        hauteur = 1 / (len(lignes) + 2)
+        for i, ligne in enumerate(lignes):
+            texte = ligne + "\n"
+            segment = documentai.Document.TextAnchor.TextSegment(start_index=position, end_index=position + len(texte))
+            position += len(texte)
+            morceaux.append(texte)
+            y0 = (i + 1) * hauteur
+            lignes_doc.append(documentai.Document.Page.Line(layout=documentai.Document.Page.Layout(
+                text_anchor=documentai.Document.TextAnchor(text_segments=[segment]),
+                confidence=0.99,
+                bounding_poly=_boite(0.1, y0, 0.9, y0 + hauteur * 0.8))))
+        pages_doc.append(documentai.Document.Page(
+            page_number=num,
+            dimension=documentai.Document.Page.Dimension(width=1240, height=1754, unit="pixels"),
+            lines=lignes_doc))
+    return documentai.Document(mime_type=mime_type, text="".join(morceaux), pages=pages_doc)
+
+class FakeDocumentAIClient:
+    """Imite DocumentProcessorServiceClient.process_document, avec latence et taux d'erreur réglables."""
+    def __init__(self, latence_s=0.0, taux_erreur=0.0, seed=None):
+        self.latence_s = latence_s
+        self.taux_erreur = taux_erreur
+        self.appels = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def processor_path(self, project, location, processor):
+        return f"projects/{project}/locations/{location}/processors/{processor}"
+
+    def process_document(self, request):
+        with self._lock:
+            self.appels += 1
+            echec = self._random.random() < self.taux_erreur
+        if self.latence_s: time.sleep(self.latence_s)
+        if echec: raise RuntimeError("Fake Document AI: simulated processing error")
+        pages = _pages_du_contenu(request.raw_document.content)
+        return documentai.ProcessResponse(document=construire_document(pages, request.raw_document.mime_type))
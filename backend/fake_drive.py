@@ -0,0 +1,216 @@
+# fake_drive.py
+# Service Google Drive en mémoire, pour exécuter la découverte, le téléchargement et
+# l'ingestion hors ligne. Il imite le sous-ensemble de l'API v3 utilisé par google_drive.py
+# (files.list/get/get_media/create/delete et changes.getStartPageToken/list) : chaque appel
+# renvoie un objet dont `.execute()` produit la réponse, et `get_media` est compatible avec
+# googleapiclient.http.MediaIoBaseDownload.
+#
+# Exemple :
+#   drive = FakeDriveService()
+#   racine = drive.ajouter_dossier("Listes")
+#   drive.ajouter_fichier("liste.pdf", b"%PDF...", parents=[racine])
+#   google_drive.lister_fichiers_recursif(drive, racine)
+import hashlib
+import itertools
+import re
+import threading
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+class _Requete:
+    def __init__(self, fonction):
+        self._fonction = fonction
+
+    def execute(self, num_retries=0):
+        return self._fonction()
+
+class _ReponseHttp(dict):
+    """Réponse imitant httplib2.Response : un dict d'en-têtes avec un attribut `status`."""
+    def __init__(self, status, entetes):
+        super().__init__(entetes)
+        self.status = status
+        self.reason = "OK" if status < 400 else "Error"
+
+class _HttpMedia:
+    """Transport minimal servant le contenu d'un fichier par plages d'octets."""
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        contenu = self._drive._contenu(self._file_id)
+        if contenu is None:
+            return _ReponseHttp(404, {}), b'{"error": "File not found"}'
+        debut, fin = 0, len(contenu) - 1
+        plage = re.match(r"bytes=(\d+)-(\d+)", (headers or {}).get("range", ""))
+        if plage:
+            debut, fin = int(plage.group(1)), min(int(plage.group(2)), len(contenu) - 1)
+        morceau = contenu[debut:fin + 1]
+        entetes = {"content-length": str(len(morceau)),
+                   "content-range": f"bytes {debut}-{debut + len(morceau) - 1}/{len(contenu)}"}
+        return _ReponseHttp(206, entetes), morceau
+
+class _RequeteMedia(_Requete):
+    def __init__(self, drive, file_id):
+        super().__init__(lambda: drive._contenu_ou_erreur(file_id))
+        self.uri = f"fake://drive/files/{file_id}?alt=media"
+        self.headers = {}
+        self.http = _HttpMedia(drive, file_id)
+
+class FakeDriveError(Exception):
+    """Erreur renvoyée par le faux service (équivalent d'un HttpError)."""
+
+class _Files:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q="", spaces=None, fields=None, pageToken=None, pageSize=100, **kwargs):
+        return _Requete(lambda: self._drive._lister(q, pageToken, pageSize))
+
+    def get(self, fileId, fields=None, **kwargs):
+        return _Requete(lambda: self._drive._metadonnees(fileId, with_trashed=True))
+
+    def get_media(self, fileId, **kwargs):
+        self._drive.appels["files.get_media"] += 1
+        return _RequeteMedia(self._drive, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def creer():
+            contenu = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+            mime_type = getattr(media_body, 'mimetype', lambda: None)() or body.get('mimeType', 'application/octet-stream')
+            file_id = self._drive.ajouter_fichier(body['name'], contenu, parents=body.get('parents'), mime_type=mime_type)
+            return {"id": file_id, "parents": body.get('parents', [])}
+        return _Requete(creer)
+
+    def delete(self, fileId, **kwargs):
+        return _Requete(lambda: self._drive.supprimer(fileId))
+
+class _Changes:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return _Requete(lambda: {"startPageToken": str(self._drive._position_changements())})
+
+    def list(self, pageToken, spaces=None, fields=None, includeRemoved=True, pageSize=100, **kwargs):
+        return _Requete(lambda: self._drive._lister_changements(int(pageToken), pageSize))
+
+class FakeDriveService:
+    """Arborescence Drive en mémoire, avec journal des changements."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}
+        self._contenus = {}
+        self._journal = []
+        self._ids = itertools.count(1)
+        self.appels = {"files.list": 0, "files.get": 0, "files.get_media": 0, "changes.list": 0}
+
+    # --- API imitée ---
+    def files(self):
+        return _Files(self)
+
+    def changes(self):
+        return _Changes(self)
+
+    # --- Mutations (enregistrées dans le journal des changements) ---
+    def ajouter_dossier(self, nom, parents=None):
+        return self._creer(nom, FOLDER_MIME_TYPE, parents, None)
+
+    def ajouter_fichier(self, nom, contenu: bytes, parents=None, mime_type='application/pdf'):
+        return self._creer(nom, mime_type, parents, contenu)
+
+    def modifier_fichier(self, file_id, contenu: bytes = None, nom=None):
+        with self._lock:
+            item = self._items[file_id]
+            if nom: item['name'] = nom
+            if contenu is not None: self._definir_contenu(item, contenu)
+            self._journaliser(file_id)
+
+    def deplacer(self, file_id, parents):
+        with self._lock:
+            self._items[file_id]['parents'] = list(parents)
+            self._journaliser(file_id)
+
+    def mettre_a_la_corbeille(self, file_id):
+        with self._lock:
+            self._items[file_id]['trashed'] = True
+            self._journaliser(file_id)
+
+    def supprimer(self, file_id):
+        with self._lock:
+            if file_id not in self._items: raise FakeDriveError(f"File not found: {file_id}")
+            del self._items[file_id]
+            self._contenus.pop(file_id, None)
+            self._journal.append({"fileId": file_id, "removed": True})
+        return ""
+
+    # --- Implémentation ---
+    def _creer(self, nom, mime_type, parents, contenu):
+        with self._lock:
+            file_id = f"fake-{next(self._ids)}"
+            item = {"id": file_id, "name": nom, "mimeType": mime_type, "parents": list(parents or []), "trashed": False}
+            if contenu is not None: self._definir_contenu(item, contenu)
+            self._items[file_id] = item
+            self._journaliser(file_id)
+        return file_id
+
+    def _definir_contenu(self, item, contenu):
+        self._contenus[item['id']] = bytes(contenu)
+        item['md5Checksum'] = hashlib.md5(contenu).hexdigest()
+        item['size'] = str(len(contenu))
+
+    def _journaliser(self, file_id):
+        self._journal.append({"fileId": file_id, "removed": False, "file": dict(self._items[file_id])})
+
+    def _position_changements(self):
+        with self._lock:
+            return len(self._journal) + 1
+
+    def _public(self, item):
+        return {k: v for k, v in item.items() if k not in ('parents', 'trashed')}
+
+    def _lister(self, q, page_token, page_size):
+        self.appels["files.list"] += 1
+        parent = re.search(r"'([^']+)' in parents", q or "")
+        exclure_corbeille = "trashed=false" in (q or "").replace(" ", "")
+        with self._lock:
+            items = [i for i in self._items.values()
+                     if (not parent or parent.group(1) in i['parents']) and not (exclure_corbeille and i['trashed'])]
+        debut = int(page_token or 0)
+        page = items[debut:debut + page_size]
+        reponse = {"files": [self._public(i) for i in page]}
+        if debut + page_size < len(items):
+            reponse["nextPageToken"] = str(debut + page_size)
+        return reponse
+
+    def _metadonnees(self, file_id, with_trashed=False):
+        self.appels["files.get"] += 1
+        with self._lock:
+            if file_id not in self._items: raise FakeDriveError(f"File not found: {file_id}")
+            item = dict(self._items[file_id])
+        metadonnees = self._public(item)
+        metadonnees['parents'] = item['parents']
+        if with_trashed: metadonnees['trashed'] = item['trashed']
+        return metadonnees
+
+    def _contenu(self, file_id):
+        with self._lock:
+            return self._contenus.get(file_id)
+
+    def _contenu_ou_erreur(self, file_id):
+        contenu = self._contenu(file_id)
+        if contenu is None: raise FakeDriveError(f"File not found: {file_id}")
+        return contenu
+
+    def _lister_changements(self, position, page_size):
+        self.appels["changes.list"] += 1
+        with self._lock:
+            debut = position - 1
+            page = self._journal[debut:debut + page_size]
+            fin = debut + len(page)
+            reponse = {"changes": [dict(c) for c in page]}
+            if fin < len(self._journal):
+                reponse["nextPageToken"] = str(fin + 1)
+            else:
+                reponse["newStartPageToken"] = str(len(self._journal) + 1)
+        return reponse
@@ -0,0 +1,141 @@
+# fake_gemini.py
+# API Gemini (generateContent) locale, pour exécuter l'extraction IA hors ligne (tests, benchmarks).
+# Elle remplace le client HTTP du moteur d'ai_processor : `post()` reçoit le même payload que l'API
+# et renvoie une réponse au même format (candidates, usageMetadata), avec latence, erreurs 500 et
+# limitations 429 (en-tête Retry-After) réglables.
+#
+# Les réponses sont déduites du texte tagué par quelques règles simples, selon le prompt reconnu :
+# école (première ligne « École / Lycée / Groupe scolaire... »), année (AAAA/AAAA), niveaux (CP... CM2,
+# « 1ère année ... », « Tronc commun ... ») et manuels (lignes « Matière : Titre - Éditeur [- ISBN] »
+# sous un niveau), standardisation unitaire ou groupée (choix autorisé égal au terme, sinon null).
+#
+# Exemple :
+#   ai_processor.moteur.utiliser_client(FakeGemini(latence_s=0.3, taux_erreur=0.01))
+import asyncio
+import json
+import random
+import re
+import threading
+import httpx
+import ai_processor
+
+_LIGNE = re.compile(r"^\[(E\d+)\]\s*(.*)$")
+_ECOLE = re.compile(r"\b(?:école|ecole|lycée|lycee|collège|college|groupe scolaire|institut|institution)\b", re.IGNORECASE)
+_ANNEE = re.compile(r"\b(20\d\d)\s*[/-]\s*(20\d\d)\b")
+_NIVEAU = re.compile(r"^(?:CP|CE1|CE2|CM1|CM2|\d+\s*(?:e|ème|ere|ère|er)?\s*année.*|Tronc commun.*|\d+\s*(?:AC|Bac).*)\s*:?$", re.IGNORECASE)
+_MANUEL = re.compile(r"^(?:(?P<matiere>[^:]{2,40})\s*:\s*)?(?P<titre>[^-]+?)\s+-\s+(?P<editeur>[^-]+?)(?:\s+-\s+(?P<isbn>[\d-]{10,17}))?$")
+_TERME = re.compile(r'NEW RAW TERM:\n"(.*)"\s*$', re.DOTALL)
+_TERMES = re.compile(r'NEW RAW TERMS:\n(.*)$', re.DOTALL)
+_CHOIX = re.compile(r"ALLOWED CHOICES LIST:\n(.*?)\n\nNEW RAW TERM", re.DOTALL)
+
+class _Reponse:
+    """Réponse imitant httpx.Response (status_code, headers, json(), raise_for_status())."""
+    def __init__(self, url, status_code, corps, entetes=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = entetes or {}
+        self._corps = corps
+
+    def json(self):
+        return self._corps
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise httpx.HTTPStatusError(f"{self.status_code} Fake Gemini error", request=httpx.Request("POST", self.url), response=self)
+
+def _lignes(texte):
+    return [(m.group(1), m.group(2).strip()) for m in map(_LIGNE.match, texte.splitlines()) if m]
+
+def repondre_ecole(texte):
+    for tag, ligne in _lignes(texte):
+        if _ECOLE.search(ligne):
+            return {"ecole_unifie": ligne, "source_tags": [tag]}
+    return {"ecole_unifie": None, "source_tags": []}
+
+def repondre_annee(texte):
+    for tag, ligne in _lignes(texte):
+        m = _ANNEE.search(ligne)
+        if m: return {"annee_scolaire": f"{m.group(1)}/{m.group(2)}", "source_tags": [tag]}
+    return {"annee_scolaire": "Année Non Spécifiée ", "source_tags": []}
+
+def repondre_niveaux(texte):
+    niveaux, courant = [], None
+    for tag, ligne in _lignes(texte):
+        if _NIVEAU.match(ligne):
+            courant = {"niveau_brut": ligne.rstrip(" :"), "niveau_source_tags": [tag], "manuels": []}
+            niveaux.append(courant)
+            continue
+        m = _MANUEL.match(ligne)
+        if courant is None or not m: continue
+        annee = re.search(r"\b(19|20)\d\d\b", ligne)
+        courant["manuels"].append({
+            "titre_livre": m.group("titre").strip(), "matiere_livre": (m.group("matiere") or "").strip() or None,
+            "maison_edition": m.group("editeur").strip(), "annee_edition": int(annee.group(0)) if annee else None,
+            "code_livre": m.group("isbn").replace("-", "") if m.group("isbn") else None, "type_livre": "Manuel",
+            "source_tags": [tag]})
+    return {"niveaux": niveaux}
+
+def repondre_combine(texte):
+    ecole, annee = repondre_ecole(texte), repondre_annee(texte)
+    return {"ecole_unifie": ecole["ecole_unifie"], "ecole_source_tags": ecole["source_tags"],
+            "annee_scolaire": annee["annee_scolaire"], "annee_source_tags": annee["source_tags"],
+            "niveaux": repondre_niveaux(texte)["niveaux"]}
+
+def repondre_standardisation(texte):
+    terme, choix = _TERME.search(texte), _CHOIX.search(texte)
+    if not terme or not choix: return {"nom_standardise": None}
+    trouve = next((c for c in json.loads(choix.group(1)) if c.lower() == terme.group(1)), None)
+    return {"nom_standardise": trouve}
+
+def repondre_standardisation_lot(texte):
+    termes, choix = _TERMES.search(texte), _CHOIX.search(texte)
+    if not termes or not choix: return {"correspondances": {}}
+    choix = json.loads(choix.group(1))
+    return {"correspondances": {terme: next((c for c in choix if c.lower() == terme), None) for terme in json.loads(termes.group(1))}}
+
+REPONSES = {
+    ai_processor.school_prompt_instructions: repondre_ecole,
+    ai_processor.year_prompt_instructions: repondre_annee,
+    ai_processor.extract_levels_and_books_prompt: repondre_niveaux,
+    ai_processor.combined_extraction_prompt: repondre_combine,
+    ai_processor.intelligent_standardize_prompt_constrained: repondre_standardisation,
+    ai_processor.batch_standardize_prompt_constrained: repondre_standardisation_lot,
+}
+
+class FakeGemini:
+    """Remplaçant d'httpx.AsyncClient pour ai_processor.moteur : latence (± gigue), taux d'erreur 500 et de 429 réglables."""
+
+    def __init__(self, latence_s=0.0, gigue_s=0.0, taux_erreur=0.0, taux_limite=0.0, retry_after_s=1, seed=None):
+        self.latence_s = latence_s
+        self.gigue_s = gigue_s
+        self.taux_erreur = taux_erreur
+        self.taux_limite = taux_limite
+        self.retry_after_s = retry_after_s
+        self.stats = {"appels": 0, "erreurs": 0, "limitations": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    async def post(self, url, headers=None, json=None, timeout=None):
+        with self._lock:
+            self.stats["appels"] += 1
+            tirage = self._random.random()
+            latence = max(0.0, self.latence_s + self._random.uniform(-self.gigue_s, self.gigue_s))
+        if latence: await asyncio.sleep(latence)
+        if tirage < self.taux_limite:
+            with self._lock: self.stats["limitations"] += 1
+            return _Reponse(url, 429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, {"Retry-After": str(self.retry_after_s)})
+        if tirage < self.taux_limite + self.taux_erreur:
+            with self._lock: self.stats["erreurs"] += 1
+            return _Reponse(url, 500, {"error": {"code": 500, "status": "INTERNAL"}})
+
+        prompt = json["contents"][0]["parts"][0]["text"]
+        instructions, _, texte = prompt.partition("\n\n--- TEXT TO ANALYZE ---\n\n")
+        repondre = REPONSES.get(instructions)
+        sortie = _dumps(repondre(texte) if repondre else {})
+        return _Reponse(url, 200, {
+            "candidates": [{"content": {"parts": [{"text": sortie}]}}],
+            "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(sortie) // 4},
+        })
+
+def _dumps(donnees):
+    return json.dumps(donnees, ensure_ascii=False)
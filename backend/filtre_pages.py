@@ -0,0 +1,104 @@
+# filtre_pages.py
+# Pré-filtre local des pages avant l'extraction des niveaux/manuels : chaque page reçoit un score
+# de « vraisemblance livre » calculé sur ses lignes taguées (ISBN, éditeurs déjà connus dans
+# manuels.editeur, mots de manuel et matières), les fournitures (stylos, trousse, cahiers...)
+# comptant en négatif. Sous le seuil, la page n'est envoyée qu'aux prompts école et année.
+#
+# Chaque page écartée est tracée dans pages_filtrees (score et raisons) pour pouvoir ajuster le seuil.
+import re
+import threading
+import time
+import unicodedata
+import database
+from config import PAGE_FILTER_MIN_SCORE
+
+POIDS = {"isbn": 3, "editeur": 2, "livre": 1, "matiere": 1, "fourniture": -1}
+
+_ISBN = re.compile(r"\bisbn\b|\b97[89](?:[- ]?\d){10}\b")
+_TAG = re.compile(r"^\[E\d+\]\s*")
+
+# Mots comparés sans accents ni majuscules, en mots entiers.
+MOTS_LIVRE = ("manuel", "livre", "fichier", "methode", "edition", "editions", "roman", "dictionnaire", "bescherelle",
+              "cahier d'activites", "cahier d'exercices", "cahier de l'eleve", "livret", "كتاب", "المفيد")
+MOTS_MATIERE = ("francais", "mathematiques", "maths", "arabe", "anglais", "espagnol", "allemand", "eveil", "sciences",
+                "physique", "chimie", "svt", "histoire", "geographie", "islamique", "informatique", "philosophie",
+                "lecture", "grammaire", "conjugaison", "orthographe", "vocabulaire", "production ecrite",
+                "الرياضيات", "العربية", "الفرنسية", "الإسلامية", "النشاط العلمي", "الاجتماعيات", "القراءة")
+MOTS_FOURNITURE = ("stylo", "stylos", "crayon", "crayons", "trousse", "gomme", "regle", "colle", "ciseaux", "feutre", "feutres",
+                   "taille-crayon", "protege-cahier", "protege-cahiers", "classeur", "ardoise", "calculatrice", "blouse",
+                   "tablier", "compas", "equerre", "rapporteur", "pochette", "etiquettes", "pinceau", "peinture",
+                   "pate a modeler", "cartable", "papier", "cahier", "cahiers", "copies", "surligneur", "agrafeuse")
+# Éditeurs courants, en complément de manuels.editeur (base vide ou nouveaux éditeurs).
+EDITEURS_DE_BASE = ("hachette", "nathan", "bordas", "hatier", "belin", "magnard", "didier", "larousse", "retz", "istra",
+                    "delagrave", "foucher", "oxford", "cambridge", "pearson", "macmillan", "dar al kitab", "afrique orient")
+
+_editeurs = {"motif": None, "date": 0.0}
+_editeurs_lock = threading.Lock()
+DUREE_EDITEURS = 3600
+
+def normaliser(texte):
+    """Minuscules, sans accents ni signes diacritiques (appliqué aux mots-clés comme aux lignes)."""
+    return "".join(c for c in unicodedata.normalize("NFD", texte.lower()) if not unicodedata.combining(c))
+
+def _motif(mots):
+    mots = sorted({normaliser(m) for m in mots if m and len(m.strip()) >= 3}, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(m) for m in mots) + r")(?!\w)") if mots else None
+
+_MOTIF_LIVRE = _motif(MOTS_LIVRE)
+_MOTIF_MATIERE = _motif(MOTS_MATIERE)
+_MOTIF_FOURNITURE = _motif(MOTS_FOURNITURE)
+
+def motif_editeurs(db_conn):
+    """Motif des éditeurs connus (manuels.editeur + EDITEURS_DE_BASE), relu au plus une fois par heure."""
+    with _editeurs_lock:
+        if _editeurs["motif"] is None or time.time() - _editeurs["date"] > DUREE_EDITEURS:
+            try:
+                connus = database.get_known_publishers(db_conn)
+            except Exception as e:
+                print(f"    -> WARNING: could not load known publishers: {e}")
+                connus = []
+            _editeurs["motif"] = _motif(list(EDITEURS_DE_BASE) + [e for e in connus if len(e) >= 4])
+            _editeurs["date"] = time.time()
+        return _editeurs["motif"]
+
+def score_page(tagged_text, editeurs):
+    """Retourne (score, raisons) d'une page ; raisons compte les lignes par type d'indice."""
+    raisons = {}
+    for ligne in tagged_text.splitlines():
+        ligne = normaliser(_TAG.sub("", ligne))
+        if not ligne.strip(): continue
+        indices = [nom for nom, motif in (("isbn", _ISBN), ("editeur", editeurs), ("livre", _MOTIF_LIVRE))
+                   if motif and motif.search(ligne)]
+        # Une fourniture l'emporte sur une matière (« cahier de français 96 pages ») mais pas sur un
+        # indice de livre (« cahier d'activités Hachette »).
+        if not indices and _MOTIF_FOURNITURE.search(ligne):
+            indices = ["fourniture"]
+        elif _MOTIF_MATIERE.search(ligne):
+            indices.append("matiere")
+        for nom in indices:
+            raisons[nom] = raisons.get(nom, 0) + 1
+    return sum(POIDS[nom] * n for nom, n in raisons.items()), raisons
+
+def pages_sans_livres(db_conn, fichier, pages, seuil=PAGE_FILTER_MIN_SCORE, journaliser=True):
+    """Numéros des pages (parmi [(page_num, tagged_text)]) dont le score est sous `seuil`.
+
+    Si aucune page n'atteint le seuil, aucune n'est écartée : un document entier jugé sans livre
+    relève plus probablement d'une erreur du filtre que d'une liste vide.
+    """
+    editeurs = motif_editeurs(db_conn)
+    scores = {page_num: score_page(texte, editeurs) for page_num, texte in pages}
+    ecartees = {page_num for page_num, (score, _) in scores.items() if score < seuil}
+    if not ecartees: return set()
+    if len(ecartees) == len(scores):
+        print("    -> Page filter: no page looks like a book list, analysing all pages.")
+        return set()
+
+    print(f"    -> Page filter: {len(ecartees)} page(s) without textbooks, only school/year extraction: {sorted(ecartees)}")
+    if journaliser:
+        extraits = dict(pages)
+        lignes = [(fichier['id'], page_num, scores[page_num][0], scores[page_num][1], extraits[page_num][:500]) for page_num in sorted(ecartees)]
+        try:
+            database.log_filtered_pages(db_conn, lignes)
+        except Exception as e:
+            print(f"    -> WARNING: could not write the page filter audit log: {e}")
+    return ecartees
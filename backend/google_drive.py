@@ -1,12 +1,13 @@
 # google_drive.py
 import os.path
-import io
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
+import spool
+from config import DRIVE_DOWNLOAD_CHUNK_MB
 
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 def get_drive_service():
@@ -30,23 +31,31 @@ def get_drive_service():
         print(f"Erreur lors de la création du service Drive: {e}")
         return None
 
-def telecharger_fichier(service, file_id):
-    """Télécharge le contenu d'un fichier depuis Google Drive."""
+def telecharger_fichier(service, file_id, taille_max=None):
+    """Télécharge un fichier depuis Google Drive, morceau par morceau, dans un spool.FichierSpool (ou None)."""
+    contenu = None
     try:
         request = service.files().get_media(fileId=file_id)
-        file_handle = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_handle, request)
+        contenu = spool.FichierSpool(taille_max)
+        downloader = MediaIoBaseDownload(contenu, request, chunksize=DRIVE_DOWNLOAD_CHUNK_MB * 1024 * 1024)
         done = False
         while done is False:
             status, done = downloader.next_chunk()
-        return file_handle.getvalue()
+        return contenu.terminer()
     except Exception as e:
         print(f"   -> ERREUR lors du téléchargement du fichier {file_id}: {e}")
+        if contenu: contenu.fermer()
         return None
 
 # Ajout d'une fonction récursive pour trouver les fichiers dans les sous-dossiers.
-def lister_fichiers_recursif(service, folder_id):
-    """Liste tous les fichiers dans un dossier et ses sous-dossiers, de manière récursive."""
+FILE_FIELDS = 'id, name, mimeType, md5Checksum, size'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+def lister_fichiers_recursif(service, folder_id, dossiers=None):
+    """Liste tous les fichiers dans un dossier et ses sous-dossiers, de manière récursive.
+
+    Si `dossiers` (un set) est fourni, les IDs des sous-dossiers parcourus y sont ajoutés.
+    """
     all_files = []
     page_token = None
     print(f"Recherche de fichiers dans le dossier ID: {folder_id}...")
@@ -55,14 +64,15 @@ def lister_fichiers_recursif(service, folder_id):
             query = f"'{folder_id}' in parents and trashed=false"
             response = service.files().list(q=query,
                                             spaces='drive',
-                                            fields='nextPageToken, files(id, name, mimeType)',
+                                            fields=f'nextPageToken, files({FILE_FIELDS})',
                                             pageToken=page_token).execute()
             
             for item in response.get('files', []):
                 # Si c'est un dossier, on explore son contenu
-                if item.get('mimeType') == 'application/vnd.google-apps.folder':
+                if item.get('mimeType') == FOLDER_MIME_TYPE:
                     print(f"  -> Découverte du sous-dossier: {item.get('name')}")
-                    all_files.extend(lister_fichiers_recursif(service, item.get('id')))
+                    if dossiers is not None: dossiers.add(item.get('id'))
+                    all_files.extend(lister_fichiers_recursif(service, item.get('id'), dossiers))
                 # Si c'est un fichier, on l'ajoute à la liste
                 else:
                     all_files.append(item)
@@ -76,3 +86,61 @@ def lister_fichiers_recursif(service, folder_id):
             
     return all_files
 
+
+
+# --- Découverte incrémentale (API changes) ---
+def obtenir_jeton_changements(service):
+    """Retourne le jeton de départ à partir duquel Drive listera les prochains changements."""
+    return service.changes().getStartPageToken().execute().get('startPageToken')
+
+def obtenir_metadonnees(service, file_id):
+    """Retourne les métadonnées d'un fichier (mêmes champs que le listing), ou None s'il est introuvable."""
+    try:
+        return service.files().get(fileId=file_id, fields=f'{FILE_FIELDS}, trashed').execute()
+    except Exception as e:
+        print(f"   -> ERREUR lors de la lecture des métadonnées de {file_id}: {e}")
+        return None
+
+def lister_changements(service, page_token, dossiers):
+    """Liste les changements Drive depuis `page_token` pour l'arborescence décrite par `dossiers`.
+
+    `dossiers` (set des IDs du dossier racine et de ses sous-dossiers) est mis à jour sur place.
+    Retourne (fichiers_ajoutes_ou_modifies, ids_supprimes, nouveau_jeton).
+    """
+    changements = []
+    nouveau_jeton = None
+    while page_token:
+        response = service.changes().list(
+            pageToken=page_token, spaces='drive', includeRemoved=True,
+            fields=f'nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}, parents, trashed))'
+        ).execute()
+        changements.extend(response.get('changes', []))
+        nouveau_jeton = response.get('newStartPageToken', nouveau_jeton)
+        page_token = response.get('nextPageToken')
+
+    fichiers, supprimes = {}, set()
+    # Les dossiers d'abord : un fichier peut apparaître dans un sous-dossier créé dans la même fenêtre.
+    for change in changements:
+        item = change.get('file') or {}
+        if item.get('mimeType') != FOLDER_MIME_TYPE: continue
+        if change.get('removed') or item.get('trashed'):
+            dossiers.discard(change.get('fileId'))
+        elif item['id'] not in dossiers and dossiers.intersection(item.get('parents', [])):
+            print(f"  -> Nouveau sous-dossier: {item.get('name')}")
+            dossiers.add(item['id'])
+            # Un dossier déplacé dans l'arborescence n'émet pas de changement pour son contenu.
+            for f in lister_fichiers_recursif(service, item['id'], dossiers):
+                fichiers[f['id']] = f
+
+    for change in changements:
+        item = change.get('file') or {}
+        if item.get('mimeType') == FOLDER_MIME_TYPE: continue
+        file_id = change.get('fileId')
+        if change.get('removed') or item.get('trashed'):
+            supprimes.add(file_id)
+            fichiers.pop(file_id, None)
+        elif dossiers.intersection(item.get('parents', [])):
+            supprimes.discard(file_id)
+            fichiers[file_id] = {k: item[k] for k in ('id', 'name', 'mimeType', 'md5Checksum', 'size') if k in item}
+
+    return list(fichiers.values()), supprimes, nouveau_jeton
\ No newline at end of file
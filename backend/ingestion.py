@@ -0,0 +1,377 @@
+# ingestion.py
+# Étapes de traitement d'un fichier, partagées par le mode séquentiel (main.py)
+# et le mode pipeline (pipeline.py).
+import hashlib
+import json
+import traceback
+import database
+import doc_processor
+import ai_processor
+import job_queue
+import telemetrie
+import spool
+import filtre_pages
+import extraction_tableaux
+from config import PAGE_CONCURRENCY, EXTRACTION_MODE, DRIVE_DISCOVERY_MODE, OCR_MODE, INGESTION_JOB_QUEUE, PAGE_FILTER_ENABLED, TABLE_EXTRACTION_ENABLED
+from config import STANDARDISATION_DEFERRED
+
+def options_par_defaut(**surcharges):
+    """Options d'une passe d'ingestion : valeurs de config.py, surchargées par l'appelant (CLI)."""
+    options = {
+        "test_mode": False,
+        "page_concurrency": PAGE_CONCURRENCY,
+        "extraction_mode": EXTRACTION_MODE,
+        "discovery_mode": DRIVE_DISCOVERY_MODE,
+        "ocr_mode": OCR_MODE,
+        "job_queue": INGESTION_JOB_QUEUE,
+        "page_filter": PAGE_FILTER_ENABLED,
+        "table_extraction": TABLE_EXTRACTION_ENABLED,
+        "deferred_standardisation": STANDARDISATION_DEFERRED,
+    }
+    options.update({cle: valeur for cle, valeur in surcharges.items() if valeur is not None})
+    return options
+
+def empreinte_drive(fichier):
+    """Empreinte de contenu tirée des métadonnées Drive (md5Checksum + taille), ou None."""
+    if not fichier.get('md5Checksum'): return None
+    return f"md5:{fichier['md5Checksum']}:{fichier.get('size', '')}"
+
+def empreinte_contenu(contenu):
+    """Même format qu'empreinte_drive, calculé sur le contenu téléchargé (octets ou spool.FichierSpool)."""
+    md5 = contenu.md5 if isinstance(contenu, spool.FichierSpool) else hashlib.md5(contenu).hexdigest()
+    return f"md5:{md5}:{len(contenu)}"
+
+def charger_checkpoints(db_conn, fichier):
+    """Points de reprise du fichier pour son contenu actuel : {(etape, page): donnees}."""
+    if not fichier.get('empreinte'): return {}
+    return {(c['etape'], c['page']): json.loads(c['donnees_json']) if c['donnees_json'] else None
+            for c in database.get_checkpoints(db_conn, fichier['id'], fichier['empreinte'])}
+
+def marquer_etape(db_conn, fichier, etape, page=0, donnees=None, commit=True):
+    """Enregistre une étape terminée (OCR, PAGE n, INSERE) pour le contenu actuel du fichier."""
+    if not fichier.get('empreinte'): return
+    database.save_checkpoint(db_conn, fichier['id'], fichier['empreinte'], etape, page, donnees, commit)
+
+def _insertion_deja_faite(db_conn, fichier):
+    """Retourne ('TRAITÉ', message) si l'insertion de ce contenu a été validée mais pas encore journalisée."""
+    insere = charger_checkpoints(db_conn, fichier).get(('INSERE', 0))
+    if not insere: return None
+    print("  -> RESUME: data already inserted by an interrupted run, only the log is missing.")
+    return 'TRAITÉ', insere['message']
+
+def verifier_doublon(db_conn, fichier, empreinte):
+    """Retourne ('DOUBLON', message) si ce contenu a déjà été traité sous un autre fichier, sinon None."""
+    fichier['empreinte'] = empreinte
+    id_source = database.get_fichier_par_empreinte(db_conn, empreinte, fichier['id'])
+    if not id_source: return None
+    fichier['doublon_de'] = id_source
+    log_message = f"Identical content already processed as file {id_source}; extraction reused."
+    print(f"  -> DUPLICATE: {log_message}")
+    return 'DOUBLON', log_message
+
+def telecharger_sans_doublon(drive_service, db_conn, fichier):
+    """Télécharge un fichier sauf si son contenu est déjà connu. Retourne (log_status, log_message, contenu).
+
+    log_status vaut None si le contenu reste à traiter (ni doublon, ni déjà inséré). L'empreinte Drive évite le téléchargement ;
+    à défaut, l'empreinte calculée pendant le téléchargement est vérifiée avant l'OCR. `contenu` (spool.FichierSpool,
+    à fermer par l'appelant) vaut None quand le résultat OCR de ce contenu est déjà sur disque (voir doc_processor.ocr_document).
+    """
+    empreinte = empreinte_drive(fichier)
+    if empreinte:
+        doublon = verifier_doublon(db_conn, fichier, empreinte) or _insertion_deja_faite(db_conn, fichier)
+        if doublon: return doublon + (None,)
+        if doc_processor.ocr_en_cache(fichier['id'], empreinte):
+            print("  -> OCR result already on disk, skipping download.")
+            return None, "", None
+
+    with telemetrie.mesurer(fichier, 'telechargement') as metriques:
+        succes, message, contenu = doc_processor.telecharger_document(drive_service, fichier)
+        if succes: metriques.ajouter(telechargement_octets=len(contenu))
+    if not succes:
+        return 'ERREUR_OCR', message, None
+
+    if not empreinte:
+        doublon = verifier_doublon(db_conn, fichier, empreinte_contenu(contenu)) or _insertion_deja_faite(db_conn, fichier)
+        if doublon:
+            spool.liberer(contenu)
+            return doublon + (None,)
+    return None, "", contenu
+
+def ocr_fichier(fichier, contenu):
+    """OCR du fichier (ou lecture du cache OCR), avec mesure du temps et du nombre de pages. Ferme le spool `contenu`."""
+    depuis_cache = doc_processor.ocr_en_cache(fichier['id'], fichier.get('empreinte'))
+    with telemetrie.mesurer(fichier, 'ocr') as metriques:
+        try:
+            succes, message, doc_obj = doc_processor.ocr_document(fichier, contenu, fichier.get('empreinte'))
+        finally:
+            spool.liberer(contenu)
+        if succes: metriques.ajouter(ocr_pages=len(doc_obj.pages), ocr_cache=int(depuis_cache))
+    return succes, message, doc_obj
+
+def separer_doublons_internes(fichiers):
+    """Sépare les fichiers dont l'empreinte Drive apparaît déjà plus haut dans la liste.
+
+    Retourne (premiers, doublons) ; traiter `doublons` après `premiers` permet de les
+    rattacher à l'extraction du premier exemplaire au lieu de les traiter en parallèle.
+    """
+    vues, premiers, doublons = set(), [], []
+    for fichier in fichiers:
+        empreinte = empreinte_drive(fichier)
+        if empreinte and empreinte in vues:
+            doublons.append(fichier)
+        else:
+            if empreinte: vues.add(empreinte)
+            premiers.append(fichier)
+    return premiers, doublons
+
+def _agreger_page(donnees_agregees, donnees_page):
+    """Fusionne le résultat d'une page dans l'agrégat du document."""
+    if not donnees_agregees['ecole']['nom_standardise'] and donnees_page.get('ecole', {}).get('nom_standardise'):
+        donnees_agregees['ecole'] = donnees_page['ecole']
+
+    if not donnees_agregees['annee_scolaire']['annee_standardisee'] and donnees_page.get('annee_scolaire', {}).get('annee_standardisee'):
+        donnees_agregees['annee_scolaire'] = donnees_page['annee_scolaire']
+
+    for niveau_page in donnees_page.get('niveaux', []):
+        nom_std = niveau_page.get('nom_standardise')
+        if not nom_std: continue
+
+        if nom_std not in donnees_agregees['niveaux_map']:
+            donnees_agregees['niveaux_map'][nom_std] = {
+                "nom_brut": niveau_page.get('nom_brut'),
+                "nom_standardise": nom_std,
+                "niveau_source_tags": [],
+                "manuels": []
+            }
+            if niveau_page.get('standardisation_differee'): donnees_agregees['niveaux_map'][nom_std]['standardisation_differee'] = True
+
+        donnees_agregees['niveaux_map'][nom_std]['manuels'].extend(niveau_page.get('manuels', []))
+        donnees_agregees['niveaux_map'][nom_std]['niveau_source_tags'].extend(niveau_page.get('niveau_source_tags', []))
+
+def analyser_document(db_conn, fichier, doc_obj, options=None):
+    """Analyse le document page par page. Retourne (donnees_a_inserer, position_mapping_complet).
+
+    `options["extraction_mode"]` choisit entre les trois prompts séparés ("triple") et le
+    prompt unique ("combine"). Avec `options["page_concurrency"]` > 1, les appels Gemini de toutes les pages partent en parallèle
+    (au plus `page_concurrency` à la fois pour ce fichier) ; la standardisation et l'agrégation
+    restent faites dans l'ordre des pages pour un résultat déterministe.
+
+    Hors mode test, chaque page standardisée est enregistrée comme point de reprise : après
+    une interruption, les pages déjà analysées sont reprises telles quelles, sans appel Gemini.
+
+    Avec `options["page_filter"]`, les pages jugées sans manuels par filtre_pages ne passent que
+    par les prompts école et année. Avec `options["table_extraction"]`, il en va de même pour les pages
+    en tableau lues de façon fiable par extraction_tableaux, dont les manuels sont repris tels quels.
+    """
+    with telemetrie.mesurer(fichier, 'analyse'):
+        return _analyser_pages(db_conn, fichier, doc_obj, options or options_par_defaut())
+
+def _analyser_pages(db_conn, fichier, doc_obj, options):
+    page_concurrency = options["page_concurrency"]
+    mode = options["extraction_mode"]
+    reprise = not options["test_mode"]
+    checkpoints = charger_checkpoints(db_conn, fichier) if reprise else {}
+    if reprise: marquer_etape(db_conn, fichier, 'OCR', donnees={"pages": len(doc_obj.pages)})
+    donnees_agregees = {
+        "ecole": {"nom_standardise": None, "source_tags": []},
+        "annee_scolaire": {"annee_standardisee": None, "source_tags": []},
+        "niveaux_map": {}
+    }
+    pages_a_analyser = []
+
+    print(f"  -> Starting page-by-page analysis for {len(doc_obj.pages)} page(s)...")
+
+    # Un seul parcours du document ; tags numérotés à la suite sur toutes les pages.
+    document_tague = doc_processor.DocumentTague(doc_obj)
+    for page_num in document_tague.numeros_pages():
+        tagged_text_page = document_tague.texte_page(page_num)
+        if not tagged_text_page.strip():
+            print(f"    -> Page {page_num} is empty, skipping.")
+            continue
+        pages_a_analyser.append((page_num, tagged_text_page))
+
+    pages_reprises = {page_num: checkpoints[('PAGE', page_num)] for page_num, _ in pages_a_analyser if ('PAGE', page_num) in checkpoints}
+    if pages_reprises:
+        print(f"    -> RESUME: {len(pages_reprises)} page(s) already analysed by an interrupted run.")
+    pages_a_lancer = [(page_num, texte) for page_num, texte in pages_a_analyser if page_num not in pages_reprises]
+    sans_livres = filtre_pages.pages_sans_livres(db_conn, fichier, pages_a_lancer, journaliser=reprise) \
+        if options["page_filter"] and pages_a_lancer else set()
+    tableaux = _extraire_tableaux(doc_obj, document_tague, [page_num for page_num, _ in pages_a_lancer if page_num not in sans_livres]) \
+        if options["table_extraction"] else {}
+    sans_livres = sans_livres | tableaux.keys()
+
+    futures_pages = {}
+    if page_concurrency > 1 and pages_a_lancer:
+        print(f"    -> Fanning out AI analysis of {len(pages_a_lancer)} page(s), max {page_concurrency} concurrent call(s)...")
+        limite = ai_processor.limite_appels(page_concurrency)
+        futures_pages = {page_num: ai_processor.lancer_extraction_brute(limite, tagged_text_page, mode, page_num not in sans_livres)
+                         for page_num, tagged_text_page in pages_a_lancer}
+    try:
+        for page_num, tagged_text_page in pages_a_analyser:
+            if page_num in pages_reprises:
+                donnees_page = pages_reprises[page_num]
+            elif futures_pages:
+                donnees_brutes = ai_processor.collecter_extraction_brute(futures_pages[page_num])
+                print(f"    -> AI results received for page {page_num}/{len(doc_obj.pages)}.")
+                if page_num in tableaux: donnees_brutes['extraction'] = tableaux[page_num]
+                donnees_page = ai_processor.standardiser_donnees_brutes(db_conn, donnees_brutes, options["deferred_standardisation"])
+            else:
+                print(f"    -> Launching AI analysis for page {page_num}/{len(doc_obj.pages)}...")
+                donnees_page = ai_processor.generer_json_pour_insertion_avec_positions(
+                    db_conn, fichier, tagged_text_page, mode, page_num not in sans_livres, tableaux.get(page_num),
+                    options["deferred_standardisation"])
+            if reprise and page_num not in pages_reprises:
+                marquer_etape(db_conn, fichier, 'PAGE', page_num, donnees_page)
+            _agreger_page(donnees_agregees, donnees_page)
+    finally:
+        # Interruption (erreur, arrêt) : les appels encore en vol ou en attente sont annulés.
+        for futures in futures_pages.values():
+            for future in futures.values(): future.cancel()
+
+    donnees_a_inserer = {
+        "ecole": donnees_agregees['ecole'],
+        "annee_scolaire": donnees_agregees['annee_scolaire'],
+        "niveaux": list(donnees_agregees['niveaux_map'].values())
+    }
+
+    print("  -> Aggregation of all pages complete.")
+    return donnees_a_inserer, document_tague.position_mapping
+
+def _extraire_tableaux(doc_obj, document_tague, pages):
+    """Extraction déterministe des pages en tableau : {page_num: {"niveaux": [...]}} pour les pages lues de façon fiable."""
+    tableaux = {}
+    for page_num in pages:
+        try:
+            extraction = extraction_tableaux.extraire_page(document_tague.page(page_num), doc_obj.text,
+                                                           document_tague.positions_page(page_num))
+        except Exception as e:
+            print(f"    -> WARNING: table extraction failed on page {page_num}: {e}")
+            continue
+        if extraction: tableaux[page_num] = extraction
+    if tableaux:
+        print(f"    -> Table extraction: textbooks of page(s) {sorted(tableaux)} read without Gemini.")
+    return tableaux
+
+def inserer_donnees(db_conn, cache, fichier, donnees_a_inserer, position_mapping_complet, nb_pages, test_mode=False):
+    """Insère les données agrégées d'un fichier en base. Retourne (log_status, log_message).
+
+    Toutes les écritures du fichier (entités, listes, manuels, positions, point de reprise
+    INSERE) forment une seule transaction : en cas d'erreur, rien ne reste en base. Les verrous
+    nommés pris pour créer écoles, années, niveaux et listes sont gardés jusqu'au commit, pour
+    que deux workers ne créent pas la même entité.
+    """
+    total_manuels = sum(len(n.get('manuels', [])) for n in donnees_a_inserer.get('niveaux', []))
+
+    if total_manuels == 0:
+        log_message = "No textbooks were extracted by the AI from any page."
+        print(f"  -> ERROR: {log_message}")
+        return 'ERREUR_EXTRACTION', log_message
+
+    if test_mode:
+        print("  -> RESULT (TEST MODE):", json.dumps(donnees_a_inserer, indent=2, ensure_ascii=False))
+        return 'TEST_MODE', "Result printed, nothing written."
+
+    print("  -> Inserting aggregated data into the database...")
+    # Les ID créés dans la transaction n'entrent dans le cache partagé qu'après le commit.
+    cache_transaction = dict(cache)
+    verrous = []
+    with telemetrie.mesurer(fichier, 'bdd'):
+        try:
+            log_message = _inserer_transaction(db_conn, cache_transaction, verrous, fichier, donnees_a_inserer, position_mapping_complet, nb_pages)
+            db_conn.commit()
+        except Exception:
+            db_conn.rollback()
+            raise
+        finally:
+            database.release_named_locks(db_conn, verrous)
+    cache.update(cache_transaction)
+    print(f"  -> SUCCESS: {log_message}")
+    return 'TRAITÉ', log_message
+
+def _id_entite_standardisee(db_conn, cache, verrous, entity_type, column_name, donnees):
+    """get_or_create_entity_id pour une école ou un niveau. Un nom brut en attente de standardisation n'est
+    pas mis en cache ; si son entité est créée ici, son ID est noté dans standardisation_en_attente (même
+    transaction) : standardisation_differee ne renomme ou ne fusionne que les entités créées ainsi."""
+    nom = donnees.get('nom_standardise')
+    if not donnees.get('standardisation_differee') or not nom:
+        return database.get_or_create_entity_id(db_conn, cache, nom, entity_type, column_name, commit=False, locks=verrous)
+    creees = []
+    entity_id = database.get_or_create_entity_id(db_conn, {}, nom, entity_type, column_name, commit=False, locks=verrous, created=creees)
+    for id_cree in creees:
+        database.add_pending_standardisation(db_conn, entity_type, nom, id_cree, commit=False)
+    return entity_id
+
+def _inserer_transaction(db_conn, cache, verrous, fichier, donnees_a_inserer, position_mapping_complet, nb_pages):
+    """Écritures d'inserer_donnees, sans commit. Retourne le message de journal."""
+    entity_map = {"niveaux": {}, "manuels": {}}
+
+    id_ecole = _id_entite_standardisee(db_conn, cache, verrous, 'ecoles', 'nom_ecole', donnees_a_inserer['ecole'])
+    entity_map['ecole'] = {'id': id_ecole, 'source_tags': donnees_a_inserer['ecole'].get('source_tags', [])}
+
+    id_annee = database.get_or_create_entity_id(db_conn, cache, donnees_a_inserer['annee_scolaire']['annee_standardisee'], 'annees_scolaires', 'annee_scolaire', commit=False, locks=verrous)
+    entity_map['annee'] = {'id': id_annee, 'source_tags': donnees_a_inserer['annee_scolaire'].get('source_tags', [])}
+
+    manuels_inseres_count = 0
+    for niveau_data in donnees_a_inserer.get('niveaux', []):
+        nom_std = niveau_data.get('nom_standardise')
+        tags_niveau = niveau_data.get('niveau_source_tags', [])
+        id_niveau = _id_entite_standardisee(db_conn, cache, verrous, 'niveaux', 'nom_niveau', niveau_data)
+        entity_map['niveaux'][id_niveau] = {'source_tags': tags_niveau}
+
+        if not all([id_ecole, id_annee, id_niveau]):
+            print(f"  -> WARNING: Missing info for level {nom_std}. Skipping list creation.")
+            continue
+
+        id_liste = database.get_or_create_liste_id(db_conn, id_ecole, id_annee, id_niveau, fichier['id'], commit=False, locks=verrous)
+
+        for manuel_data in niveau_data.get('manuels', []):
+            if manuel_data.get('titre_livre'):
+                id_manuel = database.inserer_manuel(db_conn, manuel_data, id_niveau, commit=False)
+                entity_map['manuels'][id_manuel] = {'source_tags': manuel_data.get('source_tags', [])}
+                database.creer_lien_liste_manuel(db_conn, id_liste, id_manuel, commit=False)
+                manuels_inseres_count += 1
+            else:
+                print(f"  -> WARNING: Textbook without a title ignored. Tags: {manuel_data.get('source_tags')}")
+
+    print("  -> Saving positions from all pages...")
+    nb_positions = database.save_extraction_positions(db_conn, fichier['id'], entity_map, position_mapping_complet, commit=False)
+    # Un manuel = une ligne dans manuels et une dans liste_manuels.
+    telemetrie.pour(fichier).ajouter(bdd_lignes=2 * manuels_inseres_count + nb_positions)
+
+    log_message = f"{manuels_inseres_count} textbook(s) inserted from {nb_pages} pages."
+    # Validé avec les données : une reprise après un arrêt avant log_resultat n'insère pas une seconde fois.
+    marquer_etape(db_conn, fichier, 'INSERE', donnees={"message": log_message}, commit=False)
+    return log_message
+
+def traiter_fichier(drive_service, db_conn, cache, fichier, options):
+    """Traite un fichier de bout en bout (mode séquentiel). Retourne (log_status, log_message)."""
+    try:
+        log_status, log_message, contenu = telecharger_sans_doublon(drive_service, db_conn, fichier)
+        if log_status:
+            return log_status, log_message
+
+        succes, message, doc_obj = ocr_fichier(fichier, contenu)
+        if not succes:
+            return 'ERREUR_OCR', message
+
+        donnees_a_inserer, position_mapping_complet = analyser_document(db_conn, fichier, doc_obj, options)
+        return inserer_donnees(db_conn, cache, fichier, donnees_a_inserer, position_mapping_complet, len(doc_obj.pages), options["test_mode"])
+    except Exception as e:
+        print(f"   -> GLOBAL ERROR on file: {e}"); traceback.print_exc()
+        return 'ERREUR_INCONNUE', f"Unexpected error: {str(e)}"
+
+def log_resultat(db_conn, fichier, log_status, log_message):
+    """Enregistre le statut final d'un fichier dans logs_fichiers, et son empreinte s'il a abouti.
+
+    Si le fichier vient de la file de jobs, son job est clos (ou remis en file pour un nouvel essai).
+    """
+    mime_type = fichier.get('mimeType', None)
+    database.log_to_db(db_conn, fichier['id'], fichier['name'], mime_type, log_status, log_message)
+    if fichier.get('empreinte') and log_status in ('TRAITÉ', 'DOUBLON'):
+        database.enregistrer_empreinte(db_conn, fichier['id'], fichier['empreinte'], fichier.get('doublon_de'))
+    # Les points de reprise ne servent plus une fois le fichier dans un état final.
+    if log_status in ('TRAITÉ', 'DOUBLON', 'ERREUR_EXTRACTION'):
+        database.clear_checkpoints(db_conn, fichier['id'])
+    telemetrie.sauvegarder(db_conn, fichier, log_status)
+    if fichier.get('bail'):
+        job_queue.terminer(db_conn, fichier, log_status, log_message)
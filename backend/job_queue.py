@@ -0,0 +1,105 @@
+# job_queue.py
+# File de jobs d'ingestion en base (table jobs_ingestion), pour faire tourner plusieurs workers
+# main.py en parallèle, sur une ou plusieurs machines :
+#   - la découverte Drive publie les fichiers à traiter (un seul worker à la fois, verrou nommé) ;
+#   - chaque worker réserve des jobs distincts (SELECT ... FOR UPDATE SKIP LOCKED) pour une durée
+#     de bail, prolongée par un heartbeat tant qu'il est vivant ;
+#   - un job en échec revient dans la file avec un délai croissant, jusqu'à JOB_MAX_ATTEMPTS ;
+#   - le bail d'un worker disparu expire et son job est repris par un autre.
+#
+# États d'un job (jobs_ingestion.statut), transitions écrites en SQL dans database.py :
+#   EN_ATTENTE -> EN_COURS     réservation (claim_jobs) : tentatives + 1, bail de JOB_LEASE_SECONDS
+#   EN_COURS   -> EN_COURS     bail expiré, repris par un autre worker (tentatives + 1) tant que tentatives < JOB_MAX_ATTEMPTS
+#   EN_COURS   -> ECHEC        bail expiré après la dernière tentative
+#   EN_COURS   -> TERMINE      statut final du fichier (complete_job, STATUTS_FINAUX)
+#   EN_COURS   -> EN_ATTENTE   autre statut : réessai après JOB_RETRY_DELAY_SECONDS * 2^(tentatives - 1)...
+#   EN_COURS   -> ECHEC        ... sauf après la dernière tentative
+#   EN_COURS   -> EN_ATTENTE   arrêt propre (liberer, release_jobs) : la tentative n'est pas comptée
+#   TERMINE / ECHEC -> EN_ATTENTE   republication avec une autre empreinte (tentatives remises à 0)
+# Le résultat d'un worker dont le bail a été repris est ignoré (complete_job filtre sur le worker).
+# tests/test_job_queue.py vérifie ces transitions sur une base MySQL de test (TEST_DB_NAME), et sans serveur
+# la logique Python autour du SQL (partage réservation/échec, ordre des affectations, statuts finaux).
+import os
+import socket
+import threading
+import database
+import drive_sync
+import ingestion
+from config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY_SECONDS
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Statuts de logs_fichiers qui terminent un job ; les autres (ERREUR_OCR, ERREUR_INCONNUE...) sont réessayés.
+STATUTS_FINAUX = ('TRAITÉ', 'DOUBLON', 'ERREUR_EXTRACTION', 'TEST_MODE')
+
+def publier(db_conn, fichiers, priorite=0):
+    """Ajoute des fichiers Drive à la file (ou rafraîchit leurs métadonnées)."""
+    database.enqueue_jobs(db_conn, [(f['id'], f.get('name'), ingestion.empreinte_drive(f), f, priorite) for f in fichiers])
+
+def decouvrir_et_publier(drive_service, db_conn, folder_id, mode):
+    """Découverte Drive puis publication dans la file. Retourne le nombre de fichiers publiés.
+
+    Un seul worker découvre à la fois ; les autres passent directement à la réservation de jobs.
+    """
+    verrou = database.acquire_named_lock(db_conn, f"discovery:{folder_id}", timeout=0)
+    if not verrou:
+        print("  -> Discovery already running on another worker, skipping it.")
+        return 0
+    try:
+        fichiers = drive_sync.decouvrir_fichiers(drive_service, db_conn, folder_id, mode)
+        publier(db_conn, fichiers)
+        print(f"  -> {len(fichiers)} file(s) published to the job queue.")
+        return len(fichiers)
+    finally:
+        database.release_named_locks(db_conn, [verrou])
+
+# Connexion propre aux réservations : leur commit ne valide jamais le travail en cours de l'appelant.
+_connexion_reservation = None
+
+def reserver(nombre):
+    """Réserve jusqu'à `nombre` jobs pour ce worker. Retourne les fichiers (métadonnées Drive) correspondants."""
+    global _connexion_reservation
+    if not (_connexion_reservation and _connexion_reservation.is_connected()):
+        _connexion_reservation = database.get_connection()
+    fichiers = database.claim_jobs(_connexion_reservation, WORKER_ID, nombre, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+    for fichier in fichiers:
+        fichier['bail'] = WORKER_ID
+    return fichiers
+
+def terminer(db_conn, fichier, log_status, log_message):
+    """Clôt le job d'un fichier réservé, d'après son statut final dans logs_fichiers."""
+    database.complete_job(db_conn, fichier['id'], fichier['bail'], log_status in STATUTS_FINAUX, log_message,
+                          JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY_SECONDS)
+
+def liberer(db_conn):
+    """Rend à la file les jobs encore réservés par ce worker (arrêt ou erreur en cours de passe)."""
+    nombre = database.release_jobs(db_conn, WORKER_ID)
+    if nombre: print(f"  -> {nombre} unfinished job(s) returned to the queue.")
+    global _connexion_reservation
+    if _connexion_reservation and _connexion_reservation.is_connected(): _connexion_reservation.close()
+    _connexion_reservation = None
+
+class MaintienDesBaux(threading.Thread):
+    """Heartbeat : prolonge les baux de ce worker toutes les JOB_LEASE_SECONDS / 3, sur sa propre connexion."""
+    def __init__(self):
+        super().__init__(name="job-heartbeat", daemon=True)
+        self._arret = threading.Event()
+
+    def run(self):
+        db_conn = None
+        while not self._arret.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                if not (db_conn and db_conn.is_connected()):
+                    db_conn = database.get_connection()
+                database.extend_job_leases(db_conn, WORKER_ID, JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"  -> WARNING: could not extend job leases: {e}")
+        if db_conn and db_conn.is_connected(): db_conn.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._arret.set()
+        self.join()
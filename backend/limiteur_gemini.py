@@ -0,0 +1,304 @@
+# limiteur_gemini.py
+# Limiteur de débit commun à tous les appels Gemini du processus : deux seaux de jetons
+# (requêtes par minute et tokens par minute) remplis en continu à une fraction du quota, plus
+# une limite de concurrence adaptative (divisée par deux à chaque 429, remontée d'un cran
+# après une série de succès). Les indications du serveur (Retry-After, RetryInfo) mettent
+# tous les appels en pause, pas seulement celui qui les a reçues.
+#
+# Avec un fichier d'état partagé, les seaux et la pause sont communs à tous les processus de
+# la machine (verrou fcntl, synchronisation toutes les SYNCHRO_ETAT_S secondes) ; sans fichier,
+# ou hors POSIX, ils sont propres au processus.
+import asyncio
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows : état local au processus uniquement
+    fcntl = None
+
+# Capacité des seaux, en secondes de débit : une rafale ne dépasse jamais 1/10e du quota minute.
+RAFALE_SECONDES = 6
+# Succès consécutifs avant de rendre un appel simultané après une limitation.
+SUCCES_AVANT_HAUSSE = 20
+# Intervalle de synchronisation du fichier d'état partagé : la consommation des autres processus est
+# vue avec au plus ce retard, et les appels du processus ne lisent jamais le fichier eux-mêmes.
+SYNCHRO_ETAT_S = 1.0
+SEAUX = ("rpm", "tpm")
+
+class _EtatLocal:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._etat = {}
+
+    def modifier(self, fonction, synchroniser=True):
+        with self._lock:
+            return fonction(self._etat)
+
+    def synchronisation_due(self):
+        return False
+
+    def synchroniser(self):
+        pass
+
+class _EtatFichier:
+    """Même interface que _EtatLocal. Les appels modifient une copie locale de l'état ; les débits qu'ils y
+    font sont reportés dans le fichier JSON (verrou exclusif) au plus toutes les `intervalle` secondes,
+    en même temps que la copie est rafraîchie avec la consommation des autres processus."""
+    def __init__(self, chemin, remplir, intervalle=SYNCHRO_ETAT_S):
+        self.chemin = chemin
+        self.intervalle = intervalle
+        self._remplir = remplir
+        self._vue = {}
+        self._debits = dict.fromkeys(SEAUX, 0.0)
+        self._derniere = None
+        self._lock = threading.Lock()
+        self._synchro_lock = threading.Lock()
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+
+    def modifier(self, fonction, synchroniser=True):
+        """Applique `fonction` à la copie locale ; avec `synchroniser`, synchronise d'abord le fichier si c'est dû."""
+        if synchroniser and self.synchronisation_due(): self.synchroniser()
+        with self._lock:
+            self._remplir(self._vue, time.time())
+            avant = {seau: self._vue[seau][0] for seau in SEAUX}
+            resultat = fonction(self._vue)
+            for seau in SEAUX:
+                self._debits[seau] += avant[seau] - self._vue[seau][0]
+            return resultat
+
+    def synchronisation_due(self):
+        return self._derniere is None or time.monotonic() - self._derniere >= self.intervalle
+
+    def synchroniser(self):
+        """Reporte les débits locaux dans le fichier et remplace la copie locale par l'état commun."""
+        with self._synchro_lock:
+            if not self.synchronisation_due(): return
+            with self._lock:
+                debits, self._debits = self._debits, dict.fromkeys(SEAUX, 0.0)
+                pause = self._vue.get("pause_jusqu_a", 0)
+            try:
+                etat = self._fusionner(debits, pause)
+            except BaseException:
+                with self._lock:
+                    for seau in SEAUX: self._debits[seau] += debits[seau]
+                raise
+            with self._lock:
+                # Débits faits pendant l'écriture du fichier : appliqués à la nouvelle copie, reportés à la prochaine fois.
+                for seau in SEAUX:
+                    niveau, maj = etat[seau]
+                    etat[seau] = (niveau - self._debits[seau], maj)
+                etat["pause_jusqu_a"] = max(etat.get("pause_jusqu_a", 0), self._vue.get("pause_jusqu_a", 0))
+                self._vue = etat
+                self._derniere = time.monotonic()
+
+    def _fusionner(self, debits, pause):
+        with open(self.chemin, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    etat = json.loads(f.read() or "{}")
+                except json.JSONDecodeError:
+                    etat = {}
+                for seau in SEAUX:
+                    if seau in etat: etat[seau] = tuple(etat[seau])
+                self._remplir(etat, time.time())
+                for seau in SEAUX:
+                    niveau, maj = etat[seau]
+                    etat[seau] = (niveau - debits[seau], maj)
+                etat["pause_jusqu_a"] = max(etat.get("pause_jusqu_a", 0), pause)
+                f.seek(0); f.truncate()
+                f.write(json.dumps(etat))
+                f.flush()
+                return etat
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class LimiteurGemini:
+    def __init__(self, rpm, tpm, marge=0.9, concurrence_max=8, fichier_etat=None, attente_max=60):
+        self.rpm = rpm * marge
+        self.tpm = tpm * marge
+        self.concurrence_max = max(1, concurrence_max)
+        self.attente_max = attente_max
+        if fichier_etat and fcntl is not None:
+            self._etat = _EtatFichier(fichier_etat, self._remplir)
+        else:
+            if fichier_etat: print("    -> WARNING: shared Gemini rate state needs fcntl, using a per-process limiter.")
+            self._etat = _EtatLocal()
+        self._condition = threading.Condition()
+        self._limite = self.concurrence_max
+        self._en_cours = 0
+        self._attentes = collections.deque()  # (boucle, future) des acquerir_async en attente d'une place
+        self._succes = 0
+        self._sortie_moyenne = 500.0  # Tokens de sortie attendus par appel, moyenne glissante
+        self.stats = {"appels": 0, "limitations": 0, "attente_s": 0.0}
+
+    # --- Seaux de jetons ---
+    def _remplir(self, etat, maintenant):
+        for seau, debit in (("rpm", self.rpm), ("tpm", self.tpm)):
+            capacite = debit * RAFALE_SECONDES / 60
+            niveau, maj = etat.get(seau, (capacite, maintenant))
+            etat[seau] = (min(capacite, niveau + (maintenant - maj) * debit / 60), maintenant)
+
+    def _prendre(self, jetons):
+        """Retourne une fonction d'état qui débite 1 requête et `jetons` tokens, ou renvoie l'attente nécessaire."""
+        def prendre(etat):
+            maintenant = time.time()
+            pause = etat.get("pause_jusqu_a", 0) - maintenant
+            if pause > 0: return pause
+            self._remplir(etat, maintenant)
+            requetes, tokens = etat["rpm"][0], etat["tpm"][0]
+            # Un appel plus gros que la rafale autorisée attend un seau plein puis le rend négatif.
+            besoin = min(jetons, self.tpm * RAFALE_SECONDES / 60)
+            if requetes >= 1 and tokens >= besoin:
+                etat["rpm"] = (requetes - 1, maintenant)
+                etat["tpm"] = (tokens - jetons, maintenant)
+                return 0
+            return max((1 - requetes) * 60 / self.rpm, (besoin - tokens) * 60 / self.tpm)
+        return prendre
+
+    def _corriger(self, ecart):
+        def corriger(etat):
+            self._remplir(etat, time.time())
+            niveau, maj = etat["tpm"]
+            etat["tpm"] = (niveau - ecart, maj)
+        return corriger
+
+    def _pauser(self, secondes):
+        def pauser(etat):
+            etat["pause_jusqu_a"] = max(etat.get("pause_jusqu_a", 0), time.time() + secondes)
+        return pauser
+
+    # --- API ---
+    def estimer_tokens(self, texte):
+        """Estimation (≈ 4 caractères par token) du prompt, plus la sortie moyenne observée."""
+        return len(texte) // 4 + int(self._sortie_moyenne)
+
+    def acquerir(self, jetons):
+        """Bloque jusqu'à obtenir une place de concurrence et le débit nécessaire à un appel de `jetons` tokens."""
+        debut = time.perf_counter()
+        with self._condition:
+            while self._en_cours >= self._limite:
+                self._condition.wait()
+            self._en_cours += 1
+        try:
+            while True:
+                attente = self._etat.modifier(self._prendre(jetons))
+                if attente <= 0: break
+                time.sleep(min(attente, 5) + random.uniform(0, 0.1))
+        except BaseException:
+            self._rendre_place()
+            raise
+        with self._condition:
+            self.stats["appels"] += 1
+            self.stats["attente_s"] += time.perf_counter() - debut
+
+    async def _synchroniser_async(self):
+        # Lecture et écriture du fichier partagé hors de la boucle : les autres appels en vol continuent.
+        if self._etat.synchronisation_due(): await asyncio.to_thread(self._etat.synchroniser)
+
+    async def _attendre_place(self):
+        with self._condition:
+            if self._en_cours < self._limite and not self._attentes:
+                self._en_cours += 1
+                return
+            attente = asyncio.get_running_loop().create_future()
+            self._attentes.append((asyncio.get_running_loop(), attente))
+        try:
+            await attente
+        except BaseException:
+            with self._condition:
+                if (asyncio.get_running_loop(), attente) in self._attentes:
+                    self._attentes.remove((asyncio.get_running_loop(), attente))
+                    raise
+            # Place déjà attribuée : elle est rendue ici, ou par _attribuer si la future a été annulée avant.
+            if attente.done() and not attente.cancelled(): self._rendre_place()
+            raise
+
+    def _attribuer(self, attente):
+        if attente.cancelled(): self._rendre_place()
+        else: attente.set_result(None)
+
+    async def acquerir_async(self, jetons):
+        """Comme acquerir, depuis une boucle asyncio (client_gemini) : attend sans bloquer la boucle.
+
+        Une place libérée est attribuée directement à la coroutine en attente la plus ancienne ; le fichier
+        d'état partagé n'est lu et écrit que dans un thread (asyncio.to_thread).
+        """
+        debut = time.perf_counter()
+        await self._attendre_place()
+        try:
+            while True:
+                await self._synchroniser_async()
+                attente = self._etat.modifier(self._prendre(jetons), synchroniser=False)
+                if attente <= 0: break
+                await asyncio.sleep(min(attente, 5) + random.uniform(0, 0.1))
+        except BaseException:
+            self._rendre_place()
+            raise
+        with self._condition:
+            self.stats["appels"] += 1
+            self.stats["attente_s"] += time.perf_counter() - debut
+
+    def terminer(self, jetons_estimes, usage=None, limite=False, indication=None, synchroniser=True):
+        """Rend la place prise par acquerir. `usage` corrige le seau de tokens ; `limite` signale un 429."""
+        if usage:
+            consommes = usage["prompt_tokens"] + usage["output_tokens"]
+            if consommes: self._etat.modifier(self._corriger(consommes - jetons_estimes), synchroniser)
+            if usage["output_tokens"]:
+                self._sortie_moyenne = 0.9 * self._sortie_moyenne + 0.1 * usage["output_tokens"]
+        if limite:
+            self._etat.modifier(self._pauser(min(indication or RAFALE_SECONDES, self.attente_max)), synchroniser)
+        self._liberer_place(limite)
+
+    async def terminer_async(self, jetons_estimes, usage=None, limite=False, indication=None):
+        """Comme terminer, depuis la boucle asyncio : la place est rendue avant toute synchronisation du fichier."""
+        self.terminer(jetons_estimes, usage, limite, indication, synchroniser=False)
+        await self._synchroniser_async()
+
+    def _liberer_place(self, limite=False):
+        with self._condition:
+            self._en_cours -= 1
+            if limite:
+                self.stats["limitations"] += 1
+                self._succes = 0
+                self._limite = max(1, self._limite // 2)
+            else:
+                self._succes += 1
+                if self._succes >= SUCCES_AVANT_HAUSSE and self._limite < self.concurrence_max:
+                    self._limite += 1
+                    self._succes = 0
+            self._condition.notify_all()
+            self._reveiller()
+
+    def _rendre_place(self):
+        """Rend une place sans compter de succès ni de limitation (appel abandonné avant la requête)."""
+        with self._condition:
+            self._en_cours -= 1
+            self._condition.notify_all()
+            self._reveiller()
+
+    def _reveiller(self):
+        # Sous self._condition : les places libres passent aux coroutines en attente, dans l'ordre d'arrivée.
+        while self._attentes and self._en_cours < self._limite:
+            boucle, attente = self._attentes.popleft()
+            try:
+                boucle.call_soon_threadsafe(self._attribuer, attente)
+            except RuntimeError:  # Boucle fermée : la coroutine n'attend plus.
+                continue
+            self._en_cours += 1
+
+    def delai_reessai(self, tentative, base, indication=None):
+        """Backoff exponentiel à gigue complète, jamais plus court que l'indication du serveur."""
+        delai = random.uniform(0, min(self.attente_max, base * 2 ** tentative))
+        return min(self.attente_max, max(delai, indication or 0))
+
+    def resume(self):
+        with self._condition:
+            return (f"Gemini rate limiter: {self.stats['appels']} call(s), {self.stats['limitations']} throttled (429), "
+                    f"{self.stats['attente_s']:.1f}s waiting, concurrency {self._limite}/{self.concurrence_max}")
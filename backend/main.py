@@ -1,169 +1,234 @@
 # main.py (ou Test.py)
 import database
-import doc_processor
-import ai_processor
 import google_drive
+import ingestion
+import drive_sync
+import pipeline
 import traceback
-import json
-from config import GOOGLE_DRIVE_FOLDER_ID
-from types import SimpleNamespace # N'oubliez pas cet import
+import argparse
+import signal
+import threading
+import ai_processor
+import doc_processor
+import batch_ocr
+import reveil_ingestion
+import job_queue
+import rejeu
+import resolveur_standardisation
+import standardisation_differee
+from config import GOOGLE_DRIVE_FOLDER_ID, INGESTION_WORKERS, INGESTION_QUEUE_SIZE, INGESTION_POLL_SECONDS
+from config import RECORD_REPLAY_MODE, RECORD_REPLAY_DIR
 
 TEST_MODE = False
 
-def main_orchestrator():
+def _traiter_fichiers(drive_service, db_conn, cache, fichiers_a_traiter, workers, queue_size, options, arret=None):
+    """OCR par lots éventuel, puis traitement des fichiers (pipeline ou séquentiel)."""
+    backend_batch = batch_ocr.choisir_backend(options['ocr_mode'], len(fichiers_a_traiter))
+    if backend_batch:
+        print(f"\n[Step 2b] Batch OCR for {len(fichiers_a_traiter)} file(s)...")
+        try:
+            nb_documents = batch_ocr.pre_ocr_par_lots(drive_service, db_conn, fichiers_a_traiter, backend_batch, arret=arret)
+        finally:
+            backend_batch.fermer()
+        print(f"  -> {nb_documents} document(s) OCR'd in batch; the others will use online OCR.")
+
+    if workers > 1:
+        print(f"\n[Step 3] Starting pipelined processing for {len(fichiers_a_traiter)} new file(s)...")
+        # Les copies d'un même contenu passent après le premier exemplaire pour lui être rattachées.
+        premiers, doublons = ingestion.separer_doublons_internes(fichiers_a_traiter)
+        pipeline.executer_pipeline(premiers, workers, queue_size, options, arret)
+        if doublons and not (arret and arret.is_set()):
+            print(f"\n[Step 4] Checking {len(doublons)} file(s) sharing content with files of this run...")
+            pipeline.executer_pipeline(doublons, workers, queue_size, options, arret)
+        return
+
+    print(f"\n[Step 3] Starting processing for {len(fichiers_a_traiter)} new file(s)...")
+    for fichier in fichiers_a_traiter:
+        if arret and arret.is_set():
+            print("\n-> Stop requested, remaining files are left for the next run.")
+            break
+        print(f"\n--- Processing file: {fichier['name']} ({fichier['id']}) ---")
+        log_status, log_message = 'ERREUR_INCONNUE', ''
+        try:
+            log_status, log_message = ingestion.traiter_fichier(drive_service, db_conn, cache, fichier, options)
+        finally:
+             if not TEST_MODE:
+                ingestion.log_resultat(db_conn, fichier, log_status, log_message)
+
+def _executer_passe_file_jobs(drive_service, db_conn, cache, workers, queue_size, options, arret=None):
+    """Passe en mode file de jobs : publie les fichiers découverts, puis réserve et traite des jobs
+    jusqu'à ce que la file soit vide. Retourne le nombre de fichiers traités par ce worker."""
+    print(f"\n[Step 2] Retrieving files and publishing them to the job queue (worker {job_queue.WORKER_ID})...")
+    job_queue.decouvrir_et_publier(drive_service, db_conn, GOOGLE_DRIVE_FOLDER_ID, options['discovery_mode'])
+    # Réservations courtes en séquentiel (répartition fine entre workers), de quoi remplir le pipeline sinon.
+    taille_reservation = workers * queue_size if workers > 1 else 1
+    total = 0
+    with job_queue.MaintienDesBaux():
+        try:
+            while not (arret and arret.is_set()):
+                fichiers = job_queue.reserver(taille_reservation)
+                if not fichiers: break
+                total += len(fichiers)
+                _traiter_fichiers(drive_service, db_conn, cache, fichiers, workers, queue_size, options, arret)
+        finally:
+            job_queue.liberer(db_conn)
+    if not total: print("\n-> No job available in the queue.")
+    return total
+
+def executer_passe(drive_service, db_conn, cache, workers, queue_size, options, arret=None):
+    """Une passe d'ingestion : découverte, OCR par lots éventuel, puis traitement des fichiers.
+
+    Si l'événement `arret` est levé, les fichiers déjà commencés sont terminés et les suivants
+    laissés à la prochaine passe. Retourne le nombre de fichiers traités.
+    """
+    if options.get('job_queue') and not TEST_MODE:
+        return _executer_passe_file_jobs(drive_service, db_conn, cache, workers, queue_size, options, arret)
+
+    print("\n[Step 2] Retrieving and filtering files...")
+    fichiers_a_traiter = drive_sync.decouvrir_fichiers(drive_service, db_conn, GOOGLE_DRIVE_FOLDER_ID, options['discovery_mode'])
+
+    if not fichiers_a_traiter: print("\n-> No new files to process."); return 0
+
+    _traiter_fichiers(drive_service, db_conn, cache, fichiers_a_traiter, workers, queue_size, options, arret)
+    return len(fichiers_a_traiter)
+
+def _standardiser_en_attente(db_conn, options):
+    """Fin de passe en standardisation différée : termes en attente standardisés par appels Gemini groupés."""
+    if options.get('deferred_standardisation') and not TEST_MODE:
+        standardisation_differee.resoudre(db_conn)
+
+def _afficher_caches():
+    for cache_disque in (doc_processor.ocr_cache, ai_processor.llm_cache):
+        if cache_disque: print(cache_disque.resume())
+    print(ai_processor.limiteur.resume())
+    print(resolveur_standardisation.statistiques_shortlist.resume())
+    if rejeu.actif: print(rejeu.actif.resume())
+
+def main_orchestrator(workers=INGESTION_WORKERS, queue_size=INGESTION_QUEUE_SIZE, options=None):
+    options = options or ingestion.options_par_defaut(test_mode=TEST_MODE)
     print("--- STARTING WORKFLOW ---")
     if TEST_MODE: print("!!! TEST MODE ACTIVATED !!!")
     else: print("!!! PRODUCTION MODE ACTIVATED (Writing to DB) !!!")
+    print(f"Extraction mode: {options['extraction_mode']}")
 
     print("\n[Step 1] Authentication and initialization...")
     drive_service = google_drive.get_drive_service()
     if not drive_service: print("Google Drive authentication failed. Stopping."); return
-        
+
     db_conn = None
     try:
-        db_conn = database.get_connection()
-        cache = {}
-        
-        print("\n[Step 2] Retrieving and filtering files...")
-        fichiers_deja_traites = database.get_fichiers_traites(db_conn)
-        tous_les_fichiers_drive = google_drive.lister_fichiers_recursif(drive_service, GOOGLE_DRIVE_FOLDER_ID)
-        fichiers_a_traiter = [f for f in tous_les_fichiers_drive if f['id'] not in fichiers_deja_traites]
-        
-        if not fichiers_a_traiter: print("\n-> No new files to process."); return
-            
-        print(f"\n[Step 3] Starting processing for {len(fichiers_a_traiter)} new file(s)...")
-        for fichier in fichiers_a_traiter:
-            print(f"\n--- Processing file: {fichier['name']} ({fichier['id']}) ---")
-            log_status, log_message = 'ERREUR_INCONNUE', ''
-            try:
-                succes, message, doc_obj = doc_processor.run_workflow_for_single_file(drive_service, fichier)
-                if not succes: 
-                    log_status, log_message = 'ERREUR_OCR', message
-                    continue
-                
-                donnees_agregees = {
-                    "ecole": {"nom_standardise": None, "source_tags": []},
-                    "annee_scolaire": {"annee_standardisee": None, "source_tags": []},
-                    "niveaux_map": {}
-                }
-                position_mapping_complet = {}
-                
-                print(f"  -> Starting page-by-page analysis for {len(doc_obj.pages)} page(s)...")
-
-                for page_num, page_obj in enumerate(doc_obj.pages, 1):
-                    print(f"    -> Analyzing page {page_num}/{len(doc_obj.pages)}...")
-                    
-                    # --- DÉBUT DE LA CORRECTION FINALE ---
-                    # Nous créons un objet qui imite le document original.
-                    # Il ne contient qu'une seule page, mais la référence de texte
-                    # doit être le texte COMPLET du document original pour que les
-                    # "text_anchors" de la page fonctionnent.
-                    page_doc_obj = SimpleNamespace(
-                        pages=[page_obj],
-                        text=doc_obj.text  # <- Utiliser le texte du document complet
-                    )
-                    
-                    tagged_text_page, position_mapping_page = doc_processor.preprocess_document_for_ia(page_doc_obj)
-                    # --- FIN DE LA CORRECTION FINALE ---
-
-                    if not tagged_text_page.strip():
-                        print(f"    -> Page {page_num} is empty, skipping.")
-                        continue
-
-                    position_mapping_complet.update(position_mapping_page)
-                    
-                    print(f"    -> Launching AI analysis for page {page_num}...")
-                    donnees_page = ai_processor.generer_json_pour_insertion_avec_positions(db_conn, fichier, tagged_text_page)
-
-                    if not donnees_agregees['ecole']['nom_standardise'] and donnees_page.get('ecole', {}).get('nom_standardise'):
-                        donnees_agregees['ecole'] = donnees_page['ecole']
-                    
-                    if not donnees_agregees['annee_scolaire']['annee_standardisee'] and donnees_page.get('annee_scolaire', {}).get('annee_standardisee'):
-                        donnees_agregees['annee_scolaire'] = donnees_page['annee_scolaire']
-
-                    for niveau_page in donnees_page.get('niveaux', []):
-                        nom_std = niveau_page.get('nom_standardise')
-                        if not nom_std: continue
-                        
-                        if nom_std not in donnees_agregees['niveaux_map']:
-                            donnees_agregees['niveaux_map'][nom_std] = {
-                                "nom_brut": niveau_page.get('nom_brut'),
-                                "nom_standardise": nom_std,
-                                "niveau_source_tags": [],
-                                "manuels": []
-                            }
-                        
-                        donnees_agregees['niveaux_map'][nom_std]['manuels'].extend(niveau_page.get('manuels', []))
-                        donnees_agregees['niveaux_map'][nom_std]['niveau_source_tags'].extend(niveau_page.get('niveau_source_tags', []))
-
-                donnees_a_inserer = {
-                    "ecole": donnees_agregees['ecole'],
-                    "annee_scolaire": donnees_agregees['annee_scolaire'],
-                    "niveaux": list(donnees_agregees['niveaux_map'].values())
-                }
-                
-                print("  -> Aggregation of all pages complete.")
-                
-                total_manuels = sum(len(n.get('manuels', [])) for n in donnees_a_inserer.get('niveaux', []))
-                
-                if total_manuels == 0:
-                    log_status, log_message = 'ERREUR_EXTRACTION', "No textbooks were extracted by the AI from any page."
-                    print(f"  -> ERROR: {log_message}")
-                    continue
-                    
-                if TEST_MODE: 
-                    print("  -> RESULT (TEST MODE):", json.dumps(donnees_a_inserer, indent=2, ensure_ascii=False))
-                    continue
-                
-                print("  -> Inserting aggregated data into the database...")
-                entity_map = {"niveaux": {}, "manuels": {}}
-                
-                id_ecole = database.get_or_create_entity_id(db_conn, cache, donnees_a_inserer['ecole']['nom_standardise'], 'ecoles', 'nom_ecole')
-                entity_map['ecole'] = {'id': id_ecole, 'source_tags': donnees_a_inserer['ecole'].get('source_tags', [])}
-                
-                id_annee = database.get_or_create_entity_id(db_conn, cache, donnees_a_inserer['annee_scolaire']['annee_standardisee'], 'annees_scolaires', 'annee_scolaire')
-                entity_map['annee'] = {'id': id_annee, 'source_tags': donnees_a_inserer['annee_scolaire'].get('source_tags', [])}
-
-                manuels_inseres_count = 0
-                for niveau_data in donnees_a_inserer.get('niveaux', []):
-                    nom_std = niveau_data.get('nom_standardise')
-                    tags_niveau = niveau_data.get('niveau_source_tags', [])
-                    id_niveau = database.get_or_create_entity_id(db_conn, cache, nom_std, 'niveaux', 'nom_niveau')
-                    entity_map['niveaux'][id_niveau] = {'source_tags': tags_niveau}
-                    
-                    if not all([id_ecole, id_annee, id_niveau]): 
-                        print(f"  -> WARNING: Missing info for level {nom_std}. Skipping list creation."); 
-                        continue
-                        
-                    id_liste = database.get_or_create_liste_id(db_conn, id_ecole, id_annee, id_niveau, fichier['id'])
-                    
-                    for manuel_data in niveau_data.get('manuels', []):
-                        if manuel_data.get('titre_livre'):
-                            id_manuel = database.inserer_manuel(db_conn, manuel_data, id_niveau)
-                            entity_map['manuels'][id_manuel] = {'source_tags': manuel_data.get('source_tags', [])}
-                            database.creer_lien_liste_manuel(db_conn, id_liste, id_manuel)
-                            manuels_inseres_count += 1
-                        else:
-                            print(f"  -> WARNING: Textbook without a title ignored. Tags: {manuel_data.get('source_tags')}")
-                        
-                print("  -> Saving positions from all pages...")
-                database.save_extraction_positions(db_conn, fichier['id'], entity_map, position_mapping_complet)
-                
-                log_status, log_message = 'TRAITÉ', f"{manuels_inseres_count} textbook(s) inserted from {len(doc_obj.pages)} pages."
-                print(f"  -> SUCCESS: {log_message}")
-                
-            except Exception as e:
-                log_message = f"Unexpected error: {str(e)}"
-                print(f"   -> GLOBAL ERROR on file: {e}"); traceback.print_exc()
-            finally:
-                 if not TEST_MODE:
-                    mime_type = fichier.get('mimeType', None)
-                    database.log_to_db(db_conn, fichier['id'], fichier['name'], mime_type, log_status, log_message)
+        db_conn = database.get_ingestion_connection()
+        database.init_ingestion_tables(db_conn)
+        executer_passe(drive_service, db_conn, {}, workers, queue_size, options)
+        _standardiser_en_attente(db_conn, options)
     except Exception as e:
         print(f"\n!!! FATAL ERROR IN ORCHESTRATOR: {e} !!!"); traceback.print_exc()
     finally:
         if db_conn and db_conn.is_connected(): db_conn.close(); print("\nDB connection closed.")
+        _afficher_caches()
         print("--- WORKFLOW FINISHED ---")
 
+def _installer_arret(arret):
+    """SIGTERM / Ctrl+C : termine les fichiers en cours puis s'arrête ; un second signal force l'arrêt."""
+    def gestionnaire(signum, _):
+        if arret.is_set():
+            raise SystemExit(1)
+        print(f"\n!!! Signal {signum} received: finishing files in progress, then stopping (send again to force) !!!")
+        arret.set()
+    signal.signal(signal.SIGTERM, gestionnaire)
+    signal.signal(signal.SIGINT, gestionnaire)
+
+def _connexion_valide(db_conn):
+    """Réutilise la connexion de la passe précédente si elle répond encore, sinon en ouvre une nouvelle."""
+    if db_conn:
+        try:
+            db_conn.ping(reconnect=True, attempts=3, delay=5)
+            database.use_read_committed(db_conn)  # Une reconnexion repart des réglages de session par défaut
+            return db_conn
+        except Exception as e:
+            print(f"  -> DB connection lost ({e}), reconnecting...")
+    return database.get_ingestion_connection()
+
+def main_daemon(workers=INGESTION_WORKERS, queue_size=INGESTION_QUEUE_SIZE, options=None, poll_seconds=INGESTION_POLL_SECONDS):
+    """Worker résident : clients Drive / Document AI, connexion et caches restent chauds entre les passes.
+
+    Une passe démarre toutes les `poll_seconds` secondes, ou dès qu'un upload est signalé
+    (reveil_ingestion). SIGTERM laisse finir les fichiers en cours avant de quitter.
+    """
+    options = options or ingestion.options_par_defaut(test_mode=TEST_MODE)
+    arret = threading.Event()
+    _installer_arret(arret)
+    print(f"--- STARTING INGESTION WORKER (poll every {poll_seconds}s, discovery: {options['discovery_mode']}) ---")
+
+    drive_service = google_drive.get_drive_service()
+    if not drive_service: print("Google Drive authentication failed. Stopping."); return
+
+    db_conn, cache, tables_pretes = None, {}, False
+    try:
+        while not arret.is_set():
+            signal_vu = reveil_ingestion.dernier_signal()
+            try:
+                db_conn = _connexion_valide(db_conn)
+                if not tables_pretes:
+                    database.init_ingestion_tables(db_conn); tables_pretes = True
+                traites = executer_passe(drive_service, db_conn, cache, workers, queue_size, options, arret)
+                _standardiser_en_attente(db_conn, options)
+                if traites: _afficher_caches()
+            except Exception as e:
+                # Une passe en échec (réseau, base indisponible...) ne doit pas arrêter le worker.
+                print(f"\n!!! ERROR DURING INGESTION PASS: {e} !!!"); traceback.print_exc()
+            if reveil_ingestion.attendre_signal(arret, poll_seconds, signal_vu):
+                print("\n-> New upload signalled, starting a pass.")
+    finally:
+        if db_conn and db_conn.is_connected(): db_conn.close(); print("\nDB connection closed.")
+        print("--- INGESTION WORKER STOPPED ---")
+
 if __name__ == "__main__":
-    main_orchestrator()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingestion des listes scolaires depuis Google Drive.")
+    parser.add_argument("--workers", type=int, default=INGESTION_WORKERS,
+                        help="Workers par étape ; au-delà de 1, active le mode pipeline.")
+    parser.add_argument("--queue-size", type=int, default=INGESTION_QUEUE_SIZE,
+                        help="Taille maximale des files entre les étapes du pipeline.")
+    parser.add_argument("--page-concurrency", type=int,
+                        help="Appels Gemini simultanés par fichier ; au-delà de 1, analyse les pages en parallèle.")
+    parser.add_argument("--extraction-mode", choices=ai_processor.EXTRACTION_MODES,
+                        help="'triple' : trois prompts par page ; 'combine' : un seul prompt structuré.")
+    parser.add_argument("--discovery", choices=drive_sync.DISCOVERY_MODES,
+                        help="'full' : listing complet du dossier Drive ; 'incremental' : changements depuis la dernière exécution.")
+    parser.add_argument("--ocr-mode", choices=batch_ocr.OCR_MODES,
+                        help="'online' : un appel Document AI par fichier ; 'batch' : jobs par lots ; 'batch-local' : même flux "
+                             "sans bucket GCS (OCR en ligne en arrière-plan) ; 'auto' : batch pour les gros arriérés.")
+    parser.add_argument("--no-page-filter", action="store_true",
+                        help="Envoie toutes les pages à l'extraction des niveaux/manuels, sans pré-filtre local.")
+    parser.add_argument("--no-table-extraction", action="store_true",
+                        help="Envoie aussi les pages en tableau à l'extraction Gemini des niveaux/manuels.")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="Ignore le cache disque des réponses Gemini (ni lecture ni écriture).")
+    enregistrement = parser.add_mutually_exclusive_group()
+    enregistrement.add_argument("--record", metavar="DOSSIER",
+                                help="Enregistre les réponses Drive, Document AI et Gemini dans DOSSIER (caches disque ignorés).")
+    enregistrement.add_argument("--replay", metavar="DOSSIER",
+                                help="Rejoue les réponses enregistrées dans DOSSIER, sans appel à Drive, Document AI ni Gemini.")
+    parser.add_argument("--job-queue", action="store_true", default=None,
+                        help="Partage le travail avec d'autres workers via la table jobs_ingestion (baux, heartbeat, reprise).")
+    parser.add_argument("--defer-standardisation", action="store_true", default=None,
+                        help="Standardise écoles et niveaux inconnus en fin de passe, par appels Gemini groupés.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Reste actif et relance une passe à chaque upload signalé ou toutes les --poll-interval secondes.")
+    parser.add_argument("--poll-interval", type=int, default=INGESTION_POLL_SECONDS,
+                        help="Mode --daemon : délai maximal (secondes) entre deux passes.")
+    args = parser.parse_args()
+    ai_processor.configurer_cache_llm(bypass=args.no_llm_cache)
+    mode_rejeu = "record" if args.record else "replay" if args.replay else RECORD_REPLAY_MODE
+    if mode_rejeu:
+        rejeu.activer(mode_rejeu, args.record or args.replay or RECORD_REPLAY_DIR)
+    options = ingestion.options_par_defaut(test_mode=TEST_MODE, page_concurrency=args.page_concurrency,
+                                           extraction_mode=args.extraction_mode, discovery_mode=args.discovery,
+                                           ocr_mode=args.ocr_mode, job_queue=args.job_queue,
+                                           page_filter=False if args.no_page_filter else None,
+                                           table_extraction=False if args.no_table_extraction else None,
+                                           deferred_standardisation=args.defer_standardisation)
+    if args.daemon:
+        main_daemon(workers=args.workers, queue_size=args.queue_size, options=options, poll_seconds=args.poll_interval)
+    else:
+        main_orchestrator(workers=args.workers, queue_size=args.queue_size, options=options)
@@ -0,0 +1,145 @@
+# pipeline.py
+# Mode d'ingestion pipeliné : le téléchargement, l'OCR, l'analyse IA et l'écriture en base
+# de fichiers différents se chevauchent. Les étapes communiquent par des files bornées ;
+# une seule étape écrit en base, dans l'ordre d'origine des fichiers, pour obtenir
+# le même contenu final que le mode séquentiel.
+import queue
+import threading
+import traceback
+import database
+import google_drive
+import ingestion
+
+_FIN = object()
+
+def _nouvelle_tache(index, fichier, options):
+    return {"index": index, "fichier": fichier, "options": options, "contenu": None, "doc_obj": None,
+            "donnees": None, "positions": None, "statut": None, "message": ""}
+
+def _ressources_telechargement():
+    return {"drive": google_drive.get_drive_service(), "db": database.get_ingestion_connection()}
+
+def _etape_telechargement(ressources, tache):
+    log_status, log_message, contenu = ingestion.telecharger_sans_doublon(ressources['drive'], ressources['db'], tache['fichier'])
+    if log_status:
+        tache['statut'], tache['message'] = log_status, log_message
+    tache['contenu'] = contenu
+
+def _etape_ocr(_, tache):
+    succes, message, doc_obj = ingestion.ocr_fichier(tache['fichier'], tache['contenu'])
+    tache['contenu'] = None  # Le spool est supprimé par ocr_fichier
+    if not succes:
+        tache['statut'], tache['message'] = 'ERREUR_OCR', message
+    tache['doc_obj'] = doc_obj
+
+def _etape_analyse(db_conn, tache):
+    tache['donnees'], tache['positions'] = ingestion.analyser_document(
+        db_conn, tache['fichier'], tache['doc_obj'], tache['options'])
+
+def _worker(nom, fonction, init_ressource, q_entree, q_sortie):
+    """Boucle d'un worker : applique `fonction` à chaque tâche encore saine et la transmet."""
+    ressource = None
+    try:
+        ressource = init_ressource() if init_ressource else None
+    except Exception as e:
+        print(f"  -> [{nom}] Worker initialisation failed: {e}")
+    while True:
+        tache = q_entree.get()
+        if tache is _FIN:
+            break
+        if tache['statut'] is None:
+            try:
+                if init_ressource and ressource is None:
+                    raise RuntimeError(f"{nom} worker has no usable resource")
+                fonction(ressource, tache)
+            except Exception as e:
+                print(f"   -> GLOBAL ERROR on file {tache['fichier']['name']} ({nom}): {e}"); traceback.print_exc()
+                tache['statut'], tache['message'] = 'ERREUR_INCONNUE', f"Unexpected error: {str(e)}"
+        q_sortie.put(tache)
+    for r in (ressource.values() if isinstance(ressource, dict) else [ressource]):
+        if r is not None and hasattr(r, 'is_connected') and r.is_connected():
+            r.close()
+
+def _ecrivain(q_entree, nb_fichiers, options):
+    """Étape BDD : insère et journalise les fichiers dans leur ordre d'origine."""
+    try:
+        db_conn = database.get_ingestion_connection()
+    except Exception as e:
+        # On continue à vider la file pour ne pas bloquer les étapes amont.
+        print(f"  -> [db-writer] DB connection failed, results will be discarded: {e}")
+        db_conn = None
+    cache = {}
+    en_attente = {}
+    suivant = 0
+    try:
+        while suivant < nb_fichiers:
+            tache = q_entree.get()
+            if tache is _FIN:
+                break
+            if db_conn is None:
+                suivant += 1
+                continue
+            en_attente[tache['index']] = tache
+            while suivant in en_attente:
+                try:
+                    _finaliser(db_conn, cache, en_attente.pop(suivant), options["test_mode"])
+                except Exception as e:
+                    print(f"  -> [db-writer] Could not log file result: {e}"); traceback.print_exc()
+                suivant += 1
+    finally:
+        if db_conn and db_conn.is_connected(): db_conn.close()
+
+def _finaliser(db_conn, cache, tache, test_mode):
+    fichier = tache['fichier']
+    print(f"\n--- Finalising file: {fichier['name']} ({fichier['id']}) ---")
+    log_status, log_message = tache['statut'] or 'ERREUR_INCONNUE', tache['message']
+    try:
+        if tache['statut'] is None:
+            log_status, log_message = ingestion.inserer_donnees(
+                db_conn, cache, fichier, tache['donnees'], tache['positions'], len(tache['doc_obj'].pages), test_mode)
+    except Exception as e:
+        log_status, log_message = 'ERREUR_INCONNUE', f"Unexpected error: {str(e)}"
+        print(f"   -> GLOBAL ERROR on file: {e}"); traceback.print_exc()
+    finally:
+        tache['doc_obj'] = tache['donnees'] = tache['positions'] = None
+        if not test_mode:
+            ingestion.log_resultat(db_conn, fichier, log_status, log_message)
+
+def executer_pipeline(fichiers, nb_workers, taille_file, options, arret=None):
+    """Traite `fichiers` avec `nb_workers` workers par étape et des files de taille `taille_file`.
+
+    Si l'événement `arret` est levé, plus aucun fichier n'entre dans le pipeline ; ceux
+    déjà engagés sont menés jusqu'à l'écriture en base.
+    """
+    etapes = [
+        ("download", _etape_telechargement, _ressources_telechargement),
+        ("ocr", _etape_ocr, None),
+        ("ai", _etape_analyse, database.get_ingestion_connection),
+    ]
+    files_attente = [queue.Queue(maxsize=taille_file) for _ in range(len(etapes) + 1)]
+
+    groupes = []
+    for i, (nom, fonction, init_ressource) in enumerate(etapes):
+        threads = [threading.Thread(target=_worker, name=f"{nom}-{n}", daemon=True,
+                                    args=(nom, fonction, init_ressource, files_attente[i], files_attente[i + 1]))
+                   for n in range(nb_workers)]
+        for t in threads: t.start()
+        groupes.append(threads)
+
+    ecrivain = threading.Thread(target=_ecrivain, name="db-writer", daemon=True,
+                                args=(files_attente[-1], len(fichiers), options))
+    ecrivain.start()
+
+    print(f"  -> Pipeline started: {nb_workers} worker(s) per stage, queue size {taille_file}.")
+    for index, fichier in enumerate(fichiers):
+        if arret and arret.is_set():
+            print(f"  -> Stop requested: {len(fichiers) - index} file(s) left for the next run.")
+            break
+        files_attente[0].put(_nouvelle_tache(index, fichier, options))
+
+    # Arrêt en cascade : chaque étape ne reçoit ses signaux de fin qu'une fois la précédente vidée.
+    for i, threads in enumerate(groupes):
+        for _ in threads: files_attente[i].put(_FIN)
+        for t in threads: t.join()
+    files_attente[-1].put(_FIN)
+    ecrivain.join()
@@ -0,0 +1,249 @@
+# rejeu.py
+# Enregistrement et rejeu des appels externes de l'ingestion : Google Drive (listing, métadonnées,
+# changements, téléchargements), OCR Document AI (doc_processor.ocr_document, utilisé aussi par
+# run_workflow_for_single_file) et Gemini (ai_processor.call_gemini_detaille_async, donc call_gemini).
+#
+# En mode "record", les appels réels passent et leurs réponses sont écrites dans un dossier de fixtures
+# (un .json par appel, plus un .bin pour les contenus Drive et les documents OCR). En mode "replay", les
+# réponses sont relues depuis ce dossier sans aucun accès réseau à Google, avec une latence simulée
+# optionnelle : une exécution complète de l'ingestion devient reproductible (mesures de performance,
+# comparaison de deux versions du code). La base MySQL reste utilisée normalement.
+#
+# Les caches disque OCR et LLM sont désactivés dans les deux modes : à l'enregistrement, chaque fichier
+# est réellement téléchargé et chaque latence est réelle ; au rejeu, le chemin suivi est toujours le même.
+#
+# Exemple :
+#   python main.py --record fixtures/rentree --discovery full
+#   python main.py --replay fixtures/rentree --discovery full
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from google.cloud import documentai
+import ai_processor
+import doc_processor
+import google_drive
+import spool
+import telemetrie
+from config import REPLAY_LATENCY_SCALE, REPLAY_LATENCY_MS
+
+MODES = ("record", "replay")
+
+class FixtureManquante(LookupError):
+    """Appel sans réponse enregistrée dans le dossier de fixtures (mode replay)."""
+
+class _ServiceDriveRejoue:
+    """Tient lieu de service Drive en mode replay : les fonctions de google_drive sont rejouées sans lui."""
+    def __repr__(self):
+        return "<service Drive rejoué>"
+
+class Rejeu:
+    def __init__(self, mode, dossier, echelle_latence=REPLAY_LATENCY_SCALE, latence_ms=REPLAY_LATENCY_MS):
+        if mode not in MODES: raise ValueError(f"Unknown record/replay mode: {mode}")
+        self.mode = mode
+        self.dossier = dossier
+        self.echelle_latence = echelle_latence
+        self.latence_ms = latence_ms
+        self.compteurs = {}
+        self._lock = threading.Lock()
+
+    def _chemin(self, categorie, cle, extension):
+        return os.path.join(self.dossier, categorie, hashlib.sha256(cle.encode('utf-8')).hexdigest()[:32] + extension)
+
+    def enregistrer(self, categorie, cle, duree_s, valeur, charge=None):
+        """Écrit la fixture d'un appel ; `charge` (octets ou spool.FichierSpool) va dans un .bin à côté."""
+        os.makedirs(os.path.join(self.dossier, categorie), exist_ok=True)
+        if charge is not None:
+            self._ecrire(self._chemin(categorie, cle, ".bin"), charge)
+        fixture = {"cle": cle, "duree_s": round(duree_s, 4), "resultat": valeur, "charge": charge is not None}
+        self._ecrire(self._chemin(categorie, cle, ".json"), json.dumps(fixture, ensure_ascii=False, indent=1).encode('utf-8'))
+        self._compter(categorie)
+
+    def _ecrire(self, chemin, donnees):
+        # Écriture atomique : deux workers peuvent enregistrer le même appel en même temps.
+        descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin))
+        with os.fdopen(descripteur, 'wb') as f:
+            if isinstance(donnees, spool.FichierSpool):
+                with open(donnees.chemin, 'rb') as source: shutil.copyfileobj(source, f)
+            else:
+                f.write(donnees)
+        os.replace(temporaire, chemin)
+
+    def _lire(self, categorie, cle):
+        """Retourne (resultat, chemin du .bin ou None, latence simulée en secondes) d'un appel enregistré."""
+        try:
+            with open(self._chemin(categorie, cle, ".json"), encoding='utf-8') as f:
+                fixture = json.load(f)
+        except FileNotFoundError:
+            raise FixtureManquante(f"no recorded {categorie} response in {self.dossier} for {cle[:200]}") from None
+        pause = fixture["duree_s"] * self.echelle_latence + self.latence_ms / 1000
+        return fixture["resultat"], self._chemin(categorie, cle, ".bin") if fixture["charge"] else None, pause
+
+    def charger(self, categorie, cle):
+        """Retourne (resultat, chemin du .bin ou None) d'un appel enregistré, après la latence simulée."""
+        resultat, chemin, pause = self._lire(categorie, cle)
+        if pause > 0: time.sleep(pause)
+        self._compter(categorie)
+        return resultat, chemin
+
+    async def charger_async(self, categorie, cle):
+        """Comme charger, sans bloquer la boucle asyncio pendant la latence simulée."""
+        resultat, chemin, pause = self._lire(categorie, cle)
+        if pause > 0: await asyncio.sleep(pause)
+        self._compter(categorie)
+        return resultat, chemin
+
+    def _compter(self, categorie):
+        with self._lock:
+            self.compteurs[categorie] = self.compteurs.get(categorie, 0) + 1
+
+    def envelopper(self, categorie, fonction, cle, vers_fixture, depuis_fixture):
+        """Version enregistrée ou rejouée de `fonction` (fonction ou coroutine).
+
+        `cle(arguments)` identifie l'appel (arguments liés par nom, valeurs par défaut comprises) ;
+        `vers_fixture(resultat, arguments)` retourne (valeur JSON, charge ou None) ;
+        `depuis_fixture(valeur, chemin_charge, arguments)` reconstruit le résultat.
+        """
+        signature = inspect.signature(fonction)
+
+        def lier(args, kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            return arguments.arguments
+
+        if inspect.iscoroutinefunction(fonction):
+            @functools.wraps(fonction)
+            async def enveloppe_async(*args, **kwargs):
+                arguments = lier(args, kwargs)
+                cle_appel = cle(arguments)
+                if self.mode == "replay":
+                    return depuis_fixture(*await self.charger_async(categorie, cle_appel), arguments)
+                debut = time.perf_counter()
+                resultat = await fonction(*args, **kwargs)
+                self.enregistrer(categorie, cle_appel, time.perf_counter() - debut, *vers_fixture(resultat, arguments))
+                return resultat
+            enveloppe_async.originale = fonction
+            return enveloppe_async
+
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            arguments = lier(args, kwargs)
+            cle_appel = cle(arguments)
+            if self.mode == "replay":
+                return depuis_fixture(*self.charger(categorie, cle_appel), arguments)
+            debut = time.perf_counter()
+            resultat = fonction(*args, **kwargs)
+            self.enregistrer(categorie, cle_appel, time.perf_counter() - debut, *vers_fixture(resultat, arguments))
+            return resultat
+        enveloppe.originale = fonction
+        return enveloppe
+
+    def resume(self):
+        action = "recorded" if self.mode == "record" else "replayed"
+        details = ", ".join(f"{categorie}={n}" for categorie, n in sorted(self.compteurs.items())) or "none"
+        return f"Record/replay ({self.dossier}): {action} calls: {details}"
+
+# --- Google Drive ---
+def _cle_drive(nom, *champs):
+    def cle(a):
+        valeurs = [a[champ] for champ in champs]
+        if a.get('dossiers') is not None: valeurs.append(sorted(a['dossiers']))
+        return f"{nom}:{json.dumps(valeurs, ensure_ascii=False)}"
+    return cle
+
+def _vers_fixture_dossiers(resultat, a):
+    # `dossiers` est mis à jour sur place par le listing : son état final fait partie de la réponse.
+    return {"resultat": resultat, "dossiers": sorted(a['dossiers']) if a.get('dossiers') is not None else None}, None
+
+def _depuis_fixture_dossiers(valeur, _, a):
+    if valeur["dossiers"] is not None:
+        a['dossiers'].clear()
+        a['dossiers'].update(valeur["dossiers"])
+    return valeur["resultat"]
+
+def _depuis_fixture_changements(valeur, chemin, a):
+    modifies, supprimes, nouveau_jeton = _depuis_fixture_dossiers(valeur, chemin, a)
+    return modifies, set(supprimes), nouveau_jeton
+
+def _vers_fixture_changements(resultat, a):
+    modifies, supprimes, nouveau_jeton = resultat
+    return _vers_fixture_dossiers((modifies, sorted(supprimes), nouveau_jeton), a)
+
+def _vers_fixture_telechargement(contenu, _):
+    return {"telecharge": contenu is not None}, contenu
+
+def _depuis_fixture_telechargement(valeur, chemin, a):
+    if not valeur["telecharge"]: return None
+    contenu = spool.FichierSpool(a['taille_max'])
+    try:
+        with open(chemin, 'rb') as source:
+            while morceau := source.read(1024 * 1024):
+                contenu.write(morceau)
+        return contenu.terminer()
+    except spool.TailleDepassee as e:
+        print(f"   -> ERREUR lors du téléchargement du fichier {a['file_id']}: {e}")
+        contenu.fermer()
+        return None
+
+# --- Document AI ---
+def _cle_ocr(a):
+    empreinte = a['empreinte']
+    if not empreinte and a['file_content'] is not None:
+        contenu = a['file_content']
+        md5 = contenu.md5 if isinstance(contenu, spool.FichierSpool) else hashlib.md5(contenu).hexdigest()
+        empreinte = f"md5:{md5}:{len(contenu)}"
+    return doc_processor._cle_ocr(a['fichier']['id'], empreinte)
+
+def _vers_fixture_ocr(resultat, _):
+    succes, message, document = resultat
+    return {"succes": succes, "message": message}, documentai.Document.serialize(document) if document is not None else None
+
+def _depuis_fixture_ocr(valeur, chemin, _):
+    document = None
+    if chemin:
+        with open(chemin, 'rb') as f:
+            document = documentai.Document.deserialize(f.read())
+    return valeur["succes"], valeur["message"], document
+
+# --- Gemini ---
+def _cle_gemini(a):
+    return ai_processor._cle_cache_llm(a['model'], a['instructions'], a['text_to_analyze'])
+
+def _depuis_fixture_gemini(valeur, _, __):
+    # La télémétrie compte les tokens et la latence enregistrés, comme pour l'appel d'origine.
+    telemetrie.enregistrer_appel_llm(valeur)
+    return valeur
+
+actif = None
+
+def activer(mode, dossier, echelle_latence=REPLAY_LATENCY_SCALE, latence_ms=REPLAY_LATENCY_MS):
+    """Remplace les points d'appel externes de google_drive, doc_processor et ai_processor. Retourne le Rejeu."""
+    global actif
+    if actif: raise RuntimeError(f"Record/replay already active ({actif.mode}, {actif.dossier})")
+    actif = rejeu = Rejeu(mode, dossier, echelle_latence, latence_ms)
+    os.makedirs(dossier, exist_ok=True)
+    doc_processor.ocr_cache = None
+    ai_processor.configurer_cache_llm(bypass=True)
+
+    if mode == "replay":
+        google_drive.get_drive_service = lambda: _ServiceDriveRejoue()
+    brut = (lambda v, _: (v, None), lambda v, _, __: v)
+    for nom, cle, conversions in (
+            ("lister_fichiers_recursif", _cle_drive("lister_fichiers_recursif", 'folder_id'), (_vers_fixture_dossiers, _depuis_fixture_dossiers)),
+            ("lister_changements", _cle_drive("lister_changements", 'page_token'), (_vers_fixture_changements, _depuis_fixture_changements)),
+            ("obtenir_jeton_changements", _cle_drive("obtenir_jeton_changements"), brut),
+            ("obtenir_metadonnees", _cle_drive("obtenir_metadonnees", 'file_id'), brut),
+            ("telecharger_fichier", _cle_drive("telecharger_fichier", 'file_id'), (_vers_fixture_telechargement, _depuis_fixture_telechargement))):
+        setattr(google_drive, nom, rejeu.envelopper("drive", getattr(google_drive, nom), cle, *conversions))
+    doc_processor.ocr_document = rejeu.envelopper("ocr", doc_processor.ocr_document, _cle_ocr, _vers_fixture_ocr, _depuis_fixture_ocr)
+    # La coroutine porte tous les appels Gemini : façade synchrone (call_gemini_detaille) et appels en vol.
+    ai_processor.call_gemini_detaille_async = rejeu.envelopper("gemini", ai_processor.call_gemini_detaille_async, _cle_gemini,
+                                                               brut[0], _depuis_fixture_gemini)
+    print(f"!!! RECORD/REPLAY: {mode.upper()} MODE, fixtures in {dossier} !!!")
+    return rejeu
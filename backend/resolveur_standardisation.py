@@ -0,0 +1,210 @@
+# resolveur_standardisation.py
+# Résolution locale des valeurs brutes (écoles, niveaux) vers leur nom standardisé, avant tout appel
+# Gemini. La base de connaissances (standardisation_<type>, lignes VALIDÉ) est gardée en mémoire par
+# processus d'ingestion (worker, pipeline, standardisation différée) et relue seulement quand sa version
+# change : les routes d'administration de l'application Flask et database.learn_new_standardisation
+# l'incrémentent dans versions_standardisation. L'application ne lit pas ce cache : sa seule lecture
+# (liste paginée de toutes les règles, tous statuts) n'est pas la base de connaissances.
+# Le Resolveur construit pour chaque version répond par :
+#   1. correspondance exacte sur valeur_brute (comportement historique) ;
+#   2. correspondance sur une clé normalisée : sans accents ni ponctuation, espaces réduits,
+#      ordinaux unifiés (« 3ème », « 3eme », « 3e », « troisième » -> « 3e ») ;
+#   3. correspondance approchée : index de trigrammes, puis ratio de similarité (difflib) sur les
+#      meilleurs candidats. Retenue au-delà de SEUIL_DE_CONFIANCE, et seulement si les nombres
+#      sont les mêmes (« 3e année » ne doit jamais devenir « 4e année ») et si chaque mot a son
+#      équivalent de l'autre côté : identique, ou variante orthographique d'un mot d'au moins
+#      4 lettres. Une lettre ou une filière différente (« 2e Bac Sciences Maths A » / « ... B »,
+#      « SM » / « PC ») n'est jamais résolue localement : la valeur est envoyée à Gemini.
+# En dessous du seuil, l'appelant (ai_processor._standardise_entite) consulte Gemini, en ne lui envoyant
+# que les STANDARDISATION_SHORTLIST_K noms standardisés les plus proches (Resolveur.shortlist).
+import difflib
+import hashlib
+import re
+import threading
+import time
+import database
+from filtre_pages import normaliser
+from config import SEUIL_DE_CONFIANCE, STANDARDISATION_VERSION_CHECK_SECONDS, STANDARDISATION_SHORTLIST_K
+
+ORDINAUX_EN_LETTRES = {"premier": "1e", "premiere": "1e", "deuxieme": "2e", "troisieme": "3e", "quatrieme": "4e",
+                       "cinquieme": "5e", "sixieme": "6e"}
+_ORDINAL = re.compile(r"\b(\d+)\s*(?:ere|er|ieme|eme|em|e|°|o)(?!\w)")
+_ORDINAL_EN_LETTRES = re.compile(r"\b(" + "|".join(ORDINAUX_EN_LETTRES) + r")\b")
+_PONCTUATION = re.compile(r"[^\w°]+")
+_NOMBRE = re.compile(r"\d+")
+CANDIDATS_MAX = 5
+# Mots de plus de LONGUEUR_MOT_COURT lettres : une variante (ratio >= SEUIL_VARIANTE) vaut le mot ;
+# les mots courts (lettres de section, sigles de filière) doivent être identiques.
+LONGUEUR_MOT_COURT = 3
+SEUIL_VARIANTE = 0.8
+MOTS_VIDES = {"de", "du", "des", "la", "le", "les", "l", "d", "et"}
+EXEMPLES_PAR_CHOIX = 3
+
+def cle_normalisee(texte):
+    """Clé de comparaison : minuscules sans accents, ordinaux unifiés, ponctuation et espaces réduits."""
+    texte = normaliser(texte)
+    texte = _ORDINAL_EN_LETTRES.sub(lambda m: ORDINAUX_EN_LETTRES[m.group(1)], texte)
+    texte = _PONCTUATION.sub(" ", texte)
+    texte = _ORDINAL.sub(r"\1e", texte)
+    return " ".join(texte.replace("°", " ").split())
+
+def _mots_couverts(mots, autres):
+    return all(mot in autres or (len(mot) > LONGUEUR_MOT_COURT and any(
+        len(autre) > LONGUEUR_MOT_COURT and difflib.SequenceMatcher(None, mot, autre).ratio() >= SEUIL_VARIANTE
+        for autre in autres)) for mot in mots)
+
+def mots_compatibles(cle, candidat):
+    """Vrai si chaque mot de chaque clé a son équivalent dans l'autre (mots vides ignorés)."""
+    mots = [mot for mot in cle.split() if mot not in MOTS_VIDES]
+    mots_candidat = [mot for mot in candidat.split() if mot not in MOTS_VIDES]
+    return _mots_couverts(mots, mots_candidat) and _mots_couverts(mots_candidat, mots)
+
+def _trigrammes(cle):
+    cle = f"  {cle} "
+    return {cle[i:i + 3] for i in range(len(cle) - 2)}
+
+class Resolveur:
+    """Index en mémoire d'une base de connaissances [{valeur_brute, nom_standardise}, ...]."""
+    def __init__(self, knowledge_base, seuil=SEUIL_DE_CONFIANCE):
+        self.seuil = seuil
+        self._exactes = {}
+        normalisees = {}
+        for entry in knowledge_base:
+            self._exactes.setdefault(entry['valeur_brute'], entry['nom_standardise'])
+        # Les noms standardisés eux-mêmes sont des formes connues.
+        paires = [(e['valeur_brute'], e['nom_standardise']) for e in knowledge_base] + \
+                 [(e['nom_standardise'], e['nom_standardise']) for e in knowledge_base]
+        for valeur, nom in paires:
+            if not valeur or not nom: continue
+            normalisees.setdefault(cle_normalisee(valeur), set()).add(nom)
+        # Une clé menant à plusieurs noms standardisés est ambiguë : elle est laissée à Gemini, mais reste
+        # indexée pour la présélection des candidats (shortlist).
+        self._noms_par_cle = {cle: noms for cle, noms in normalisees.items() if cle}
+        self._normalisees = {cle: next(iter(noms)) for cle, noms in self._noms_par_cle.items() if len(noms) == 1}
+        self._cles = list(self._noms_par_cle)
+        self._index = {}
+        for numero, cle in enumerate(self._cles):
+            for trigramme in _trigrammes(cle):
+                self._index.setdefault(trigramme, []).append(numero)
+        self._exemples = {}
+        for entry in knowledge_base:
+            exemples = self._exemples.setdefault(entry['nom_standardise'], [])
+            if len(exemples) < EXEMPLES_PAR_CHOIX: exemples.append(entry)
+
+    def _dice(self, cle):
+        """Coefficient de Dice (trigrammes) de `cle` avec chaque clé indexée qui partage au moins un trigramme."""
+        trigrammes = _trigrammes(cle)
+        communs = {}
+        for trigramme in trigrammes:
+            for numero in self._index.get(trigramme, ()):
+                communs[numero] = communs.get(numero, 0) + 1
+        return {numero: 2 * n / (len(trigrammes) + len(_trigrammes(self._cles[numero]))) for numero, n in communs.items()}
+
+    def resoudre(self, valeur_propre):
+        """Retourne (nom_standardise, score, méthode) ; (None, meilleur score, None) sous le seuil."""
+        if valeur_propre in self._exactes:
+            return self._exactes[valeur_propre], 1.0, "exact"
+        cle = cle_normalisee(valeur_propre)
+        if cle in self._normalisees:
+            return self._normalisees[cle], 1.0, "normalised"
+        if not cle: return None, 0.0, None
+
+        # Coefficient de Dice sur les trigrammes pour présélectionner, ratio difflib pour décider.
+        dice = self._dice(cle)
+        candidats = sorted(dice, key=dice.get, reverse=True)[:CANDIDATS_MAX]
+        nombres = _NOMBRE.findall(cle)
+        meilleur, meilleur_score = None, 0.0
+        for numero in candidats:
+            candidat = self._cles[numero]
+            if candidat not in self._normalisees or _NOMBRE.findall(candidat) != nombres: continue
+            if not mots_compatibles(cle, candidat): continue
+            score = difflib.SequenceMatcher(None, cle, candidat).ratio()
+            if score > meilleur_score:
+                meilleur, meilleur_score = candidat, score
+        if meilleur is not None and meilleur_score >= self.seuil:
+            return self._normalisees[meilleur], meilleur_score, "fuzzy"
+        return None, meilleur_score, None
+
+    def shortlist(self, valeur_propre, k):
+        """Les `k` noms standardisés les plus proches lexicalement de `valeur_propre`, du plus au moins proche."""
+        dice = self._dice(cle_normalisee(valeur_propre))
+        scores = {}
+        for numero, score in dice.items():
+            for nom in self._noms_par_cle[self._cles[numero]]:
+                scores[nom] = max(scores.get(nom, 0.0), score)
+        return sorted(scores, key=lambda nom: (-scores[nom], nom))[:k]
+
+    def exemples(self, noms):
+        """Règles de la base de connaissances illustrant `noms` (au plus EXEMPLES_PAR_CHOIX par nom)."""
+        return [entry for nom in noms for entry in self._exemples.get(nom, ())]
+
+class StatistiquesShortlist:
+    """Taux de réussite de la présélection : Gemini a-t-il trouvé sa réponse parmi les k candidats envoyés ?
+
+    Un rang moyen bas et peu d'échecs indiquent que STANDARDISATION_SHORTLIST_K peut être réduit.
+    """
+    def __init__(self):
+        self.stats = {"appels": 0, "trouves": 0, "rangs": 0, "complets": 0}
+        self._lock = threading.Lock()
+
+    def enregistrer(self, rang=None, complet=False):
+        """`rang` (1 = premier candidat) du choix de Gemini, None s'il n'a rien retenu ; `complet` : liste non réduite."""
+        with self._lock:
+            if complet:
+                self.stats["complets"] += 1
+                return
+            self.stats["appels"] += 1
+            if rang is not None:
+                self.stats["trouves"] += 1
+                self.stats["rangs"] += rang
+
+    def resume(self):
+        with self._lock:
+            appels, trouves = self.stats["appels"], self.stats["trouves"]
+            taux = f"{100 * trouves / appels:.0f}%" if appels else "n/a"
+            rang = f"{self.stats['rangs'] / trouves:.1f}" if trouves else "n/a"
+            return (f"Standardisation shortlist (k={STANDARDISATION_SHORTLIST_K}): {appels} call(s), hit rate {taux}, "
+                    f"mean rank {rang}, {self.stats['complets']} call(s) with the full list")
+
+statistiques_shortlist = StatistiquesShortlist()
+
+class BaseDeConnaissances:
+    """Règles VALIDÉ d'un type d'entité à une version donnée, avec leurs choix triés et leur Resolveur."""
+    def __init__(self, entity_type, version, knowledge_base):
+        self.entity_type = entity_type
+        self.version = version
+        self.knowledge_base = knowledge_base
+        self.choix = sorted({entry['nom_standardise'] for entry in knowledge_base})
+        self.resolveur = Resolveur(knowledge_base)
+
+_bases = {}
+_versions = {"valeurs": None, "date": None}
+_bases_lock = threading.Lock()
+
+def _empreinte(knowledge_base):
+    contenu = "\n".join(f"{e['valeur_brute']}\t{e['nom_standardise']}" for e in knowledge_base)
+    return "contenu:" + hashlib.sha1(contenu.encode('utf-8')).hexdigest()
+
+def charger(conn, entity_type):
+    """BaseDeConnaissances de `entity_type` ('ecoles', 'niveaux'), relue seulement si sa version a changé."""
+    table = f"standardisation_{entity_type}"
+    with _bases_lock:
+        maintenant = time.monotonic()
+        if _versions["date"] is None or maintenant - _versions["date"] >= STANDARDISATION_VERSION_CHECK_SECONDS:
+            _versions["valeurs"] = database.get_standardisation_versions(conn)
+            _versions["date"] = maintenant
+        en_cache = _bases.get(entity_type)
+        if _versions["valeurs"] is not None:
+            version = _versions["valeurs"].get(table, 0)
+            if en_cache and en_cache.version == version:
+                return en_cache
+            knowledge_base = database.get_standardisation_knowledge_base(conn, entity_type)
+        else:
+            # Versions illisibles : relecture à chaque appel, le Resolveur n'est reconstruit que si le contenu change.
+            knowledge_base = database.get_standardisation_knowledge_base(conn, entity_type)
+            version = _empreinte(knowledge_base)
+            if en_cache and en_cache.version == version:
+                return en_cache
+        print(f"  -> Knowledge base '{entity_type}' loaded ({len(knowledge_base)} rule(s), version {version}).")
+        _bases[entity_type] = base = BaseDeConnaissances(entity_type, version, knowledge_base)
+        return base
@@ -0,0 +1,37 @@
+# reveil_ingestion.py
+# Signal « nouveau travail » entre l'API Flask et le worker d'ingestion résident (main.py --daemon).
+# Le signal est la date de modification d'un fichier partagé : la route d'upload le touche,
+# le worker la surveille pendant son attente entre deux passes. Aucune dépendance, utilisable
+# depuis n'importe quel processus de la même machine.
+import os
+import time
+from config import INGESTION_WAKE_FILE, INGESTION_WAKE_CHECK_SECONDS
+
+def signaler_nouveau_travail():
+    """Réveille le worker d'ingestion (sans effet si aucun worker ne tourne)."""
+    try:
+        os.makedirs(os.path.dirname(INGESTION_WAKE_FILE) or ".", exist_ok=True)
+        with open(INGESTION_WAKE_FILE, 'a'):
+            pass
+        os.utime(INGESTION_WAKE_FILE, None)
+    except OSError as e:
+        print(f"AVERTISSEMENT : impossible de signaler le worker d'ingestion : {e}")
+
+def dernier_signal():
+    """Horodatage du dernier signal, ou 0."""
+    try:
+        return os.path.getmtime(INGESTION_WAKE_FILE)
+    except OSError:
+        return 0.0
+
+def attendre_signal(arret, delai, depuis):
+    """Attend au plus `delai` secondes, un signal postérieur à `depuis` ou l'arrêt (threading.Event).
+
+    Retourne True si un nouveau signal a été reçu.
+    """
+    fin = time.monotonic() + delai
+    while not arret.is_set() and time.monotonic() < fin:
+        if dernier_signal() > depuis:
+            return True
+        arret.wait(min(INGESTION_WAKE_CHECK_SECONDS, max(0.0, fin - time.monotonic())))
+    return False
@@ -10,6 +10,7 @@ import tempfile
 import io
 from flask import send_file
 import database
+import reveil_ingestion
 
 drive_bp = Blueprint('drive_bp', __name__)
 
@@ -66,6 +67,9 @@ def upload_file_to_drive():
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+        # Le worker d'ingestion (main.py --daemon) traite le fichier sans attendre sa prochaine passe.
+        reveil_ingestion.signaler_nouveau_travail()
+
         return jsonify({
             "success": True,
             "file_id": uploaded_file.get('id'),
@@ -79,9 +83,6 @@ def upload_file_to_drive():
         return jsonify({"error": f"Erreur lors de l'upload sur Drive : {str(e)}"}), 500
 
 
-
-drive_bp = Blueprint('drive_bp', __name__)
-
 @drive_bp.route('/files/download/<string:file_id>', methods=['GET'])
 @login_required
 def download_drive_file(file_id):
@@ -3,6 +3,8 @@ from flask import Blueprint, jsonify
 from flask_login import login_required
 from decorators import admin_required
 import database
+import reveil_ingestion
+from config import JOB_PRIORITY_REPROCESS
 
 files_bp = Blueprint('files_bp', __name__)
 
@@ -38,13 +40,16 @@ def reprocess_file(file_id):
         db_conn = database.get_connection()
         cursor = db_conn.cursor()
         
-        # On supprime simplement le log du fichier.
-        # Au prochain lancement, main.py le verra comme un "nouveau" fichier.
-        query = "DELETE FROM logs_fichiers WHERE id_fichier_drive = %s"
+        # On repasse le fichier en attente (plutôt que de supprimer son log) : la découverte
+        # complète comme la découverte incrémentale de main.py le reprendront.
+        query = "UPDATE logs_fichiers SET statut = 'EN_ATTENTE', error_message = 'Reprocessing requested.', date_traitement = NOW() WHERE id_fichier_drive = %s"
         cursor.execute(query, (file_id,))
         db_conn.commit()
         
         if cursor.rowcount > 0:
+            # Avec la file de jobs (INGESTION_JOB_QUEUE), le job du fichier repasse en tête de file.
+            database.requeue_job(db_conn, file_id, JOB_PRIORITY_REPROCESS)
+            reveil_ingestion.signaler_nouveau_travail()
             return jsonify({"success": True, "message": f"Le fichier {file_id} sera retraité au prochain lancement."})
         else:
             return jsonify({"success": False, "message": "Fichier non trouvé dans les logs."}), 404
@@ -82,6 +82,7 @@ def create_std_entry(std_type):
     try:
         cursor = db_conn.cursor()
         cursor.execute(query, values)
+        database.bump_standardisation_version(cursor, table)
         db_conn.commit()
         return jsonify({"message": "Entrée créée."}), 201
     finally:
@@ -101,6 +102,7 @@ def update_std_entry(std_type, entry_id):
     try:
         cursor = db_conn.cursor()
         cursor.execute(f"UPDATE `{table}` SET {set_clause} WHERE `{pk}` = %s", tuple(values))
+        database.bump_standardisation_version(cursor, table)
         db_conn.commit()
         return jsonify({"message": "Mise à jour réussie."})
     finally:
@@ -116,6 +118,7 @@ def delete_std_entry(std_type, entry_id):
     try:
         cursor = db_conn.cursor()
         cursor.execute(f"DELETE FROM `{table}` WHERE `{pk}` = %s", (entry_id,))
+        database.bump_standardisation_version(cursor, table)
         db_conn.commit()
         return jsonify({"message": "Suppression réussie."})
     finally:
@@ -143,6 +146,7 @@ def bulk_delete_std_entries(std_type):
         placeholders = ', '.join(['%s'] * len(entry_ids))
         query = f"DELETE FROM `{table}` WHERE `{pk}` IN ({placeholders})"
         cursor.execute(query, tuple(entry_ids))
+        database.bump_standardisation_version(cursor, table)
         db_conn.commit()
         return jsonify({"message": "Suppression groupée réussie."})
     finally:
@@ -173,9 +177,11 @@ def bulk_validate_std_entries(std_type):
         query = f"UPDATE `{table}` SET statut = 'VALIDÉ' WHERE `{pk}` IN ({placeholders})"
         
         cursor.execute(query, tuple(entry_ids))
+        validees = cursor.rowcount
+        database.bump_standardisation_version(cursor, table)
         db_conn.commit()
         
-        return jsonify({"message": f"{cursor.rowcount} règles ont été validées."})
+        return jsonify({"message": f"{validees} règles ont été validées."})
     except Exception as e:
         if db_conn: db_conn.rollback()
         return jsonify({"error": "Erreur lors de la validation groupée.", "details": str(e)}), 500
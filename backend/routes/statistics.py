@@ -1,7 +1,9 @@
 # Prototyping/routes/statistics.py
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_login import login_required
+from decorators import admin_required
 import database
+import telemetrie
 import traceback
 
 statistics_bp = Blueprint('statistics_bp', __name__)
@@ -58,4 +60,23 @@ def get_statistics_summary():
         return jsonify({"error": "Erreur interne du serveur", "details": str(e)}), 500
     finally:
         if db_conn and db_conn.is_connected():
-            db_conn.close()
\ No newline at end of file
+            db_conn.close()
+
+@statistics_bp.route('/ingestion', methods=['GET'])
+@login_required
+@admin_required
+def get_ingestion_metrics():
+    """[ADMIN] Temps par étape (p50/p95), tokens et coût estimé par page des fichiers traités sur `?days=` jours (7 par défaut)."""
+    days = request.args.get('days', default=7, type=int)
+    db_conn = None
+    try:
+        db_conn = database.get_connection()
+        resume = telemetrie.agreger(database.get_file_metrics(db_conn, days))
+        resume['days'] = days
+        return jsonify(resume)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Erreur interne du serveur", "details": str(e)}), 500
+    finally:
+        if db_conn and db_conn.is_connected():
+            db_conn.close()
@@ -0,0 +1,116 @@
+# spool.py
+# Téléchargements Drive écrits par morceaux dans un fichier temporaire (spool) au lieu d'être
+# accumulés en mémoire : un worker ne garde que le morceau en cours, quel que soit le fichier.
+# Le md5 et la taille sont calculés au fil de l'écriture (empreinte sans relecture).
+#
+# Les octets ne repassent en mémoire qu'au moment de l'appel OCR en ligne, sous contrôle
+# d'admission : la somme des fichiers chargés en même temps par le processus est bornée.
+# La mémoire n'est donc pas constante quelle que soit la taille du fichier : l'OCR en ligne reçoit le
+# document en octets dans la requête. Le pic est borné par OCR_MAX_INFLIGHT_MB (admission_ocr), ou par
+# la plus grosse requête si elle dépasse cette limite, soit OCR_SPLIT_MAX_MB pour un PDF découpé.
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import weakref
+from config import DOWNLOAD_SPOOL_DIR, OCR_MAX_INFLIGHT_MB
+
+# Fichiers de spool laissés par un processus interrompu, supprimés au premier téléchargement.
+AGE_MAX_ORPHELINS = 24 * 3600
+_purge_faite = False
+_purge_lock = threading.Lock()
+
+class TailleDepassee(Exception):
+    pass
+
+def _supprimer(chemin):
+    try:
+        os.remove(chemin)
+    except FileNotFoundError:
+        pass
+
+def _purger_orphelins():
+    """Une seule fois par processus. D'autres processus partagent le dossier : un fichier peut disparaître entre
+    le listing et sa suppression, et un fichier illisible ne doit pas faire échouer le téléchargement en cours."""
+    global _purge_faite
+    with _purge_lock:
+        if _purge_faite: return
+        _purge_faite = True
+        limite = time.time() - AGE_MAX_ORPHELINS
+        for nom in os.listdir(DOWNLOAD_SPOOL_DIR):
+            if not nom.startswith("drive-"): continue
+            chemin = os.path.join(DOWNLOAD_SPOOL_DIR, nom)
+            try:
+                if os.path.getmtime(chemin) < limite: os.remove(chemin)
+            except OSError:
+                pass
+
+class FichierSpool:
+    """Contenu d'un fichier téléchargé, sur disque. Supprimé par fermer() (ou à défaut par le ramasse-miettes).
+
+    S'utilise comme un objet fichier en écriture (MediaIoBaseDownload appelle write()).
+    """
+    def __init__(self, taille_max=None):
+        os.makedirs(DOWNLOAD_SPOOL_DIR, exist_ok=True)
+        _purger_orphelins()
+        descripteur, self.chemin = tempfile.mkstemp(prefix="drive-", dir=DOWNLOAD_SPOOL_DIR)
+        self._fichier = os.fdopen(descripteur, 'wb')
+        self._md5 = hashlib.md5()
+        self.taille = 0
+        self.taille_max = taille_max
+        self._finaliseur = weakref.finalize(self, _supprimer, self.chemin)
+
+    def write(self, morceau):
+        self.taille += len(morceau)
+        if self.taille_max and self.taille > self.taille_max:
+            raise TailleDepassee(f"taille maximale dépassée ({self.taille_max} octets)")
+        self._md5.update(morceau)
+        return self._fichier.write(morceau)
+
+    def terminer(self):
+        """Fin de l'écriture : le contenu devient lisible."""
+        self._fichier.close()
+        return self
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    def lire(self):
+        with open(self.chemin, 'rb') as f:
+            return f.read()
+
+    def fermer(self):
+        if not self._fichier.closed: self._fichier.close()
+        self._finaliseur()
+
+    def __len__(self):
+        return self.taille
+
+def liberer(contenu):
+    """Supprime un contenu téléchargé (sans effet sur des octets ou None)."""
+    if isinstance(contenu, FichierSpool): contenu.fermer()
+
+class ControleAdmission:
+    """Sémaphore en octets : bloque tant que la somme des contenus chargés dépasserait `max_octets`.
+
+    Un contenu plus gros que la limite passe seul, pour ne jamais bloquer indéfiniment.
+    """
+    def __init__(self, max_octets):
+        self.max_octets = max_octets
+        self._en_cours = 0
+        self._condition = threading.Condition()
+
+    def acquerir(self, octets):
+        with self._condition:
+            while self._en_cours and self._en_cours + octets > self.max_octets:
+                self._condition.wait()
+            self._en_cours += octets
+
+    def liberer(self, octets):
+        with self._condition:
+            self._en_cours -= octets
+            self._condition.notify_all()
+
+admission_ocr = ControleAdmission(OCR_MAX_INFLIGHT_MB * 1024 * 1024)
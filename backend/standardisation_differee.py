@@ -0,0 +1,57 @@
+# standardisation_differee.py
+# Standardisation différée (STANDARDISATION_DEFERRED, main.py --defer-standardisation). Pendant l'analyse,
+# une école ou un niveau sans correspondance locale (resolveur_standardisation) est inséré sous son nom
+# brut ; l'entité créée pour lui est notée dans standardisation_en_attente (ID et nom brut) : aucun appel
+# Gemini sur le chemin critique du fichier.
+#
+# En fin de passe, resoudre() standardise tous les termes en attente en quelques appels groupés
+# (ai_processor.standardiser_lot), puis corrige la base en une transaction par type d'entité : les entités
+# provisoires notées, et elles seules, sont renommées ou fusionnées dans l'entité standard existante
+# (listes, manuels, positions), et les règles apprises sont enregistrées en bloc (statut À_VÉRIFIER, comme
+# un appel Gemini unitaire).
+# Un terme dont l'appel groupé a échoué reste en attente pour la passe suivante.
+import database
+import ai_processor
+import resolveur_standardisation
+
+VERROU = "standardisation_en_attente"
+
+def resoudre(db_conn):
+    """Standardise les termes en attente (un seul worker à la fois). Retourne le nombre de termes traités."""
+    verrou = database.acquire_named_lock(db_conn, VERROU, timeout=0)
+    if not verrou:
+        print("\n-> Deferred standardisation already running in another worker, skipped.")
+        return 0
+    try:
+        return sum(_resoudre_type(db_conn, entity_type) for entity_type in database.STANDARDISED_ENTITIES)
+    finally:
+        database.release_named_locks(db_conn, [verrou])
+
+def _resoudre_type(db_conn, entity_type):
+    en_attente = database.get_pending_standardisations(db_conn, entity_type)
+    if not en_attente: return 0
+    print(f"\n[Deferred standardisation] {len(en_attente)} pending {entity_type} term(s)...")
+    base = resolveur_standardisation.charger(db_conn, entity_type)
+    resultats = ai_processor.standardiser_lot(base, list(en_attente))
+
+    verrous, corrigees = [], 0
+    try:
+        for valeur_brute, (nom_standardise, _) in resultats.items():
+            if nom_standardise and nom_standardise != valeur_brute:
+                corrigees += database.merge_standardised_entity(db_conn, entity_type, valeur_brute, en_attente[valeur_brute],
+                                                                nom_standardise, verrous)
+        # Comme _standardise_entite : un terme sans correspondance est appris sous son nom brut.
+        database.learn_new_standardisations(db_conn, entity_type, [(valeur_brute, nom_standardise or valeur_brute)
+                                                                   for valeur_brute, (nom_standardise, apprendre) in resultats.items() if apprendre],
+                                            commit=False)
+        database.delete_pending_standardisations(db_conn, entity_type, list(resultats), commit=False)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        database.release_named_locks(db_conn, verrous)
+    standardises = sum(1 for nom_standardise, _ in resultats.values() if nom_standardise)
+    print(f"  -> {standardises}/{len(resultats)} term(s) standardised, {corrigees} provisional {entity_type} row(s) patched, "
+          f"{len(en_attente) - len(resultats)} left pending.")
+    return len(resultats)
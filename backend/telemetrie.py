@@ -0,0 +1,121 @@
+# telemetrie.py
+# Métriques d'ingestion par fichier et par étape (téléchargement, OCR, analyse IA, écriture en base),
+# enregistrées dans metriques_fichiers à côté de logs_fichiers : une ligne par traitement de fichier.
+#
+# Le collecteur d'un fichier est attaché au dict du fichier, qui traverse toutes les étapes (mode
+# séquentiel comme pipeline). Pendant une étape mesurée, le collecteur est aussi le « fichier
+# courant » (contextvars) : call_gemini_detaille y impute ses tokens sans que le fichier lui soit passé.
+import contextvars
+import socket
+import threading
+import time
+from contextlib import contextmanager
+import database
+from config import GEMINI_PRICE_INPUT_PER_MTOK, GEMINI_PRICE_OUTPUT_PER_MTOK, DOCAI_PRICE_PER_PAGE
+
+_collecteur_courant = contextvars.ContextVar("collecteur_metriques", default=None)
+MACHINE = socket.gethostname()
+
+# Étapes chronométrées (colonne <etape>_ms), dans l'ordre du traitement.
+ETAPES = ("telechargement", "ocr", "analyse", "llm", "bdd", "total")
+
+class MetriquesFichier:
+    """Compteurs d'un fichier, incrémentés depuis plusieurs threads."""
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self.valeurs = {}
+        self._lock = threading.Lock()
+
+    def ajouter(self, **increments):
+        with self._lock:
+            for cle, valeur in increments.items():
+                self.valeurs[cle] = self.valeurs.get(cle, 0) + valeur
+
+def pour(fichier):
+    """Collecteur de métriques du fichier (créé au premier appel)."""
+    return fichier.setdefault('_metriques', MetriquesFichier())
+
+@contextmanager
+def mesurer(fichier, etape):
+    """Chronomètre une étape du fichier ; les appels Gemini faits pendant l'étape lui sont imputés."""
+    metriques = pour(fichier)
+    jeton = _collecteur_courant.set(metriques)
+    debut = time.perf_counter()
+    try:
+        yield metriques
+    finally:
+        metriques.ajouter(**{f"{etape}_ms": int((time.perf_counter() - debut) * 1000)})
+        _collecteur_courant.reset(jeton)
+
+def soumettre(executor, fonction, *args):
+    """executor.submit, en transmettant le fichier courant au thread du pool."""
+    return executor.submit(contextvars.copy_context().run, fonction, *args)
+
+def enregistrer_appel_llm(resultat):
+    """Impute un résultat de call_gemini_detaille au fichier courant (sans effet hors d'une étape mesurée)."""
+    metriques = _collecteur_courant.get()
+    if metriques is None: return
+    if resultat["cached"]:
+        metriques.ajouter(llm_appels_cache=1)
+        return
+    metriques.ajouter(llm_appels=1, llm_reessais=max(0, resultat["attempts"] - 1), llm_ms=resultat["latency_ms"],
+                      llm_tokens_entree=resultat["usage"]["prompt_tokens"], llm_tokens_sortie=resultat["usage"]["output_tokens"])
+
+def sauvegarder(db_conn, fichier, log_status):
+    """Enregistre les métriques du fichier avec son statut final. Une erreur ici n'affecte pas le traitement."""
+    metriques = fichier.get('_metriques')
+    if metriques is None: return
+    with metriques._lock:
+        valeurs = dict(metriques.valeurs)
+    valeurs['total_ms'] = int((time.perf_counter() - metriques.debut) * 1000)
+    try:
+        database.save_file_metrics(db_conn, fichier['id'], log_status, MACHINE, valeurs)
+    except Exception as e:
+        print(f"  -> WARNING: could not save file metrics: {e}")
+
+# --- Agrégation (API d'administration) ---
+def _percentile(valeurs, p):
+    """Percentile par rang le plus proche ; None si aucune valeur."""
+    if not valeurs: return None
+    valeurs = sorted(valeurs)
+    rang = max(1, -(-len(valeurs) * p // 100))
+    return valeurs[int(rang) - 1]
+
+def agreger(lignes):
+    """Résumé de lignes de metriques_fichiers : p50/p95 par étape, tokens, coût estimé par page."""
+    def somme(colonne): return sum(l.get(colonne) or 0 for l in lignes)
+
+    etapes = {}
+    for etape in ETAPES:
+        mesures = [l[f"{etape}_ms"] for l in lignes if l.get(f"{etape}_ms") is not None]
+        etapes[etape] = {"count": len(mesures), "p50_ms": _percentile(mesures, 50), "p95_ms": _percentile(mesures, 95)}
+
+    pages = somme('ocr_pages')
+    pages_facturees = sum(l.get('ocr_pages') or 0 for l in lignes if not l.get('ocr_cache'))
+    cout_llm = (somme('llm_tokens_entree') * GEMINI_PRICE_INPUT_PER_MTOK + somme('llm_tokens_sortie') * GEMINI_PRICE_OUTPUT_PER_MTOK) / 1_000_000
+    cout_ocr = pages_facturees * DOCAI_PRICE_PER_PAGE
+    statuts = {}
+    for l in lignes:
+        statuts[l['statut']] = statuts.get(l['statut'], 0) + 1
+
+    return {
+        "files": len(lignes),
+        "statuses": statuts,
+        "stages": etapes,
+        "download_bytes": somme('telechargement_octets'),
+        "pages": pages,
+        "llm": {
+            "calls": somme('llm_appels'),
+            "cached_calls": somme('llm_appels_cache'),
+            "retries": somme('llm_reessais'),
+            "prompt_tokens": somme('llm_tokens_entree'),
+            "output_tokens": somme('llm_tokens_sortie'),
+        },
+        "db_rows_written": somme('bdd_lignes'),
+        "estimated_cost": {
+            "llm": round(cout_llm, 4),
+            "ocr": round(cout_ocr, 4),
+            "total": round(cout_llm + cout_ocr, 4),
+            "per_page": round((cout_llm + cout_ocr) / pages, 6) if pages else None,
+        },
+    }
@@ -0,0 +1,21 @@
+# tests/conftest.py
+# Tests unitaires des fonctions pures de l'ingestion : aucune base MySQL ni API Google n'est contactée.
+# config.py exige quelques variables d'environnement ; des valeurs factices suffisent, sans écraser
+# celles déjà définies. Les caches disque sont désactivés, le spool va dans un dossier temporaire.
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_dossier = tempfile.mkdtemp(prefix="tests-backend-")
+_credentials = os.path.join(_dossier, "credentials.json")
+with open(_credentials, 'w') as f:
+    json.dump({"project_id": "tests"}, f)
+
+for nom, valeur in {"GEMINI_API_KEY": "tests", "DB_HOST": "localhost", "DB_USER": "tests", "DB_NAME": "tests",
+                    "GOOGLE_DRIVE_FOLDER_ID": "tests", "DOCAI_LOCATION": "eu", "DOCAI_PROCESSOR_ID": "tests",
+                    "GOOGLE_APPLICATION_CREDENTIALS": _credentials, "OCR_CACHE_ENABLED": "false",
+                    "LLM_CACHE_ENABLED": "false", "DOWNLOAD_SPOOL_DIR": os.path.join(_dossier, "spool")}.items():
+    os.environ.setdefault(nom, valeur)
@@ -0,0 +1,60 @@
+# tests/fausse_connexion.py
+# Connexion MySQL factice pour tester les fonctions de database.py sans serveur : elle journalise les
+# requêtes (espaces normalisés), renvoie des lignes imposées aux SELECT et peut lever une erreur choisie.
+# `lignes` : les lignes de tous les SELECT, ou {fragment SQL: lignes} (premier fragment contenu dans la
+# requête ; aucune ligne sinon). GET_LOCK réussit toujours.
+
+class Curseur:
+    def __init__(self, connexion, dictionary):
+        self.connexion, self.dictionary, self.rowcount, self._lignes = connexion, dictionary, 0, []
+
+    def execute(self, requete, parametres=()):
+        requete = " ".join(requete.split())
+        self.connexion.requetes.append((requete, tuple(parametres)))
+        for motif, erreur in self.connexion.erreurs.items():
+            if motif in requete: raise erreur
+        self.rowcount = self.connexion.rowcount
+        self._lignes = self.connexion.lignes_de(requete) if requete.startswith("SELECT") else []
+
+    def executemany(self, requete, lignes):
+        self.execute(requete)
+        self.connexion.requetes[-1] = (self.connexion.requetes[-1][0], list(lignes))
+
+    def fetchall(self):
+        lignes, self._lignes = self._lignes, []
+        return lignes
+
+    def fetchone(self):
+        return self._lignes.pop(0) if self._lignes else None
+
+    def close(self):
+        pass
+
+class Connexion:
+    def __init__(self, rowcount=1, erreurs=None, lignes=None):
+        self.rowcount, self.erreurs, self.lignes = rowcount, erreurs or {}, lignes or []
+        self.requetes, self.commits, self.rollbacks = [], 0, 0
+        self.in_transaction = False
+
+    def cursor(self, dictionary=False):
+        return Curseur(self, dictionary)
+
+    def start_transaction(self):
+        self.in_transaction = True
+
+    def commit(self):
+        self.commits += 1
+        self.in_transaction = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def lignes_de(self, requete):
+        if "GET_LOCK" in requete: return [(1,)]
+        if not isinstance(self.lignes, dict): return list(self.lignes)
+        return next((list(lignes) for motif, lignes in self.lignes.items() if motif in requete), [])
+
+    def sql(self, motif):
+        """Requêtes (texte, paramètres) contenant `motif`."""
+        return [(requete, parametres) for requete, parametres in self.requetes if motif in requete]
@@ -0,0 +1,141 @@
+# tests/test_batch_ocr.py
+# Flux OCR par lots : un job Document AI bloqué ou un arrêt demandé ne doit jamais retenir le worker,
+# les fichiers concernés repassant simplement par l'OCR en ligne.
+import os
+import threading
+import time
+import pytest
+import batch_ocr
+import doc_processor
+import fake_docai
+import ingestion
+import spool
+from disk_cache import DiskCache
+
+class BackendBloque:
+    """Backend dont les jobs ne se terminent jamais."""
+    def __init__(self):
+        self.soumis, self.abandonnes = [], []
+
+    def soumettre(self, elements):
+        self.soumis.append([fichier['id'] for fichier, _ in elements])
+        return f"job{len(self.soumis)}"
+
+    def est_termine(self, job_id):
+        return False
+
+    def abandonner(self, job_id):
+        self.abandonnes.append(job_id)
+
+@pytest.fixture
+def fichiers(monkeypatch):
+    monkeypatch.setattr(ingestion, "telecharger_sans_doublon", lambda drive, db, fichier: (None, "", b"contenu"))
+    return [{'id': f"f{i}", 'mimeType': 'application/pdf'} for i in range(3)]
+
+def test_delai_maximal(fichiers):
+    backend = BackendBloque()
+    debut = time.monotonic()
+    assert batch_ocr.pre_ocr_par_lots(None, None, fichiers, backend, taille_lot=2, intervalle=0.01, delai_max=0.1) == 0
+    assert time.monotonic() - debut < 2
+    assert backend.soumis == [["f0", "f1"], ["f2"]]
+    assert backend.abandonnes == ["job1", "job2"]
+
+def test_arret_demande(fichiers):
+    backend, arret = BackendBloque(), threading.Event()
+    threading.Timer(0.1, arret.set).start()
+    debut = time.monotonic()
+    assert batch_ocr.pre_ocr_par_lots(None, None, fichiers, backend, intervalle=60, delai_max=3600, arret=arret) == 0
+    assert time.monotonic() - debut < 5
+    assert backend.abandonnes == ["job1"]
+
+def test_arret_avant_envoi(fichiers):
+    backend, arret = BackendBloque(), threading.Event()
+    arret.set()
+    assert batch_ocr.pre_ocr_par_lots(None, None, fichiers, backend, arret=arret) == 0
+    assert backend.soumis == []
+
+class BackendEnEchec(BackendBloque):
+    """Premier envoi refusé (quota), lecture des résultats du second en erreur."""
+    def soumettre(self, elements):
+        if not self.soumis:
+            self.soumis.append(None)
+            raise RuntimeError("429 quota exceeded")
+        return super().soumettre(elements)
+
+    def est_termine(self, job_id):
+        return True
+
+    def resultats(self, job_id):
+        raise RuntimeError("shard illisible")
+
+def test_echecs_par_lot_sans_interrompre_la_passe(fichiers, monkeypatch):
+    liberes = []
+    monkeypatch.setattr(batch_ocr.spool, "liberer", liberes.append)
+    backend = BackendEnEchec()
+    assert batch_ocr.pre_ocr_par_lots(None, None, fichiers, backend, taille_lot=2, intervalle=0.01) == 0
+    assert backend.soumis == [None, ["f2"]]
+    assert liberes == [b"contenu", b"contenu"]  # Spools du lot refusé
+    assert backend.abandonnes == ["job2"]
+
+class Bucket:
+    """Bucket GCS en mémoire ; l'envoi du fichier `refuse` échoue."""
+    def __init__(self, refuse):
+        self.refuse, self.objets = refuse, set()
+
+    def blob(self, nom):
+        bucket = self
+        class Blob:
+            name = nom
+            def upload_from_filename(self, chemin, content_type=None):
+                if nom.endswith(bucket.refuse): raise OSError("upload interrompu")
+                bucket.objets.add(nom)
+            def delete(self):
+                bucket.objets.discard(nom)
+        return Blob()
+
+    def list_blobs(self, prefix):
+        return [self.blob(nom) for nom in sorted(self.objets) if nom.startswith(prefix)]
+
+def test_envoi_gcs_en_echec(monkeypatch):
+    liberes = []
+    monkeypatch.setattr(batch_ocr.spool, "liberer", liberes.append)
+    backend = batch_ocr.DocumentAIBatchBackend.__new__(batch_ocr.DocumentAIBatchBackend)
+    backend._bucket, backend._bucket_name, backend._prefix, backend._operations = Bucket("f1"), "b", "p", {}
+    contenus = [type("Spool", (), {"chemin": f"/tmp/f{i}"})() for i in range(3)]
+    with pytest.raises(OSError):
+        backend.soumettre([({'id': f"f{i}", 'mimeType': 'application/pdf'}, c) for i, c in enumerate(contenus)])
+    assert liberes == contenus
+    assert backend._bucket.objets == set()
+    assert backend._operations == {}
+
+def test_flux_batch_local_hors_ligne(tmp_path, monkeypatch):
+    """--ocr-mode batch-local avec le faux Document AI : les documents arrivent dans le cache OCR."""
+    monkeypatch.setattr(doc_processor, "_client", fake_docai.FakeDocumentAIClient())
+    monkeypatch.setattr(doc_processor, "ocr_cache", DiskCache(str(tmp_path), 10 * 1024 * 1024))
+    pages = {f"f{i}": [[f"École {i}", "2025/2026"], ["CE1", f"Manuel {i} - Hachette"]] for i in range(5)}
+    spools = []
+    def telecharger(drive, db, fichier):
+        contenu = spool.FichierSpool()
+        contenu.write(fake_docai.contenu_synthetique(pages[fichier['id']]))
+        spools.append(contenu.terminer())
+        return None, "", contenu
+    monkeypatch.setattr(ingestion, "telecharger_sans_doublon", telecharger)
+    fichiers = [{'id': file_id, 'name': f"{file_id}.pdf", 'mimeType': 'application/pdf', 'empreinte': f"md5-{file_id}"} for file_id in pages]
+
+    backend = batch_ocr.choisir_backend("batch-local", len(fichiers))
+    assert isinstance(backend, batch_ocr.LocalBatchBackend)
+    try:
+        assert batch_ocr.pre_ocr_par_lots(None, None, fichiers, backend, taille_lot=2, intervalle=0.01) == 5
+    finally:
+        backend.fermer()
+    for fichier in fichiers:
+        document = doc_processor.charger_ocr(fichier['id'], fichier['empreinte'])
+        assert document.text.splitlines() == [ligne for page in pages[fichier['id']] for ligne in page]
+        assert len(document.pages) == 2
+    assert not any(os.path.exists(contenu.chemin) for contenu in spools)
+    assert backend._executor._shutdown
+
+def test_choisir_backend(monkeypatch):
+    monkeypatch.setattr(doc_processor, "ocr_cache", None)
+    assert batch_ocr.choisir_backend("batch-local", 100) is None  # Le mode batch passe par le cache OCR
+    assert batch_ocr.choisir_backend("online", 100) is None
@@ -0,0 +1,28 @@
+# tests/test_client_gemini.py
+# Façade synchrone du moteur asyncio : appelée depuis la boucle du moteur, elle bloquerait cette boucle
+# pour toujours ; elle doit lever une erreur à la place.
+import asyncio
+import pytest
+from client_gemini import MoteurGemini
+
+async def _valeur(x):
+    return x
+
+def test_executer_depuis_un_thread():
+    assert MoteurGemini().executer(_valeur(3)) == 3
+
+def test_executer_depuis_la_boucle_du_moteur():
+    moteur = MoteurGemini()
+
+    async def appel_synchrone_imbrique():
+        coroutine = _valeur(1)
+        with pytest.raises(RuntimeError):
+            moteur.executer(coroutine)
+        assert coroutine.cr_frame is None  # Coroutine fermée, pas d'avertissement « never awaited »
+        return await _valeur(2)  # La boucle reste utilisable
+
+    assert moteur.soumettre(appel_synchrone_imbrique()).result(timeout=5) == 2
+
+def test_attendre_depuis_une_autre_boucle():
+    moteur = MoteurGemini()
+    assert asyncio.run(moteur.attendre(_valeur(4))) == 4
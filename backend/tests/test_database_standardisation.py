@@ -0,0 +1,36 @@
+# tests/test_database_standardisation.py
+# Une règle de standardisation modifiée sans sa version laisse chaque worker sur l'ancienne base de
+# connaissances (resolveur_standardisation.charger) : la règle et sa version sont écrites ensemble ou pas du tout.
+import pytest
+import database
+from fausse_connexion import Connexion
+
+class Deadlock(Exception):
+    pass
+
+def test_version_en_echec_annule_la_regle():
+    conn = Connexion(rowcount=2, erreurs={"versions_standardisation": Deadlock("1213 (40001): Deadlock found")})
+    database.learn_new_standardisation(conn, "CE 1", "CE1", "niveaux")
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+
+def test_version_en_echec_remontee():
+    conn = Connexion(erreurs={"versions_standardisation": Deadlock("1213")})
+    with pytest.raises(Deadlock):
+        database.bump_standardisation_version(conn.cursor(), "standardisation_niveaux")
+
+@pytest.mark.parametrize("existantes, version", [
+    ([], False),                                      # Nouvelles suggestions seulement
+    ([("ce 1", "CE1", "À_VÉRIFIER")], False),         # Règle inchangée
+    ([("ce 1", "CE1", "VALIDÉ")], True),              # Règle validée renvoyée en vérification
+    ([("ce 1", "Cours élémentaire 1", "À_VÉRIFIER")], True),
+])
+def test_version_seulement_si_une_regle_change(existantes, version):
+    conn = Connexion(lignes=existantes)
+    database.learn_new_standardisations(conn, "niveaux", [("CE 1", "CE1"), ("CE 2", "CE2")])
+    assert bool(conn.sql("versions_standardisation")) == version
+    assert conn.commits == 1
+
+def test_regle_unitaire_nouvelle_sans_version():
+    conn = Connexion(rowcount=1)
+    database.learn_new_standardisation(conn, "CE 1", "CE1", "niveaux")
+    assert conn.sql("versions_standardisation") == [] and conn.commits == 1
@@ -0,0 +1,62 @@
+# tests/test_disk_cache.py
+# Le cache OCR et le cache LLM partagent DiskCache : lecture/écriture, durée de vie et éviction
+# des entrées les moins récemment utilisées.
+import os
+import time
+import pytest
+import disk_cache
+from disk_cache import DiskCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(str(tmp_path), max_bytes=1000)
+
+def test_aller_retour(cache):
+    assert cache.get("cle") is None
+    assert not cache.contient("cle")
+    cache.set("cle", b"valeur")
+    assert cache.contient("cle")
+    assert cache.get("cle") == b"valeur"
+    assert (cache.stats["hits"], cache.stats["misses"], cache.stats["writes"]) == (1, 1, 1)
+
+def test_reecriture_sans_double_comptage(cache):
+    for _ in range(3):
+        cache.set("cle", os.urandom(400))
+    cache.set("autre", os.urandom(400))  # 800 octets réellement stockés : sous la limite
+    assert cache.stats["evictions"] == 0
+    assert cache.get("cle") is not None and cache.get("autre") is not None
+
+def test_valeur_trop_grosse_ignoree(cache):
+    cache.set("cle", os.urandom(2000))
+    assert cache.get("cle") is None
+    assert cache.stats["writes"] == 0
+
+def test_duree_de_vie(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), max_bytes=1000, ttl=60)
+    cache.set("cle", b"valeur")
+    maintenant = time.time()
+    monkeypatch.setattr(disk_cache.time, "time", lambda: maintenant + 120)
+    assert not cache.contient("cle")
+    assert cache.get("cle") is None
+    monkeypatch.undo()
+    assert cache.get("cle") is None  # Entrée expirée supprimée, pas seulement masquée
+    assert cache.stats["misses"] == 2
+
+def test_eviction_des_moins_recemment_utilisees(cache):
+    cache.set("a", os.urandom(400))
+    time.sleep(0.01)
+    cache.set("b", os.urandom(400))
+    time.sleep(0.01)
+    assert cache.get("a") is not None  # « a » redevient la plus récente
+    cache.set("c", os.urandom(400))
+    assert cache.stats["evictions"] == 1
+    assert not cache.contient("b")
+    assert cache.contient("a") and cache.contient("c")
+
+def test_taille_relue_au_demarrage(tmp_path):
+    DiskCache(str(tmp_path), max_bytes=1000).set("a", os.urandom(400))
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    cache.set("b", os.urandom(400))
+    assert cache.stats["evictions"] == 0
+    cache.set("c", os.urandom(400))  # Dépasse la limite seulement si « a » a été compté au démarrage
+    assert cache.stats["evictions"] == 1
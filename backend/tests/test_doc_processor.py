@@ -0,0 +1,92 @@
+# tests/test_doc_processor.py
+# Assemblage des documents Document AI OCRisés par morceaux : une ancre mal décalée pointe en silence
+# vers le texte d'une autre page (positions et extraction faussées sans aucune erreur).
+import io
+from google.cloud import documentai
+from pypdf import PdfWriter
+import doc_processor
+from doc_processor import _decaler_ancres, _get_text_anchor_content, _plan_decoupage, fusionner_documents
+
+def _ancre(debut, fin):
+    return documentai.Document.TextAnchor(text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=debut, end_index=fin)])
+
+def _document(lignes):
+    """Document d'une page : une ligne OCR par texte, et un tableau d'une cellule sur la dernière ligne."""
+    texte, paragraphes = "", []
+    for ligne in lignes:
+        paragraphes.append(_ancre(len(texte), len(texte) + len(ligne)))
+        texte += ligne + "\n"
+    page = documentai.Document.Page(
+        page_number=1,
+        layout=documentai.Document.Page.Layout(text_anchor=_ancre(0, len(texte))),
+        lines=[documentai.Document.Page.Line(layout=documentai.Document.Page.Layout(text_anchor=a)) for a in paragraphes],
+        tables=[documentai.Document.Page.Table(body_rows=[documentai.Document.Page.Table.TableRow(cells=[
+            documentai.Document.Page.Table.TableCell(layout=documentai.Document.Page.Layout(text_anchor=paragraphes[-1]))])])],
+    )
+    return documentai.Document(text=texte, pages=[page], mime_type="application/pdf")
+
+def _lignes(document):
+    return [[_get_text_anchor_content(document.text, ligne.layout.text_anchor) for ligne in page.lines] for page in document.pages]
+
+def test_decaler_ancres_recursif():
+    page = documentai.Document.pb(_document(["Maths", "Hachette"])).pages[0]
+    _decaler_ancres(page, 100)
+    assert [(s.start_index, s.end_index) for s in page.lines[1].layout.text_anchor.text_segments] == [(106, 114)]
+    cellule = page.tables[0].body_rows[0].cells[0]
+    assert [(s.start_index, s.end_index) for s in cellule.layout.text_anchor.text_segments] == [(106, 114)]
+    assert page.layout.text_anchor.text_segments[0].start_index == 100
+
+def test_fusion_ancres_et_pages():
+    morceaux = [_document(["CP", "Lecture - Nathan"]), _document(["CE1", "Maths - Hachette"]), _document(["CE2", "Anglais - Oxford"])]
+    attendu = [ligne for document in morceaux for ligne in _lignes(document)]
+    fusion = fusionner_documents(morceaux)
+    assert fusion.text == "".join(document.text for document in morceaux)
+    assert [page.page_number for page in fusion.pages] == [1, 2, 3]
+    assert _lignes(fusion) == attendu
+    cellules = [_get_text_anchor_content(fusion.text, page.tables[0].body_rows[0].cells[0].layout.text_anchor) for page in fusion.pages]
+    assert cellules == ["Lecture - Nathan", "Maths - Hachette", "Anglais - Oxford"]
+
+def test_fusion_ne_modifie_pas_les_morceaux():
+    morceaux = [_document(["CP"]), _document(["CE1"])]
+    fusionner_documents(morceaux)
+    assert _lignes(morceaux[1]) == [["CE1"]]
+    assert morceaux[1].pages[0].page_number == 1
+
+def test_fusion_document_unique():
+    document = _document(["CP"])
+    assert fusionner_documents([document]) is document
+
+# --- Découpage des PDF volumineux ---
+def _pdf(nb_pages, remplissage=0):
+    redacteur = PdfWriter()
+    for _ in range(nb_pages):
+        redacteur.add_blank_page(width=100, height=100)
+    if remplissage: redacteur.add_metadata({"/Subject": "x" * remplissage})
+    tampon = io.BytesIO()
+    redacteur.write(tampon)
+    return tampon.getvalue()
+
+PDF = {'mimeType': 'application/pdf'}
+
+def test_plan_petit_pdf_en_un_appel(monkeypatch):
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_MAX_PAGES", 15)
+    assert _plan_decoupage(PDF, _pdf(3)) is None
+    assert _plan_decoupage({'mimeType': 'image/png'}, b"png") is None
+    assert _plan_decoupage(PDF, b"pas un pdf") is None
+
+def test_plan_couvre_toutes_les_pages(monkeypatch):
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_MAX_PAGES", 10)
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_CHUNK_PAGES", 5)
+    contenu = _pdf(23)
+    plan = _plan_decoupage(PDF, contenu)
+    assert [(debut, fin) for debut, fin, _ in plan] == [(0, 5), (5, 10), (10, 15), (15, 20), (20, 23)]
+    assert sum(taille for _, _, taille in plan) <= len(contenu)
+
+def test_plan_limite_de_taille(monkeypatch):
+    # Sous la limite de pages mais au-dessus de la limite de taille : morceaux plus petits que OCR_SPLIT_CHUNK_PAGES.
+    contenu = _pdf(8, remplissage=3_500_000)  # ≈ 3,5 Mo : 2 pages de 0,45 Mo par morceau de 1 Mo
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_MAX_PAGES", 15)
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_CHUNK_PAGES", 5)
+    monkeypatch.setattr(doc_processor, "OCR_SPLIT_MAX_MB", 1)
+    plan = _plan_decoupage(PDF, contenu)
+    assert [(debut, fin) for debut, fin, _ in plan] == [(0, 2), (2, 4), (4, 6), (6, 8)]
@@ -0,0 +1,53 @@
+# tests/test_extraction_tableaux.py
+# Une page lue par extraire_page ne passe plus par Gemini : les colonnes, le niveau courant et le
+# rejet des tableaux peu fiables sont vérifiés sur un tableau reconstruit à partir des positions OCR.
+from types import SimpleNamespace
+from extraction_tableaux import extraire_page
+
+PAGE = SimpleNamespace(tables=[])
+
+def _lignes(rangees, confiance=1.0):
+    """position_mapping d'une page : une ligne OCR par cellule, rangées espacées verticalement."""
+    mapping = {}
+    for i, rangee in enumerate(rangees):
+        y = 0.05 + i * 0.05
+        for x, texte in rangee:
+            boite = [{'x': x, 'y': y}, {'x': x + 0.2, 'y': y}, {'x': x + 0.2, 'y': y + 0.02}, {'x': x, 'y': y + 0.02}]
+            mapping[f"E{len(mapping) + 1}"] = {'text': texte, 'bounding_box': boite, 'confidence': confiance}
+    return mapping
+
+ENTETE = [(0.05, "Matière"), (0.3, "Titre"), (0.55, "Éditeur"), (0.8, "ISBN")]
+TABLEAU = [
+    [(0.05, "CE2 :")],
+    ENTETE,
+    [(0.05, "Français"), (0.3, "Mes apprentissages en français édition 2021"), (0.55, "Hachette"), (0.8, "978-2-01-117895-4")],
+    [(0.05, "Maths"), (0.3, "Cap Maths CE2 fichier"), (0.55, "Hatier"), (0.8, "2-218-93812-3")],
+]
+
+def test_tableau_avec_niveau():
+    resultat = extraire_page(PAGE, "", _lignes(TABLEAU), confiance_min=0.8)
+    assert [n["niveau_brut"] for n in resultat["niveaux"]] == ["CE2"]
+    niveau = resultat["niveaux"][0]
+    assert niveau["niveau_source_tags"] == ["E1"]
+    francais, maths = niveau["manuels"]
+    assert francais == {"titre_livre": "Mes apprentissages en français", "matiere_livre": "Français",
+                        "maison_edition": "Hachette", "annee_edition": 2021, "code_livre": "9782011178954",
+                        "type_livre": "Manuel", "source_tags": ["E6", "E7", "E8", "E9"]}
+    assert (maths["code_livre"], maths["type_livre"], maths["annee_edition"]) == ("2218938123", "Fichier", None)
+
+def test_colonne_niveau():
+    rangees = [[(0.05, "Classe"), (0.3, "Titre"), (0.6, "Éditeur")],
+               [(0.05, "CM1"), (0.3, "Pour comprendre les maths"), (0.6, "Hachette")]]
+    resultat = extraire_page(PAGE, "", _lignes(rangees), confiance_min=0.8)
+    assert resultat["niveaux"][0]["niveau_brut"] == "CM1"
+    assert resultat["niveaux"][0]["manuels"][0]["titre_livre"] == "Pour comprendre les maths"
+
+def test_sans_en_tete_reconnu():
+    rangees = [[(0.05, "CE2")], [(0.05, "Français"), (0.3, "Mes apprentissages"), (0.55, "Hachette")]]
+    assert extraire_page(PAGE, "", _lignes(rangees), confiance_min=0.8) is None
+
+def test_sans_niveau():
+    assert extraire_page(PAGE, "", _lignes(TABLEAU[1:]), confiance_min=0.8) is None
+
+def test_ocr_peu_fiable():
+    assert extraire_page(PAGE, "", _lignes(TABLEAU, confiance=0.5), confiance_min=0.8) is None
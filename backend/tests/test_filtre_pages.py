@@ -0,0 +1,32 @@
+# tests/test_filtre_pages.py
+# Une page écartée à tort perd tous ses manuels : les cas limites du score (fourniture contre
+# matière, fourniture contre indice de livre) et le repli « aucune page écartée » sont fixés ici.
+import filtre_pages
+from filtre_pages import EDITEURS_DE_BASE, _motif, pages_sans_livres, score_page
+
+EDITEURS = _motif(EDITEURS_DE_BASE)
+
+def test_ligne_de_manuel():
+    score, raisons = score_page("[E3] Mathématiques CE2 - Hachette - ISBN 978-2-01-117895-4", EDITEURS)
+    assert raisons == {"isbn": 1, "editeur": 1, "matiere": 1}
+    assert score == 6
+
+def test_la_fourniture_l_emporte_sur_la_matiere():
+    assert score_page("[E1] Cahier de français 96 pages", EDITEURS) == (-1, {"fourniture": 1})
+
+def test_l_indice_de_livre_l_emporte_sur_la_fourniture():
+    assert score_page("[E1] Cahier d'activités Hachette", EDITEURS) == (3, {"editeur": 1, "livre": 1})
+
+def test_mots_entiers_sans_accents():
+    assert score_page("[E1] ÉDITIONS Nathan\n[E2] Règle plate 30 cm\n[E3] Bibliothèque", EDITEURS) == \
+        (2, {"editeur": 1, "livre": 1, "fourniture": 1})
+
+def test_page_de_fournitures_ecartee(monkeypatch):
+    monkeypatch.setattr(filtre_pages, "motif_editeurs", lambda db_conn: EDITEURS)
+    pages = [(1, "[E1] Français : Mes apprentissages, Hachette"), (2, "[E2] 1 trousse\n[E3] 2 stylos bleus\n[E4] 1 gomme")]
+    assert pages_sans_livres(None, {'id': 'f'}, pages, seuil=1, journaliser=False) == {2}
+
+def test_aucune_page_ecartee_si_toutes_sont_sous_le_seuil(monkeypatch):
+    monkeypatch.setattr(filtre_pages, "motif_editeurs", lambda db_conn: EDITEURS)
+    pages = [(1, "[E1] 1 trousse"), (2, "[E2] 2 stylos")]
+    assert pages_sans_livres(None, {'id': 'f'}, pages, seuil=1, journaliser=False) == set()
@@ -0,0 +1,140 @@
+# tests/test_job_queue.py
+# File de jobs partagée entre workers (job_queue.py, database.py) : la machine à états décrite en tête de
+# job_queue.py. Les tests « base » l'exécutent sur une base MySQL de test (TEST_DB_NAME, avec les DB_HOST,
+# DB_USER et DB_PASSWORD habituels ; ses tables jobs_ingestion sont vidées) et sont ignorés sans elle.
+# Les autres vérifient sans serveur la logique Python et l'ordre des affectations SQL.
+import os
+import re
+import pytest
+import config
+import database
+import job_queue
+from fausse_connexion import Connexion
+
+# --- Sans serveur ---
+def test_reservation_refusee_dans_une_transaction_ouverte():
+    conn = Connexion()
+    conn.in_transaction = True
+    with pytest.raises(RuntimeError):
+        database.claim_jobs(conn, "w1", 5, 600, 3)
+    assert conn.requetes == [] and conn.commits == 0
+
+def test_reservation_bail_expire_et_derniere_tentative():
+    conn = Connexion(lignes=[
+        {"id_fichier_drive": "a", "metadonnees_json": '{"id": "a"}', "statut": "EN_ATTENTE", "tentatives": 0},
+        {"id_fichier_drive": "b", "metadonnees_json": '{"id": "b"}', "statut": "EN_COURS", "tentatives": 2},
+        {"id_fichier_drive": "c", "metadonnees_json": '{"id": "c"}', "statut": "EN_COURS", "tentatives": 3},
+    ])
+    assert database.claim_jobs(conn, "w1", 5, 600, max_attempts=3) == [{"id": "a"}, {"id": "b"}]
+    [(_, echecs)] = conn.sql("SET statut = 'ECHEC'")
+    assert echecs == ("c",)
+    [(_, reserves)] = conn.sql("SET statut = 'EN_COURS'")
+    assert reserves == ("w1", 600, "a", "b")
+    assert (conn.commits, conn.rollbacks, conn.in_transaction) == (1, 0, False)
+
+def test_reservation_en_erreur_annulee():
+    conn = Connexion(erreurs={"FOR UPDATE SKIP LOCKED": RuntimeError("Lock wait timeout")})
+    with pytest.raises(RuntimeError):
+        database.claim_jobs(conn, "w1", 5, 600, 3)
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+
+def test_republication_affectations_dans_l_ordre():
+    """MySQL évalue ON DUPLICATE KEY UPDATE de gauche à droite : `empreinte` doit être comparée avant d'être remplacée."""
+    conn = Connexion()
+    database.enqueue_jobs(conn, [("a", "a.pdf", "md5", {"id": "a"}, 0)])
+    [(requete, _)] = conn.sql("INSERT INTO jobs_ingestion")
+    colonnes = re.findall(r"(\w+) = ", requete.split("ON DUPLICATE KEY UPDATE")[1])
+    assert colonnes[-1] == "empreinte"
+    assert colonnes.index("tentatives") < colonnes.index("statut")  # tentatives lit l'ancien statut
+
+@pytest.mark.parametrize("succes, statut", [(True, "'TERMINE'"), (False, "IF(tentatives >= %s, 'ECHEC', 'EN_ATTENTE')")])
+def test_cloture_reservee_au_detenteur_du_bail(succes, statut):
+    conn = Connexion()
+    database.complete_job(conn, "a", "w1", succes, "ERREUR_OCR", max_attempts=3, retry_delay_seconds=60)
+    [(requete, parametres)] = conn.sql("UPDATE jobs_ingestion")
+    assert f"statut = {statut}" in requete
+    assert requete.endswith("WHERE id_fichier_drive = %s AND worker = %s") and parametres[-2:] == ("a", "w1")
+    assert conn.commits == 1
+
+def test_liberation_rend_la_tentative():
+    conn = Connexion(rowcount=2)
+    assert database.release_jobs(conn, "w1") == 2
+    [(requete, parametres)] = conn.sql("UPDATE jobs_ingestion")
+    assert "tentatives = GREATEST(tentatives - 1, 0)" in requete and parametres == ("w1",)
+
+@pytest.mark.parametrize("log_status, succes", [("TRAITÉ", True), ("DOUBLON", True), ("ERREUR_OCR", False), ("ERREUR_INCONNUE", False)])
+def test_statut_final_du_job(monkeypatch, log_status, succes):
+    appels = []
+    monkeypatch.setattr(database, "complete_job", lambda conn, file_id, worker, ok, *args: appels.append((file_id, worker, ok)))
+    job_queue.terminer(None, {'id': "a", 'bail': "w1"}, log_status, "")
+    assert appels == [("a", "w1", succes)]
+
+# --- Sur une base MySQL de test ---
+@pytest.fixture
+def base():
+    nom = os.getenv("TEST_DB_NAME")
+    if not nom: pytest.skip("TEST_DB_NAME non défini : transitions non vérifiées sur MySQL")
+    connecteur = pytest.importorskip("mysql.connector")
+    conn = connecteur.connect(**dict(config.DB_CONFIG, database=nom))
+    database.use_read_committed(conn)
+    database.init_ingestion_tables(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM jobs_ingestion")
+    conn.commit()
+    cursor.close()
+    yield conn
+    conn.close()
+
+def _job(conn, file_id):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT statut, tentatives, worker FROM jobs_ingestion WHERE id_fichier_drive = %s", (file_id,))
+    ligne = cursor.fetchone()
+    cursor.close()
+    conn.commit()  # claim_jobs exige une connexion sans transaction ouverte
+    return ligne["statut"], ligne["tentatives"], ligne["worker"]
+
+def _publier(conn, empreinte="md5-1"):
+    database.enqueue_jobs(conn, [("a", "a.pdf", empreinte, {"id": "a"}, 0)])
+
+def test_base_cycle_nominal_et_republication(base):
+    _publier(base)
+    assert database.claim_jobs(base, "w1", 5, 600, 3) == [{"id": "a"}]
+    assert database.claim_jobs(base, "w2", 5, 600, 3) == []  # Bail en cours : pas de double réservation
+    database.complete_job(base, "a", "w1", True)
+    assert _job(base, "a") == ("TERMINE", 1, None)
+    _publier(base)
+    assert _job(base, "a") == ("TERMINE", 1, None)  # Même contenu : rien à refaire
+    _publier(base, "md5-2")
+    assert _job(base, "a") == ("EN_ATTENTE", 0, None)
+
+def test_base_reprise_de_bail_et_resultat_perime_ignore(base):
+    _publier(base)
+    database.claim_jobs(base, "w1", 5, -1, 3)  # Bail déjà expiré : w1 est considéré comme disparu
+    assert database.claim_jobs(base, "w2", 5, 600, 3) == [{"id": "a"}]
+    assert _job(base, "a") == ("EN_COURS", 2, "w2")
+    database.complete_job(base, "a", "w1", True)
+    assert _job(base, "a") == ("EN_COURS", 2, "w2")
+
+def test_base_echec_apres_la_derniere_tentative(base):
+    _publier(base)
+    database.claim_jobs(base, "w1", 5, -1, 2)
+    database.claim_jobs(base, "w2", 5, -1, 2)
+    assert database.claim_jobs(base, "w3", 5, 600, 2) == []
+    assert _job(base, "a") == ("ECHEC", 2, None)
+
+def test_base_reessai_puis_echec(base):
+    _publier(base)
+    database.claim_jobs(base, "w1", 5, 600, 2)
+    database.complete_job(base, "a", "w1", False, "ERREUR_OCR", max_attempts=2, retry_delay_seconds=0)
+    assert _job(base, "a") == ("EN_ATTENTE", 1, None)
+    database.claim_jobs(base, "w1", 5, 600, 2)
+    database.complete_job(base, "a", "w1", False, "ERREUR_OCR", max_attempts=2, retry_delay_seconds=0)
+    assert _job(base, "a") == ("ECHEC", 2, None)
+
+def test_base_arret_propre_sans_tentative_comptee(base):
+    _publier(base)
+    database.claim_jobs(base, "w1", 5, 600, 3)
+    assert database.release_jobs(base, "w1") == 1
+    assert _job(base, "a") == ("EN_ATTENTE", 0, None)
+    _publier(base)  # Republier un job en attente ne le remet pas à zéro ni ne le termine
+    assert _job(base, "a") == ("EN_ATTENTE", 0, None)
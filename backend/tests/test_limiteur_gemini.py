@@ -0,0 +1,98 @@
+# tests/test_limiteur_gemini.py
+# Le limiteur est partagé par tous les appels Gemini (threads, boucle asyncio, autres processus) : seaux de
+# jetons, concurrence adaptative, places rendues par les attentes annulées et débits du fichier partagé.
+import asyncio
+import time
+import pytest
+import limiteur_gemini
+from limiteur_gemini import LimiteurGemini, SUCCES_AVANT_HAUSSE
+
+@pytest.fixture
+def horloge(monkeypatch):
+    """Horloge murale figée, avancée à la main."""
+    temps = {"t": 1_000_000.0}
+    monkeypatch.setattr(limiteur_gemini.time, "time", lambda: temps["t"])
+    return temps
+
+def test_seaux_debit_et_remplissage(horloge):
+    limiteur = LimiteurGemini(rpm=60, tpm=60_000, marge=1)  # Seaux de 6 requêtes et 6 000 tokens
+    etat = {}
+    for _ in range(6):
+        assert limiteur._prendre(1000)(etat) == 0
+    assert etat["rpm"][0] == 0 and etat["tpm"][0] == 0
+    assert limiteur._prendre(1000)(etat) == pytest.approx(1.0)  # Une requête et 1 000 tokens reviennent en 1 s
+    horloge["t"] += 1
+    assert limiteur._prendre(1000)(etat) == 0
+    horloge["t"] += 60
+    limiteur._remplir(etat, horloge["t"])
+    assert etat["rpm"][0] == 6 and etat["tpm"][0] == 6000  # Jamais au-delà de la capacité
+
+def test_appel_plus_gros_que_la_rafale(horloge):
+    limiteur = LimiteurGemini(rpm=60, tpm=60_000, marge=1)
+    etat = {}
+    assert limiteur._prendre(10_000)(etat) == 0  # Seau plein : l'appel passe et le rend négatif
+    assert etat["tpm"][0] == -4000
+    assert limiteur._prendre(1)(etat) == pytest.approx(4.001)
+
+def test_pause_commune(horloge):
+    limiteur = LimiteurGemini(rpm=60, tpm=60_000, marge=1)
+    etat = {}
+    limiteur._pauser(3)(etat)
+    assert limiteur._prendre(1)(etat) == pytest.approx(3)
+
+def test_concurrence_adaptative():
+    limiteur = LimiteurGemini(rpm=1e9, tpm=1e12, concurrence_max=8, attente_max=0)
+    for attendu in (4, 2, 1, 1):
+        limiteur.acquerir(10)
+        limiteur.terminer(10, limite=True)
+        assert limiteur._limite == attendu
+    for _ in range(SUCCES_AVANT_HAUSSE - 1):
+        limiteur.acquerir(10)
+        limiteur.terminer(10)
+    assert limiteur._limite == 1
+    limiteur.acquerir(10)
+    limiteur.terminer(10)
+    assert limiteur._limite == 2
+    assert limiteur.stats["limitations"] == 4 and limiteur._en_cours == 0
+
+def test_attente_annulee_rend_sa_place():
+    limiteur = LimiteurGemini(rpm=1e9, tpm=1e12, concurrence_max=1)
+
+    async def scenario():
+        await limiteur.acquerir_async(10)
+        attente = asyncio.create_task(limiteur.acquerir_async(10))
+        await asyncio.sleep(0)
+        assert len(limiteur._attentes) == 1
+        attente.cancel()  # Annulée pendant l'attente : retirée de la file
+        with pytest.raises(asyncio.CancelledError): await attente
+        assert not limiteur._attentes and limiteur._en_cours == 1
+
+        attente = asyncio.create_task(limiteur.acquerir_async(10))
+        await asyncio.sleep(0)
+        await limiteur.terminer_async(10)  # La place est attribuée à l'attente...
+        attente.cancel()                   # ... annulée avant d'avoir repris la main
+        with pytest.raises(asyncio.CancelledError): await attente
+        for _ in range(3): await asyncio.sleep(0)
+        assert limiteur._en_cours == 0
+
+        await asyncio.wait_for(limiteur.acquerir_async(10), 1)
+        await limiteur.terminer_async(10)
+
+    asyncio.run(scenario())
+    assert limiteur._en_cours == 0
+
+@pytest.mark.skipif(limiteur_gemini.fcntl is None, reason="fichier d'état partagé : POSIX uniquement")
+def test_fichier_partage_fusionne_les_debits(tmp_path, horloge):
+    chemin = str(tmp_path / "etat.json")
+    a, b = (LimiteurGemini(rpm=60, tpm=60_000, marge=1, fichier_etat=chemin) for _ in range(2))
+    for limiteur, appels in ((a, 3), (b, 2)):
+        limiteur._etat.intervalle = 3600  # Synchronisations déclenchées à la main
+        limiteur._etat._derniere = time.monotonic()
+        for _ in range(appels):
+            assert limiteur._etat.modifier(limiteur._prendre(100)) == 0
+    for etat in (a._etat, b._etat, a._etat):
+        etat._derniere = None
+        etat.synchroniser()
+    for limiteur in (a, b):
+        assert limiteur._etat._vue["rpm"][0] == 1  # 6 - 3 - 2, vus par les deux processus
+        assert limiteur._etat._vue["tpm"][0] == 5500
@@ -0,0 +1,137 @@
+# tests/test_resolveur_standardisation.py
+# Le Resolveur apprend ses correspondances approchées sans validation humaine : une erreur ici
+# devient une règle de standardisation fausse. Ces tests fixent ce qu'il doit résoudre, et surtout
+# ce qu'il doit laisser à Gemini.
+import pytest
+import database
+import resolveur_standardisation
+from resolveur_standardisation import Resolveur, cle_normalisee, mots_compatibles
+
+BASE = [
+    {"valeur_brute": "2ème Bac Sciences Maths A", "nom_standardise": "2e Bac SM A"},
+    {"valeur_brute": "2ème Bac Sciences Physiques", "nom_standardise": "2e Bac PC"},
+    {"valeur_brute": "1ère année collège", "nom_standardise": "1AC"},
+    {"valeur_brute": "3ème année primaire", "nom_standardise": "3AP"},
+    {"valeur_brute": "Groupe Scolaire Al Amal", "nom_standardise": "GS Al Amal"},
+]
+
+@pytest.fixture
+def resolveur():
+    return Resolveur(BASE, seuil=0.85)
+
+@pytest.mark.parametrize("texte, attendu", [
+    ("3ème année", "3e annee"),
+    ("3eme Année", "3e annee"),
+    ("3e année", "3e annee"),
+    ("Troisième année", "3e annee"),
+    ("1ère  année, collège", "1e annee college"),
+    ("2°  Bac", "2e bac"),
+])
+def test_cle_normalisee(texte, attendu):
+    assert cle_normalisee(texte) == attendu
+
+def test_correspondance_exacte(resolveur):
+    assert resolveur.resoudre("1ère année collège") == ("1AC", 1.0, "exact")
+
+def test_correspondance_normalisee(resolveur):
+    assert resolveur.resoudre("1ERE ANNEE COLLEGE") == ("1AC", 1.0, "normalised")
+    assert resolveur.resoudre("troisième année primaire") == ("3AP", 1.0, "normalised")
+
+def test_le_nom_standardise_est_une_forme_connue(resolveur):
+    assert resolveur.resoudre("gs al amal")[0] == "GS Al Amal"
+
+@pytest.mark.parametrize("valeur, attendu", [
+    ("Groupe Scolair Al Amal", "GS Al Amal"),
+    ("1ère anné collège", "1AC"),
+    ("2eme bac science math A", "2e Bac SM A"),
+])
+def test_variantes_orthographiques(resolveur, valeur, attendu):
+    nom, score, methode = resolveur.resoudre(valeur)
+    assert (nom, methode) == (attendu, "fuzzy")
+    assert score >= 0.85
+
+@pytest.mark.parametrize("valeur", [
+    "4ème année primaire",            # autre nombre
+    "2ème Bac Sciences Maths B",      # autre lettre de section
+    "2ème Bac Sciences Maths",        # lettre de section absente
+    "2ème Bac SVT",                   # autre filière
+    "Groupe Scolaire Al Amal 2",      # nombre ajouté
+])
+def test_presque_identiques_laisses_a_gemini(resolveur, valeur):
+    assert resolveur.resoudre(valeur)[0] is None
+
+def test_cle_ambigue_laissee_a_gemini():
+    resolveur = Resolveur([{"valeur_brute": "CE 1", "nom_standardise": "CE1"},
+                           {"valeur_brute": "ce-1", "nom_standardise": "Cours élémentaire 1"}])
+    assert resolveur.resoudre("CE 1") == ("CE1", 1.0, "exact")
+    assert resolveur.resoudre("ce 1 ") == (None, 0.0, None)
+
+def test_sous_le_seuil():
+    assert Resolveur(BASE, seuil=0.99).resoudre("Groupe Scolair Al Amal")[0] is None
+
+def test_mots_compatibles():
+    assert mots_compatibles("2e bac sciences maths a", "2e bac science math a")
+    assert mots_compatibles("1e annee du college", "1e annee college")
+    assert not mots_compatibles("2e bac sciences maths a", "2e bac sciences maths b")
+    assert not mots_compatibles("2e bac sm", "2e bac pc")
+
+# --- Cache des bases de connaissances (charger) ---
+class FausseBase:
+    """Tables de standardisation et versions_standardisation, avec le décompte des lectures."""
+    def __init__(self, versions):
+        self.versions, self.regles = versions, list(BASE)
+        self.lectures_versions = self.lectures_regles = 0
+
+    def get_standardisation_versions(self, conn):
+        self.lectures_versions += 1
+        return None if self.versions is None else dict(self.versions)
+
+    def get_standardisation_knowledge_base(self, conn, entity_type):
+        self.lectures_regles += 1
+        return list(self.regles)
+
+@pytest.fixture
+def fausse_base(monkeypatch):
+    def creer(versions):
+        base = FausseBase(versions)
+        monkeypatch.setattr(database, "get_standardisation_versions", base.get_standardisation_versions)
+        monkeypatch.setattr(database, "get_standardisation_knowledge_base", base.get_standardisation_knowledge_base)
+        return base
+    monkeypatch.setattr(resolveur_standardisation, "_bases", {})
+    monkeypatch.setattr(resolveur_standardisation, "_versions", {"valeurs": None, "date": None})
+    monkeypatch.setattr(resolveur_standardisation, "STANDARDISATION_VERSION_CHECK_SECONDS", 3600)
+    return creer
+
+def _verifier_les_versions():
+    resolveur_standardisation._versions["date"] = None  # Intervalle de vérification écoulé
+
+def test_base_relue_seulement_si_sa_version_change(fausse_base):
+    base = fausse_base({"standardisation_niveaux": 1})
+    premiere = resolveur_standardisation.charger(None, "niveaux")
+    assert resolveur_standardisation.charger(None, "niveaux") is premiere
+    _verifier_les_versions()
+    assert resolveur_standardisation.charger(None, "niveaux") is premiere
+    assert (base.lectures_versions, base.lectures_regles) == (2, 1)
+    base.versions["standardisation_niveaux"] = 2
+    base.regles.append({"valeur_brute": "Tronc commun sciences", "nom_standardise": "TC Sciences"})
+    assert resolveur_standardisation.charger(None, "niveaux").version == 1  # Pas encore revérifiée
+    _verifier_les_versions()
+    relue = resolveur_standardisation.charger(None, "niveaux")
+    assert relue.version == 2 and "TC Sciences" in relue.choix
+    assert base.lectures_regles == 2
+
+def test_version_d_un_autre_type_sans_effet(fausse_base):
+    base = fausse_base({"standardisation_niveaux": 1, "standardisation_ecoles": 1})
+    niveaux = resolveur_standardisation.charger(None, "niveaux")
+    base.versions["standardisation_ecoles"] = 2
+    _verifier_les_versions()
+    assert resolveur_standardisation.charger(None, "niveaux") is niveaux
+
+def test_versions_illisibles_empreinte_du_contenu(fausse_base):
+    base = fausse_base(None)
+    premiere = resolveur_standardisation.charger(None, "niveaux")
+    assert premiere.version.startswith("contenu:")
+    assert resolveur_standardisation.charger(None, "niveaux") is premiere  # Relue, mais Resolveur conservé
+    assert base.lectures_regles == 2
+    base.regles.append({"valeur_brute": "Tronc commun sciences", "nom_standardise": "TC Sciences"})
+    assert "TC Sciences" in resolveur_standardisation.charger(None, "niveaux").choix
@@ -0,0 +1,65 @@
+# tests/test_spool.py
+# Fichiers de spool (empreinte au fil de l'écriture, taille maximale, suppression) et contrôle
+# d'admission en octets des appels OCR.
+import hashlib
+import os
+import threading
+import pytest
+from spool import ControleAdmission, FichierSpool, TailleDepassee, liberer
+
+def test_contenu_et_empreinte():
+    spool = FichierSpool()
+    for morceau in (b"abc", b"def", b"ghi"):
+        spool.write(morceau)
+    spool.terminer()
+    assert spool.lire() == b"abcdefghi"
+    assert (len(spool), spool.md5) == (9, hashlib.md5(b"abcdefghi").hexdigest())
+    liberer(spool)
+    assert not os.path.exists(spool.chemin)
+
+def test_taille_maximale():
+    spool = FichierSpool(taille_max=5)
+    spool.write(b"abcde")
+    with pytest.raises(TailleDepassee):
+        spool.write(b"f")
+    spool.fermer()
+    assert not os.path.exists(spool.chemin)
+
+def test_liberer_des_octets():
+    liberer(b"octets")
+    liberer(None)
+
+def test_admission_bornee():
+    controle = ControleAdmission(100)
+    controle.acquerir(60)
+    admis = threading.Event()
+    def second():
+        controle.acquerir(60)
+        admis.set()
+    threading.Thread(target=second, daemon=True).start()
+    assert not admis.wait(0.2)
+    controle.liberer(60)
+    assert admis.wait(2)
+
+def test_contenu_plus_gros_que_la_limite_passe_seul():
+    controle = ControleAdmission(100)
+    controle.acquerir(500)
+    controle.liberer(500)
+    controle.acquerir(50)
+    assert controle._en_cours == 50
+
+def test_purge_des_orphelins(tmp_path, monkeypatch):
+    import spool
+    for nom in ("drive-ancien", "drive-recent", "autre"):
+        (tmp_path / nom).write_bytes(b"x")
+    os.utime(tmp_path / "drive-ancien", (0, 0))
+    os.utime(tmp_path / "autre", (0, 0))
+    monkeypatch.setattr(spool, "DOWNLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(spool, "_purge_faite", False)
+    lister = os.listdir
+    # Un autre processus supprime « drive-disparu » entre le listing et sa lecture.
+    monkeypatch.setattr(spool.os, "listdir", lambda dossier: ["drive-disparu"] + lister(dossier))
+    threads = [threading.Thread(target=spool._purger_orphelins) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert sorted(lister(tmp_path)) == ["autre", "drive-recent"]
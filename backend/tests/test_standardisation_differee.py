@@ -0,0 +1,79 @@
+# tests/test_standardisation_differee.py
+# La standardisation différée corrige la base après coup : elle ne doit toucher que les entités
+# provisoires notées pour un terme en attente, jamais une autre entité portant le même nom brut,
+# et laisser en attente les termes que l'appel groupé n'a pas traités.
+import pytest
+import ai_processor
+import database
+import resolveur_standardisation
+import standardisation_differee
+from fausse_connexion import Connexion
+
+# --- database.merge_standardised_entity ---
+def test_fusion_des_seules_entites_notees_dans_l_entite_standard():
+    conn = Connexion(lignes={"AND nom_niveau = %s AND statut = 'À_VÉRIFIER'": [(12,)], "WHERE nom_niveau = %s": [(7,)]})
+    verrous = []
+    assert database.merge_standardised_entity(conn, "niveaux", "2eme bac pc", [12, 15], "2e Bac PC", verrous) == 1
+    [(_, parametres)] = conn.sql("statut = 'À_VÉRIFIER'")
+    assert parametres == (12, 15, "2eme bac pc")  # 15 a déjà été renommée par ailleurs : elle n'est pas revenue
+    assert conn.sql("UPDATE niveaux") == []
+    assert conn.sql("UPDATE manuels SET id_niveau")[0][1] == (7, 12)
+    assert conn.sql("UPDATE source_locations")[0][1] == (7, "niveau", 12)
+    assert conn.sql("DELETE FROM niveaux") == [("DELETE FROM niveaux WHERE id_niveau = %s", (12,))]
+    assert len(verrous) == 2 and conn.commits == 0  # Transaction et verrous restent à l'appelant
+
+def test_premiere_entite_notee_renommee_sans_entite_standard():
+    conn = Connexion(lignes={"statut = 'À_VÉRIFIER'": [(12,), (15,)]})
+    assert database.merge_standardised_entity(conn, "ecoles", "gs al amal", [12, 15], "GS Al Amal", []) == 2
+    assert conn.sql("UPDATE ecoles")[0][1] == ("GS Al Amal", 12)
+    assert conn.sql("DELETE FROM ecoles") == [("DELETE FROM ecoles WHERE id_ecole = %s", (15,))]
+
+def test_aucune_entite_notee_encore_provisoire():
+    conn = Connexion(lignes={"WHERE nom_ecole = %s": [(7,)]})
+    assert database.merge_standardised_entity(conn, "ecoles", "gs al amal", [12], "GS Al Amal", []) == 0
+    assert conn.sql("UPDATE") == [] and conn.sql("DELETE") == []
+
+# --- standardisation_differee._resoudre_type ---
+class Journal:
+    """database.* appelées par _resoudre_type, avec leurs arguments."""
+    def __init__(self, monkeypatch, en_attente, resultats, erreur=None):
+        self.fusions, self.appris, self.supprimes, self.liberes = [], None, None, []
+        monkeypatch.setattr(database, "get_pending_standardisations", lambda conn, entity_type: dict(en_attente))
+        monkeypatch.setattr(resolveur_standardisation, "charger", lambda conn, entity_type: None)
+        monkeypatch.setattr(ai_processor, "standardiser_lot", lambda base, termes: dict(resultats))
+        def fusionner(conn, entity_type, brute, ids, nom, verrous):
+            if erreur: raise erreur
+            self.fusions.append((brute, ids, nom))
+            verrous.append(f"verrou:{brute}")
+            return len(ids)
+        monkeypatch.setattr(database, "merge_standardised_entity", fusionner)
+        monkeypatch.setattr(database, "learn_new_standardisations",
+                            lambda conn, entity_type, paires, commit: setattr(self, "appris", (paires, commit)))
+        monkeypatch.setattr(database, "delete_pending_standardisations",
+                            lambda conn, entity_type, valeurs, commit: setattr(self, "supprimes", (valeurs, commit)))
+        monkeypatch.setattr(database, "release_named_locks", lambda conn, verrous: self.liberes.extend(verrous))
+
+def test_resolution_groupee(monkeypatch):
+    en_attente = {"2eme bac pc": [12], "tc sciences": [20], "1ac": [30], "xyz": [40]}
+    resultats = {"2eme bac pc": ("2e Bac PC", True), "tc sciences": (None, True), "1ac": ("1AC", False)}
+    journal = Journal(monkeypatch, en_attente, resultats)
+    conn = Connexion()
+    assert standardisation_differee._resoudre_type(conn, "niveaux") == 3
+    assert journal.fusions == [("2eme bac pc", [12], "2e Bac PC"), ("1ac", [30], "1AC")]
+    assert journal.appris == ([("2eme bac pc", "2e Bac PC"), ("tc sciences", "tc sciences")], False)
+    assert journal.supprimes == (["2eme bac pc", "tc sciences", "1ac"], False)  # "xyz" : lot en échec, reste en attente
+    assert (conn.commits, conn.rollbacks) == (1, 0)
+    assert journal.liberes == ["verrou:2eme bac pc", "verrou:1ac"]
+
+def test_erreur_de_fusion_annule_tout(monkeypatch):
+    journal = Journal(monkeypatch, {"2eme bac pc": [12]}, {"2eme bac pc": ("2e Bac PC", True)}, erreur=RuntimeError("Deadlock"))
+    conn = Connexion()
+    with pytest.raises(RuntimeError):
+        standardisation_differee._resoudre_type(conn, "niveaux")
+    assert (conn.commits, conn.rollbacks) == (0, 1)
+    assert journal.appris is None and journal.supprimes is None
+
+def test_rien_en_attente(monkeypatch):
+    Journal(monkeypatch, {}, {})
+    monkeypatch.setattr(ai_processor, "standardiser_lot", lambda base, termes: pytest.fail("appel Gemini inutile"))
+    assert standardisation_differee._resoudre_type(Connexion(), "ecoles") == 0
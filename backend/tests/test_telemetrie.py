@@ -0,0 +1,50 @@
+# tests/test_telemetrie.py
+# Agrégats de l'API d'administration (percentiles, coût par page) et imputation des appels Gemini
+# au fichier dont l'étape est en cours.
+import pytest
+import telemetrie
+from telemetrie import _percentile, agreger, enregistrer_appel_llm, mesurer
+
+@pytest.mark.parametrize("valeurs, p, attendu", [
+    ([], 50, None),
+    ([7], 95, 7),
+    (list(range(1, 21)), 50, 10),
+    (list(range(1, 21)), 95, 19),
+    ([30, 10, 20], 50, 20),
+    ([30, 10, 20], 95, 30),
+])
+def test_percentile_rang_le_plus_proche(valeurs, p, attendu):
+    assert _percentile(valeurs, p) == attendu
+
+def test_agreger(monkeypatch):
+    monkeypatch.setattr(telemetrie, "GEMINI_PRICE_INPUT_PER_MTOK", 1.0)
+    monkeypatch.setattr(telemetrie, "GEMINI_PRICE_OUTPUT_PER_MTOK", 2.0)
+    monkeypatch.setattr(telemetrie, "DOCAI_PRICE_PER_PAGE", 0.01)
+    lignes = [
+        {"statut": "SUCCESS", "ocr_ms": 100, "total_ms": 1000, "ocr_pages": 4, "ocr_cache": 0,
+         "llm_appels": 2, "llm_tokens_entree": 1_000_000, "llm_tokens_sortie": 500_000},
+        {"statut": "SUCCESS", "ocr_ms": 300, "total_ms": 2000, "ocr_pages": 6, "ocr_cache": 1, "llm_appels_cache": 2},
+        {"statut": "FAILED", "ocr_ms": None, "total_ms": 50},
+    ]
+    resume = agreger(lignes)
+    assert resume["files"] == 3
+    assert resume["statuses"] == {"SUCCESS": 2, "FAILED": 1}
+    assert resume["stages"]["ocr"] == {"count": 2, "p50_ms": 100, "p95_ms": 300}
+    assert resume["stages"]["bdd"] == {"count": 0, "p50_ms": None, "p95_ms": None}
+    assert resume["pages"] == 10
+    assert (resume["llm"]["calls"], resume["llm"]["cached_calls"]) == (2, 2)
+    # Les pages lues dans le cache OCR ne sont pas facturées.
+    assert resume["estimated_cost"] == {"llm": 2.0, "ocr": 0.04, "total": 2.04, "per_page": 0.204}
+
+def test_appels_imputes_a_l_etape_en_cours():
+    resultat = {"cached": False, "attempts": 3, "latency_ms": 120, "usage": {"prompt_tokens": 10, "output_tokens": 5}}
+    fichier = {}
+    enregistrer_appel_llm(resultat)  # Hors étape mesurée : sans effet
+    with mesurer(fichier, "analyse"):
+        enregistrer_appel_llm(resultat)
+        enregistrer_appel_llm({"cached": True})
+    valeurs = fichier['_metriques'].valeurs
+    assert {cle: valeurs[cle] for cle in ("llm_appels", "llm_appels_cache", "llm_reessais", "llm_ms",
+                                          "llm_tokens_entree", "llm_tokens_sortie")} == \
+        {"llm_appels": 1, "llm_appels_cache": 1, "llm_reessais": 2, "llm_ms": 120, "llm_tokens_entree": 10, "llm_tokens_sortie": 5}
+    assert "analyse_ms" in valeurs